@@ -0,0 +1,97 @@
+from .models import BlogEntry, BlogComment, Friendship
+
+# Reasons returned by the *_denial() methods
+JOURNAL = 'journal'
+LOGIN_REQUIRED = 'login_required'
+NOT_FRIENDS = 'not_friends'
+
+
+class EntryAccess:
+    """
+    Resolves what the current user may do with blog entries and comments.
+
+    One instance is attached to each request (see for_request()). An entry is
+    loaded together with its author in a single query and kept for the rest of
+    the request. Whether the user follows the author is read from the database
+    (one unique index lookup per author, also kept for the request), never
+    from the cached follow graph, so an unfollow takes effect at once in
+    every process.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._entries = {}
+        self._follows = {}
+
+    @classmethod
+    def for_request(cls, request):
+        access = getattr(request, '_entry_access', None)
+        if access is None:
+            access = cls(request.user)
+            request._entry_access = access
+        return access
+
+    def get_entry(self, blog_entry_id):
+        """Load a blog entry for permission checks. Raises BlogEntry.DoesNotExist."""
+        blog_entry_id = int(blog_entry_id)
+        if blog_entry_id not in self._entries:
+            self._entries[blog_entry_id] = BlogEntry.objects.select_related('author').defer('search_vector').get(id=blog_entry_id)
+        return self._entries[blog_entry_id]
+
+    def get_comment(self, comment_id, **filters):
+        """Load a comment along with its blog entry. Raises BlogComment.DoesNotExist."""
+        comment = BlogComment.objects.select_related('author', 'blog_entry__author').defer('blog_entry__search_vector').get(id=comment_id, **filters)
+        self._entries[comment.blog_entry_id] = comment.blog_entry
+        return comment
+
+    def follows_author(self, blog_entry):
+        if not self.user.is_authenticated:
+            return False
+        author_id = blog_entry.author_id
+        if author_id not in self._follows:
+            self._follows[author_id] = Friendship.objects.filter(follower_id=self.user.id, user_id=author_id).exists()
+        return self._follows[author_id]
+
+    def is_author(self, blog_entry):
+        return self.user.is_authenticated and blog_entry.author_id == self.user.id
+
+    def viewer_class(self, blog_entry):
+        """How the user relates to the entry's author, part of the ETags of entry responses."""
+        if not self.user.is_authenticated:
+            return 'anonymous'
+        if self.is_author(blog_entry):
+            return 'author'
+        if self.follows_author(blog_entry):
+            return 'follower'
+        return 'user'
+
+    def view_denial(self, blog_entry):
+        """Why the user may not see the entry, or None if they may."""
+        if self.is_author(blog_entry):
+            return None
+        if blog_entry.visibility == 'journal':
+            return JOURNAL
+        if blog_entry.visibility == 'friends':
+            if not self.user.is_authenticated:
+                return LOGIN_REQUIRED
+            if not self.follows_author(blog_entry):
+                return NOT_FRIENDS
+        return None
+
+    def comment_denial(self, blog_entry):
+        # Journal entries are private notes, nobody comments on them
+        if blog_entry.visibility == 'journal':
+            return JOURNAL
+        return self.view_denial(blog_entry)
+
+    def like_denial(self, blog_entry):
+        return self.view_denial(blog_entry)
+
+    def can_view(self, blog_entry):
+        return self.view_denial(blog_entry) is None
+
+    def can_comment(self, blog_entry):
+        return self.comment_denial(blog_entry) is None
+
+    def can_like(self, blog_entry):
+        return self.like_denial(blog_entry) is None
@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.models.signals import post_delete, post_save
+
+        from . import search, user_cache
+        from .models import BlogEntry
+
+        # Saved, renamed, deactivated or deleted users must not be served from the cache
+        post_save.connect(user_cache.user_changed, sender=User, dispatch_uid='api.user_cache.saved')
+        post_delete.connect(user_cache.user_changed, sender=User, dispatch_uid='api.user_cache.deleted')
+
+        # Keep the search backend (the in-process index) in step with every entry write
+        post_save.connect(search.blog_entry_saved, sender=BlogEntry, dispatch_uid='api.search.saved')
+        post_delete.connect(search.blog_entry_deleted, sender=BlogEntry, dispatch_uid='api.search.deleted')
@@ -2,9 +2,11 @@ from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.models import AnonymousUser, User
 from rest_framework_simplejwt.tokens import AccessToken
 from django.utils.translation import gettext_lazy as _
+from . import passwords, token_cache, user_cache
 
 class CookieJWTAuthentication(BaseAuthentication):
     def authenticate(self, request):
@@ -16,15 +18,45 @@ class CookieJWTAuthentication(BaseAuthentication):
             return None
             
         try:
-            # If token exists, return the user and the token
-            validated_token = AccessToken(jwt_token)
+            # If token exists, return the user and the token; tokens seen
+            # before in this process are not verified again until they expire
+            validated_token = token_cache.access_token(jwt_token)
             user_id = validated_token.get('user_id')
             if user_id is None:
                 return None
-            user = User.objects.get(id=user_id)
+            # Cached per process for a short while, saving a query per request
+            user = user_cache.get_user(user_id)
+            if not user.is_active:
+                return None
             return (user, validated_token)
         except Exception as e:
             return None
 
     def authenticate_header(self, request):
         return 'Bearer'
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that verifies passwords on the hash pool (api.passwords)
+    instead of in the web worker. Raises HashPoolBusy when the pool is full.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway so unknown usernames take as long as wrong passwords
+            passwords.hash_password(password)
+            return None
+        if not passwords.check_password(password, user.password) or not self.user_can_authenticate(user):
+            return None
+        if passwords.must_update(user.password):
+            # Rehash with the current algorithm and iterations, as Django does on login
+            user.password = passwords.hash_password(password)
+            user.save(update_fields=['password'])
+        return user
@@ -0,0 +1,425 @@
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageOps, ImageSequence, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+AVATAR_DIR = 'avatars'
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+CHUNK_SIZE = 64 * 1024
+
+# Square variants made from every upload. Clients are linked to these; the
+# original is only served while they are being made.
+SMALL = 48  # blog cards and autocomplete
+MEDIUM = 128  # user search results
+LARGE = 512  # profile pages
+VARIANT_SIZES = (SMALL, MEDIUM, LARGE)
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+VARIANT_QUALITY = 80
+
+# Larger images are refused before their pixels are decoded. The pixel limit
+# covers all frames of an animated image, as they are all decoded to strip
+# their metadata; it bounds the memory one upload takes
+MAX_PIXELS = 40_000_000
+MAX_FRAMES = 500
+
+# Originals are stored re-encoded in their own format, keeping only these
+# entries of the image info; EXIF (GPS coordinates, camera serial numbers),
+# XMP and comments are dropped
+ORIGINAL_INFO = ('transparency', 'background', 'duration', 'loop', 'icc_profile')
+ORIGINAL_OPTIONS = {
+    'JPEG': {'quality': 90},
+    'WEBP': {'quality': 90},
+}
+
+# Files of an unused picture are only deleted once nobody has stored the same
+# picture for this many seconds, so an identical upload that is still being
+# saved keeps them (see delete_if_unused())
+DELETE_GRACE = 10 * 60
+
+# Served under one URL forever, so browsers and proxies may keep them for a year
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+}
+
+
+def extension_for(content_type):
+    return EXTENSIONS.get(content_type) or (mimetypes.guess_extension(content_type or '') or '.bin').lstrip('.')
+
+
+def content_type_for(extension):
+    for content_type, known_extension in EXTENSIONS.items():
+        if known_extension == extension:
+            return content_type
+    return mimetypes.guess_type(f'avatar.{extension}')[0] or 'application/octet-stream'
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def max_upload_size():
+    return getattr(settings, 'AVATAR_MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+
+
+def avatar_name(avatar_hash, extension, size=None):
+    """Storage path of an image or one of its variants, fanned out over subdirectories by hash prefix."""
+    suffix = f'_{size}' if size else ''
+    return f'{AVATAR_DIR}/{avatar_hash[:2]}/{avatar_hash[2:4]}/{avatar_hash}{suffix}.{extension}'
+
+
+def avatar_url(avatar_hash, size):
+    """URL of the `size` variant of a picture, one of VARIANT_SIZES."""
+    if not avatar_hash:
+        return None
+    return reverse('avatar-variant', kwargs={'avatar_hash': avatar_hash, 'size': size, 'extension': VARIANT_EXTENSION})
+
+
+def original_url(avatar_hash, content_type):
+    return reverse('avatar', kwargs={'avatar_hash': avatar_hash, 'extension': extension_for(content_type)})
+
+
+def check_image(file):
+    """
+    Make sure `file` is a complete image in one of the EXTENSIONS formats and
+    no larger than MAX_PIXELS over all its frames (and no more than
+    MAX_FRAMES of them), and return its content type. Only the headers are
+    read for the size check. Raises InvalidImage.
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            content_type = Image.MIME.get(image.format)
+            if content_type not in EXTENSIONS:
+                raise InvalidImage(f'Unsupported image format: {image.format}')
+            width, height = image.size
+            frames = getattr(image, 'n_frames', 1)
+            if frames > MAX_FRAMES:
+                raise InvalidImage(f'Image has too many frames: {frames}')
+            if width * height * frames > MAX_PIXELS:
+                if frames > 1:
+                    raise InvalidImage(f'Image is too large: {frames} frames of {width}x{height}')
+                raise InvalidImage(f'Image is too large: {width}x{height}')
+            image.seek(0)
+            image.verify()
+    except UnidentifiedImageError as e:
+        raise InvalidImage('Unrecognized image file') from e
+    except Image.DecompressionBombError as e:
+        raise InvalidImage('Image is too large') from e
+    except (OSError, SyntaxError) as e:
+        raise InvalidImage(f'Damaged image file: {e}') from e
+    finally:
+        file.seek(0)
+    return content_type
+
+
+def strip_metadata(file):
+    """
+    Re-encode a checked image (see check_image) without its metadata and return
+    it as a temporary file. Still images are turned upright according to
+    their EXIF orientation first; animated ones keep every frame, which
+    check_image() has limited to MAX_PIXELS in total.
+    """
+    clean = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+    file.seek(0)
+    with Image.open(file) as image:
+        image_format = image.format
+        info = {key: image.info[key] for key in ORIGINAL_INFO if key in image.info}
+        options = dict(info, **ORIGINAL_OPTIONS.get(image_format, {}))
+        if getattr(image, 'n_frames', 1) == 1:
+            # Decoded once and, if need be, turned in place: no extra copy
+            image.load()
+            ImageOps.exif_transpose(image, in_place=True)
+            image.info = {key: value for key, value in info.items() if key != 'duration'}
+            image.save(clean, image_format, **options)
+        else:
+            frames, durations = [], []
+            for frame in ImageSequence.Iterator(image):
+                durations.append(frame.info.get('duration') or info.get('duration', 100))
+                frame = frame.copy()
+                frame.info = {key: value for key, value in info.items() if key != 'duration'}
+                frames.append(frame)
+            frames[0].save(
+                clean, image_format, save_all=True, append_images=frames[1:],
+                **dict(options, duration=durations),
+            )
+    file.seek(0)
+    clean.seek(0)
+    return clean
+
+
+def save_avatar(file, content_type):
+    """
+    Store an image under the SHA-256 of its content and return the hash.
+
+    `file` is read in chunks, so uploads spooled to disk are never loaded
+    whole. Identical images are stored once.
+    """
+    if isinstance(file, bytes):
+        file = ContentFile(file)
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    avatar_hash = digest.hexdigest()
+
+    name = avatar_name(avatar_hash, extension_for(content_type))
+    if not default_storage.exists(name):
+        file.seek(0)
+        default_storage.save(name, File(file))
+    else:
+        _touch(name)
+    return avatar_hash
+
+
+def _touch(name):
+    """Mark a stored file as just stored again, which holds off delete_if_unused()."""
+    try:
+        os.utime(default_storage.path(name))
+    except (NotImplementedError, FileNotFoundError):
+        pass
+
+
+def _restore(name, file):
+    """Write `file` back if the picture was deleted before the upload using it committed."""
+    try:
+        if not default_storage.exists(name):
+            file.seek(0)
+            default_storage.save(name, File(file))
+            logger.warning("Restored avatar deleted during upload", extra={'avatar_name': name})
+    finally:
+        file.close()
+
+
+def store_upload(file, content_type=None):
+    """
+    Check an uploaded picture, store it without metadata and queue its
+    variants for when the current transaction commits. Returns (hash, content
+    type), the content type being read from the image rather than trusted
+    from the client. Call it inside the transaction that saves the hash.
+    """
+    if isinstance(file, bytes):
+        file = ContentFile(file)
+    content_type = check_image(file)
+    clean = strip_metadata(file)
+    try:
+        avatar_hash = save_avatar(clean, content_type)
+    except BaseException:
+        clean.close()
+        raise
+    # Kept until the commit in case the same picture, already stored, is deleted meanwhile
+    name = avatar_name(avatar_hash, extension_for(content_type))
+    transaction.on_commit(lambda: _restore(name, clean))
+    transaction.on_commit(lambda: make_variants_in_background(avatar_hash, content_type))
+    return avatar_hash, content_type
+
+
+class AvatarUploadHandler(TemporaryFileUploadHandler):
+    """
+    Upload handler for multipart picture uploads: the file always goes to a
+    temporary file, CHUNK_SIZE at a time, and reading stops as soon as more
+    than max_upload_size() bytes have arrived, setting `too_large`.
+    """
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+        self.too_large = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_upload_size():
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def receive_raw_upload(stream, content_length):
+    """
+    Copy a raw request body of `content_length` bytes to a temporary file,
+    CHUNK_SIZE at a time, and return the file. Raises UploadTooLarge before
+    reading anything when the declared length is over max_upload_size().
+    """
+    if content_length > max_upload_size():
+        raise UploadTooLarge(f'Uploads are limited to {max_upload_size()} bytes')
+    upload = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+    remaining = content_length
+    while remaining:
+        chunk = stream.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        upload.write(chunk)
+        remaining -= len(chunk)
+    upload.seek(0)
+    return upload
+
+
+def find_original(avatar_hash):
+    """Storage name of the original of a picture, whatever its format, or None."""
+    for extension in EXTENSIONS.values():
+        name = avatar_name(avatar_hash, extension)
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+def stored_names(avatar_hash):
+    """Storage names of every file kept for a picture that exist: its original and its variants."""
+    names = [avatar_name(avatar_hash, extension) for extension in EXTENSIONS.values()]
+    names += [avatar_name(avatar_hash, VARIANT_EXTENSION, size) for size in VARIANT_SIZES]
+    return [name for name in names if default_storage.exists(name)]
+
+
+def delete_if_unused(avatar_hash):
+    """
+    Delete the files of a picture no profile uses any more. Pictures are
+    stored once per content, so another profile may still use the same one.
+    Returns the number of files deleted.
+
+    An upload of the same picture that is not committed yet does not show in
+    the profiles, but it has touched the original (see save_avatar()), so
+    files stored in the last DELETE_GRACE seconds are kept. That is checked
+    after the profiles; should an upload still slip in between, it writes the
+    picture back after its commit. purge_unused_avatars deletes kept files
+    later.
+    """
+    from .models import UserProfile
+
+    if not avatar_hash or not HASH_RE.match(avatar_hash):
+        return 0
+    if UserProfile.objects.filter(avatar_hash=avatar_hash).exists():
+        return 0
+    names = stored_names(avatar_hash)
+    recent = timezone.now() - timedelta(seconds=DELETE_GRACE)
+    if any(default_storage.get_modified_time(name) > recent for name in names):
+        return 0
+    for name in names:
+        default_storage.delete(name)
+    if names:
+        logger.info("Deleted unused avatar", extra={'avatar_hash': avatar_hash, 'files': len(names)})
+    return len(names)
+
+
+def replaced(old_hash, new_hash):
+    """
+    Called when a profile's picture changes from `old_hash` to `new_hash`
+    (None when removed): the old picture's files are deleted once the current
+    transaction commits, unless another profile uses it or it was stored
+    lately (see delete_if_unused()).
+    """
+    if old_hash and old_hash != new_hash:
+        transaction.on_commit(lambda: delete_if_unused(old_hash))
+
+
+def make_variants(avatar_hash, content_type):
+    """
+    Write the VARIANT_SIZES variants of a stored picture: turned upright
+    according to its EXIF orientation, cropped to a square around the centre,
+    scaled down (never up) and saved as WebP with no metadata. Animated images
+    keep their first frame. Variants that already exist are left alone.
+    """
+    names = {size: avatar_name(avatar_hash, VARIANT_EXTENSION, size) for size in VARIANT_SIZES}
+    missing = [size for size, name in names.items() if not default_storage.exists(name)]
+    if not missing:
+        return
+
+    with default_storage.open(avatar_name(avatar_hash, extension_for(content_type)), 'rb') as f:
+        with Image.open(f) as image:
+            # JPEGs are decoded straight at the smallest scale still covering
+            # the largest variant, so a huge photo never sits in memory whole
+            image.draft('RGB', (LARGE, LARGE))
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    for size in sorted(missing, reverse=True):
+        side = min(size, image.width, image.height)
+        variant = ImageOps.fit(image, (side, side), method=Image.Resampling.LANCZOS)
+        # Nothing from image.info is passed on, so EXIF, XMP and ICC data are dropped
+        buffer = io.BytesIO()
+        variant.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+        # Another worker may have written it in the meantime; the content would be the same
+        if not default_storage.exists(names[size]):
+            default_storage.save(names[size], ContentFile(buffer.getvalue()))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'AVATAR_WORKERS', 2),
+                    thread_name_prefix='avatars',
+                )
+    return _executor
+
+
+def _make_variants_job(avatar_hash, content_type):
+    try:
+        make_variants(avatar_hash, content_type)
+    except Exception:
+        logger.exception("Failed to make avatar variants", extra={'avatar_hash': avatar_hash})
+    finally:
+        with _executor_lock:
+            _pending.discard(avatar_hash)
+
+
+def make_variants_in_background(avatar_hash, content_type):
+    """
+    Queue make_variants() on the avatar worker threads, unless it is already
+    queued for this picture. Decoding, resizing and encoding happen in Pillow's
+    C code without the GIL, so threads get the work off the request path
+    without the cost of worker processes. With settings.AVATAR_WORKERS = 0 the
+    variants are made right away.
+    """
+    if not getattr(settings, 'AVATAR_WORKERS', 2):
+        _make_variants_job(avatar_hash, content_type)
+        return
+    with _executor_lock:
+        if avatar_hash in _pending:
+            return
+        _pending.add(avatar_hash)
+    _get_executor().submit(_make_variants_job, avatar_hash, content_type)
+
+
+def open_avatar(avatar_hash, extension, size=None):
+    """Open a stored image or variant for reading. Raises FileNotFoundError."""
+    if not HASH_RE.match(avatar_hash):
+        raise FileNotFoundError(avatar_hash)
+    name = avatar_name(avatar_hash, extension, size)
+    if not default_storage.exists(name):
+        raise FileNotFoundError(name)
+    return default_storage.open(name, 'rb')
@@ -0,0 +1,36 @@
+import ipaddress
+
+from django.conf import settings
+
+
+def _trusted_proxies():
+    return getattr(settings, 'TRUSTED_PROXY_COUNT', 0)
+
+
+def _header():
+    return getattr(settings, 'CLIENT_IP_HEADER', 'HTTP_X_FORWARDED_FOR')
+
+
+def client_ip(request):
+    """
+    Address of the client that sent `request`.
+
+    Behind TRUSTED_PROXY_COUNT proxies REMOTE_ADDR is the nearest proxy, and
+    each proxy appends the address it was connected from to CLIENT_IP_HEADER
+    (X-Forwarded-For). Entries further left were written by the client and
+    can be anything, so the client is the TRUSTED_PROXY_COUNT-th entry from
+    the right. Without proxies, or when the header is missing or malformed,
+    REMOTE_ADDR is used.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR')
+    proxies = _trusted_proxies()
+    if not proxies:
+        return remote_addr
+    forwarded = [address.strip() for address in request.META.get(_header(), '').split(',') if address.strip()]
+    if not forwarded:
+        return remote_addr
+    address = forwarded[-min(proxies, len(forwarded))]
+    try:
+        return str(ipaddress.ip_address(address))
+    except ValueError:
+        return remote_addr
@@ -0,0 +1,55 @@
+import hashlib
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+USERS_VERSION_KEY = 'conditional:users'
+
+# Clients and browsers may keep responses but must revalidate them each time;
+# shared caches must not keep them at all, they can depend on the viewer
+CACHE_CONTROL = 'private, no-cache'
+
+
+def users_version():
+    """Bumped whenever a username changes, for ETags of pages that show other users' names."""
+    return cache.get_or_set(USERS_VERSION_KEY, 1, None)
+
+
+def users_changed():
+    try:
+        cache.incr(USERS_VERSION_KEY)
+    except ValueError:
+        cache.add(USERS_VERSION_KEY, 1, None)
+
+
+def make_etag(*parts):
+    """Strong ETag from the values a representation is built from."""
+    return '"%s"' % hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+
+
+def not_modified(request, etag):
+    """
+    The 304 response to send when the client's If-None-Match matches `etag`,
+    otherwise None. Only the ETag is compared: like and comment counters change
+    without touching updated_at, so If-Modified-Since alone cannot show that a
+    body is unchanged and is ignored.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        add_validators(response, etag)
+    return response
+
+
+def add_validators(response, etag, last_modified=None):
+    """
+    Set ETag, Last-Modified (a datetime, informational) and the caching
+    headers. Responses vary with the auth cookie because the viewer decides
+    what may be seen.
+    """
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Cache-Control'] = CACHE_CONTROL
+    patch_vary_headers(response, ['Cookie'])
+    return response
@@ -0,0 +1,60 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+USERNAME_KEY = 'login:failures:username:{}'
+IP_KEY = 'login:failures:ip:{}'
+
+
+def _window():
+    return getattr(settings, 'LOGIN_FAILURE_WINDOW', 15 * 60)
+
+
+def _limits():
+    return (
+        getattr(settings, 'LOGIN_MAX_FAILURES_PER_USERNAME', 5),
+        getattr(settings, 'LOGIN_MAX_FAILURES_PER_IP', 20),
+    )
+
+
+def _hashed(value):
+    # Keys stay short and free of characters memcached rejects, whatever the
+    # client sent (a username may be any JSON value)
+    return hashlib.sha1(str(value or '').encode('utf-8')).hexdigest()
+
+
+def _keys(username, ip):
+    # Usernames are matched case-insensitively so variants share one counter
+    return USERNAME_KEY.format(_hashed(str(username or '').lower())), IP_KEY.format(_hashed(ip))
+
+
+def is_throttled(username, ip):
+    """
+    Whether too many logins have failed lately for this username or from this
+    address. Checked before the password is hashed, so guessing costs no CPU
+    once the limit is reached; the counters reset LOGIN_FAILURE_WINDOW seconds
+    after the first failure.
+    """
+    username_key, ip_key = _keys(username, ip)
+    failures = cache.get_many([username_key, ip_key])
+    username_limit, ip_limit = _limits()
+    return failures.get(username_key, 0) >= username_limit or failures.get(ip_key, 0) >= ip_limit
+
+
+def record_failure(username, ip):
+    for key in _keys(username, ip):
+        if not cache.add(key, 1, _window()):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.add(key, 1, _window())
+
+
+def reset(username):
+    cache.delete(_keys(username, None)[0])
+
+
+def retry_after():
+    return _window()
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api import token_cache, user_cache
+from api.authentication import CookieJWTAuthentication
+
+
+class Command(BaseCommand):
+    help = (
+        'Time CookieJWTAuthentication.authenticate() for one request carrying an access '
+        'token cookie, with the token and user caches cold and warm.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User to authenticate as')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per case (default: 2000)')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user named {options["username"]}')
+
+        request = RequestFactory().get('/api/user/')
+        request.COOKIES[settings.SIMPLE_JWT['AUTH_COOKIE']] = str(AccessToken.for_user(user))
+        authentication = CookieJWTAuthentication()
+
+        def clear_both():
+            token_cache.clear()
+            user_cache.clear()
+
+        cases = {
+            # Every request verifies the token and queries the user, as before the caches
+            'no caches': clear_both,
+            'user cache only': token_cache.clear,
+            'token cache only': user_cache.clear,
+            'both caches': None,
+        }
+
+        results = {}
+        for name, before_each in cases.items():
+            if authentication.authenticate(request) is None:
+                raise CommandError(f'Authentication failed ({name})')
+            timings = []
+            for _ in range(options['requests']):
+                if before_each:
+                    before_each()
+                started = time.perf_counter()
+                authentication.authenticate(request)
+                timings.append((time.perf_counter() - started) * 1_000_000)
+            results[name] = timings
+
+        baseline = statistics.median(results['no caches'])
+        for name, timings in results.items():
+            median = statistics.median(timings)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            self.stdout.write(
+                f'{name:>17}: median {median:8.1f} µs  p95 {p95:8.1f} µs  ({baseline / median:.1f}x)'
+            )
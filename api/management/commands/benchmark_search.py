@@ -0,0 +1,100 @@
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.test import RequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.views.blog_views import AsyncSearchView, SearchView, _search_entries_page, _search_users_page
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the latency of SearchView (user and blog halves one after the other) '
+        'with AsyncSearchView (both halves at the same time) on the current database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('query', help='Search query to run')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per view (default: 50)')
+        parser.add_argument('--username', help='Search as this user instead of anonymously')
+        parser.add_argument('--count', default='capped', choices=['exact', 'capped'], help='Count mode (default: capped)')
+
+    def handle(self, *args, **options):
+        cookies = {}
+        user = AnonymousUser()
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user named {options["username"]}')
+            cookies[settings.SIMPLE_JWT['AUTH_COOKIE']] = str(AccessToken.for_user(user))
+
+        factory = RequestFactory()
+        params = {'q': options['query'], 'count': options['count']}
+
+        def make_request():
+            request = factory.get('/api/search/', params)
+            request.COOKIES.update(cookies)
+            return request
+
+        sync_view = SearchView.as_view()
+        async_view = async_to_sync(AsyncSearchView.as_view())
+
+        def run_sync():
+            response = sync_view(make_request())
+            response.render()
+            # Release the connection like the end of a real request does (CONN_MAX_AGE),
+            # the async view does the same in its worker threads
+            close_old_connections()
+            return response
+
+        def run_async():
+            return async_view(make_request())
+
+        results = {}
+        for name, run in (('sync', run_sync), ('async', run_async)):
+            # Warm up connections, caches and the search backend
+            response = run()
+            if response.status_code != 200:
+                raise CommandError(f'{name} search returned {response.status_code}: {response.content[:200]}')
+            timings = []
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = timings
+
+        # Each half on its own: sync should take about their sum, async about the larger one
+        request = make_request()
+        request.user = user
+        halves = {
+            'users half': lambda: _search_users_page(request, options['query'], 1, 3, options['count']),
+            'blog half': lambda: _search_entries_page(user, options['query'], 1, 3, options['count']),
+        }
+        for name, run in halves.items():
+            run()
+            timings = []
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = timings
+
+        for name, timings in results.items():
+            timings.sort()
+            self.stdout.write(
+                f'{name:>10}: mean {statistics.mean(timings):.1f} ms, '
+                f'p50 {timings[len(timings) // 2]:.1f} ms, '
+                f'p95 {timings[int(len(timings) * 0.95) - 1]:.1f} ms'
+            )
+        speedup = statistics.mean(results['sync']) / statistics.mean(results['async'])
+        self.stdout.write(f'async is {speedup:.2f}x the speed of sync')
+        self.stdout.write(
+            'The halves overlap only while one of them waits on the database, so the gain '
+            'needs the database to have cores of its own (e.g. a separate host).'
+        )
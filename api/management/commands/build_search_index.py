@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.search import build_index
+
+
+class Command(BaseCommand):
+    help = 'Build the in-process blog search index from the database and save it to disk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            default=settings.SEARCH_INDEX_PATH,
+            help='Where to write the index (default: settings.SEARCH_INDEX_PATH)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = build_index()
+        built = time.perf_counter()
+        index.save(options['output'])
+        saved = time.perf_counter()
+        self.stdout.write(
+            f'Indexed {len(index)} entries ({len(index.postings)} terms) in {built - started:.2f}s, '
+            f'saved to {options["output"]} in {saved - built:.2f}s'
+        )
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.user_import import BATCH_SIZE, import_users, read_csv, read_ndjson
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users and their profiles from a CSV file with a header line, or from NDJSON. '
+        'Reads username (required), email, password, first_name and last_name from each row.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for standard input")
+        parser.add_argument(
+            '--format',
+            choices=sorted(READERS),
+            help='Input format (default: from the file extension)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Users inserted per transaction (default: {BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Password hashing processes (default: one per CPU)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        input_format = options['format'] or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if input_format is None:
+            raise CommandError('Cannot tell the input format, pass --format')
+
+        if path == '-':
+            stream = sys.stdin
+        else:
+            try:
+                # utf-8-sig also reads the byte order mark spreadsheets put in CSV files
+                stream = open(path, newline='', encoding='utf-8-sig')
+            except OSError as e:
+                raise CommandError(f'Cannot read {path}: {e}')
+
+        started = time.perf_counter()
+        created = duplicates = invalid = 0
+        try:
+            rows = READERS[input_format](stream)
+            for result in import_users(rows, options['batch_size'], options['workers']):
+                for line, username in result['duplicates']:
+                    self.stderr.write(f'Line {line}: username {username!r} is taken')
+                for line, message in result['invalid']:
+                    self.stderr.write(f'Line {line}: {message}')
+                created += result['created']
+                duplicates += len(result['duplicates'])
+                invalid += len(result['invalid'])
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{created} users created ({created / elapsed:.0f} users/s)')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Created {created} users ({duplicates} duplicates, {invalid} invalid rows skipped) '
+            f'in {elapsed:.2f}s, {created / elapsed:.0f} users/s'
+        )
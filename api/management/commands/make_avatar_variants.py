@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.avatars import make_variants
+from api.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Make the resized variants of every stored profile picture that lacks them.'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        pictures = (
+            UserProfile.objects.filter(avatar_hash__isnull=False)
+            .order_by()
+            .values_list('avatar_hash', 'profile_picture_content_type')
+            .distinct()
+        )
+        done = failed = 0
+        for avatar_hash, content_type in pictures.iterator(chunk_size=1000):
+            try:
+                make_variants(avatar_hash, content_type)
+                done += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{avatar_hash}: {e}')
+        self.stdout.write(
+            f'Processed {done} pictures ({failed} failed) in {time.perf_counter() - started:.2f}s'
+        )
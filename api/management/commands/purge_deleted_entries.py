@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.search import PURGE_BATCH_SIZE, purge_deleted_entries
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete the ids of blog entries deleted more than a week ago, which search indexes '
+        'have caught up with. Meant to run periodically, e.g. daily from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PURGE_BATCH_SIZE,
+            help=f'Rows deleted per statement (default: {PURGE_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        deleted = purge_deleted_entries(options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} deleted entry ids in {time.perf_counter() - started:.2f}s')
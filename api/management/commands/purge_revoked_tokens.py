@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.revocation import PURGE_BATCH_SIZE, purge
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked refresh tokens that have expired. Meant to run periodically, e.g. daily from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PURGE_BATCH_SIZE,
+            help=f'Rows deleted per statement (default: {PURGE_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        deleted = purge(options['batch_size'])
+        self.stdout.write(f'Deleted {deleted} expired revoked tokens in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,71 @@
+import time
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.avatars import AVATAR_DIR, HASH_RE
+from api.models import UserProfile
+
+
+def stored_files():
+    """Storage names of every file under AVATAR_DIR, with the picture hash they belong to."""
+    for first in default_storage.listdir(AVATAR_DIR)[0]:
+        for second in default_storage.listdir(f'{AVATAR_DIR}/{first}')[0]:
+            directory = f'{AVATAR_DIR}/{first}/{second}'
+            for filename in default_storage.listdir(directory)[1]:
+                avatar_hash = filename[:64]
+                if HASH_RE.match(avatar_hash):
+                    yield f'{directory}/{filename}', avatar_hash
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete stored profile pictures and variants no profile uses, such as pictures replaced '
+        'before unused ones were deleted right away, or uploads whose request failed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Keep files written less than this many seconds ago, which may belong to uploads in progress (default: 3600)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only list the files that would be deleted')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if not default_storage.exists(AVATAR_DIR):
+            self.stdout.write('No stored pictures')
+            return
+        used = set(
+            UserProfile.objects.filter(avatar_hash__isnull=False).order_by()
+            .values_list('avatar_hash', flat=True).distinct().iterator(chunk_size=1000)
+        )
+        cutoff = timezone.now() - timedelta(seconds=options['min_age'])
+        unused = {}
+        kept = 0
+        for name, avatar_hash in stored_files():
+            if avatar_hash in used or default_storage.get_modified_time(name) > cutoff:
+                kept += 1
+            else:
+                unused.setdefault(avatar_hash, []).append(name)
+
+        deleted = 0
+        for avatar_hash, names in unused.items():
+            # A profile may have been given the picture since `used` was read
+            if UserProfile.objects.filter(avatar_hash=avatar_hash).exists():
+                kept += len(names)
+                continue
+            for name in names:
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    default_storage.delete(name)
+                deleted += 1
+        self.stdout.write(
+            f'{"Would delete" if options["dry_run"] else "Deleted"} {deleted} unused files, '
+            f'kept {kept}, in {time.perf_counter() - started:.2f}s'
+        )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from api.models import BlogEntry, BlogComment, BlogLike, CommentLike
+
+
+def count_subquery(model, fk):
+    rows = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by()
+        .values(fk)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized like and comment counters from the source tables.'
+
+    def handle(self, *args, **options):
+        counters = [
+            (BlogEntry, 'like_count', count_subquery(BlogLike, 'blog_entry')),
+            (BlogEntry, 'comment_count', count_subquery(BlogComment, 'blog_entry')),
+            (BlogComment, 'like_count', count_subquery(CommentLike, 'comment')),
+        ]
+        for model, field, actual in counters:
+            with transaction.atomic():
+                fixed = (
+                    model.objects.annotate(actual=actual)
+                    .exclude(**{field: F('actual')})
+                    .update(**{field: actual})
+                )
+            self.stdout.write(f'{model.__name__}.{field}: {fixed} row(s) corrected')
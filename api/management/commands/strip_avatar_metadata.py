@@ -0,0 +1,41 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.avatars import avatar_name, delete_if_unused, extension_for, make_variants, save_avatar, strip_metadata
+from api.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        'Store the profile pictures uploaded before originals were stripped of their metadata '
+        'again without it, point their profiles to the new copies and delete the old files.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        pictures = list(
+            UserProfile.objects.filter(avatar_hash__isnull=False)
+            .order_by()
+            .values_list('avatar_hash', 'profile_picture_content_type')
+            .distinct()
+        )
+        changed = failed = 0
+        for avatar_hash, content_type in pictures:
+            try:
+                with default_storage.open(avatar_name(avatar_hash, extension_for(content_type)), 'rb') as original:
+                    with strip_metadata(original) as clean:
+                        new_hash = save_avatar(clean, content_type)
+                if new_hash == avatar_hash:
+                    continue
+                make_variants(new_hash, content_type)
+                UserProfile.objects.filter(avatar_hash=avatar_hash).update(avatar_hash=new_hash)
+                delete_if_unused(avatar_hash)
+                changed += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{avatar_hash}: {e}')
+        self.stdout.write(
+            f'Stored {changed} of {len(pictures)} pictures again ({failed} failed) in {time.perf_counter() - started:.2f}s'
+        )
@@ -0,0 +1,124 @@
+from django.contrib.postgres.indexes import PostgresIndex
+from django.contrib.postgres.operations import AddIndexConcurrently as PostgresAddIndexConcurrently, TrigramExtension
+from django.db import IntegrityError
+from django.db.migrations.operations import AddConstraint, AddIndex, RunSQL
+
+# Times a unique index build is retried after rows inserted since the
+# duplicates were deleted turned out to be duplicates again
+UNIQUE_INDEX_ATTEMPTS = 3
+
+
+def drop_invalid_index(schema_editor, name):
+    """
+    Drop `name` if a CREATE INDEX CONCURRENTLY that failed left it behind
+    marked invalid. Such an index is useless but still there, so building it
+    again (or IF NOT EXISTS skipping the build) would fail or do nothing.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', [name])
+        row = cursor.fetchone()
+    if row is not None and not row[0]:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(name)}')
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    """
+    CREATE INDEX CONCURRENTLY on PostgreSQL, so live tables are not locked for
+    writes while the index builds. Other databases (local SQLite) get a plain
+    CREATE INDEX, or nothing for PostgreSQL index types such as GIN. Migrations
+    using it must set atomic = False. An invalid index left by an earlier failed
+    run is dropped and built again.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            if not isinstance(self.index, PostgresIndex):
+                AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+            return
+        drop_invalid_index(schema_editor, self.index.name)
+        return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            if not isinstance(self.index, PostgresIndex):
+                AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+            return
+        return super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class PostgreSQLTrigramExtension(TrigramExtension):
+    """CREATE EXTENSION pg_trgm; skipped both ways on other databases (Django only skips it forwards)."""
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class PostgreSQLRunSQL(RunSQL):
+    """RunSQL that only runs on PostgreSQL, for SQL other databases do not understand."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class AddUniqueConstraintConcurrently(AddConstraint):
+    """
+    Add a UniqueConstraint without blocking writes on PostgreSQL: the unique
+    index is built CONCURRENTLY first and then attached with
+    ALTER TABLE ... ADD CONSTRAINT ... USING INDEX, which only takes a brief lock.
+
+    Rows written while the index builds can duplicate existing ones, which
+    makes the build fail. `deduplicate(apps, schema_editor)`, if given, deletes
+    duplicates; it is run again and the build retried, up to
+    UNIQUE_INDEX_ATTEMPTS times. Re-running the migration after a failure is
+    safe: an invalid index is dropped, an attached constraint is kept.
+    """
+
+    atomic = False
+
+    def __init__(self, model_name, constraint, deduplicate=None):
+        super().__init__(model_name, constraint)
+        self.deduplicate = deduplicate
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        if self.deduplicate is not None:
+            kwargs['deduplicate'] = self.deduplicate
+        return name, args, kwargs
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = %s',
+                [model._meta.db_table, self.constraint.name],
+            )
+            if cursor.fetchone() is not None:
+                return
+
+        quote = schema_editor.quote_name
+        table = quote(model._meta.db_table)
+        name = quote(self.constraint.name)
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in self.constraint.fields)
+        for attempt in range(1, UNIQUE_INDEX_ATTEMPTS + 1):
+            drop_invalid_index(schema_editor, self.constraint.name)
+            try:
+                schema_editor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})')
+                break
+            except IntegrityError:
+                if self.deduplicate is None or attempt == UNIQUE_INDEX_ATTEMPTS:
+                    drop_invalid_index(schema_editor, self.constraint.name)
+                    raise
+                self.deduplicate(from_state.apps, schema_editor)
+        schema_editor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}')
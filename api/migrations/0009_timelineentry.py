@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-17 02:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_timelines(apps, schema_editor):
+    """Materialize existing friends-only entries into their followers' timelines."""
+    BlogEntry = apps.get_model('api', 'BlogEntry')
+    Friendship = apps.get_model('api', 'Friendship')
+    TimelineEntry = apps.get_model('api', 'TimelineEntry')
+
+    batch = []
+    entries = BlogEntry.objects.filter(visibility='friends').values_list('id', 'author_id', 'created_at')
+    for entry_id, author_id, created_at in entries.iterator(chunk_size=1000):
+        for follower_id in Friendship.objects.filter(user_id=author_id).values_list('follower_id', flat=True):
+            batch.append(TimelineEntry(
+                owner_id=follower_id,
+                blog_entry_id=entry_id,
+                author_id=author_id,
+                created_at=created_at,
+            ))
+        if len(batch) >= 1000:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_blogcomment_bloglike_commentlike'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='timeline_fanout_on_read',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('blog_entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='api.blogentry')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['owner', '-created_at'], name='api_timeline_owner_created'), models.Index(fields=['owner', 'author'], name='api_timeline_owner_author')],
+                'unique_together': {('owner', 'blog_entry')},
+            },
+        ),
+        migrations.RunPython(backfill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-17 02:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, fk):
+    rows = (
+        model.objects.filter(**{fk: OuterRef('pk')})
+        .order_by()
+        .values(fk)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows), Value(0))
+
+
+def initialize_counters(apps, schema_editor):
+    BlogEntry = apps.get_model('api', 'BlogEntry')
+    BlogComment = apps.get_model('api', 'BlogComment')
+    BlogLike = apps.get_model('api', 'BlogLike')
+    CommentLike = apps.get_model('api', 'CommentLike')
+
+    BlogEntry.objects.update(
+        like_count=count_subquery(BlogLike, 'blog_entry'),
+        comment_count=count_subquery(BlogComment, 'blog_entry'),
+    )
+    BlogComment.objects.update(like_count=count_subquery(CommentLike, 'comment'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogcomment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='blogentry',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='blogentry',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(initialize_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2 on 2026-10-17 02:35
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+from api.migration_operations import AddIndexConcurrently, AddUniqueConstraintConcurrently
+
+
+def dedupe(model, fields):
+    """Keep the oldest row of every duplicated group. Returns the field values of each such group."""
+    duplicates = list(
+        model.objects.values(*fields).annotate(keep=Min('id'), rows=Count('id')).filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        model.objects.filter(**{field: duplicate[field] for field in fields}).exclude(id=duplicate['keep']).delete()
+    return duplicates
+
+
+def dedupe_friendships(apps, schema_editor):
+    dedupe(apps.get_model('api', 'Friendship'), ('user', 'follower'))
+
+
+def dedupe_blog_likes(apps, schema_editor):
+    """Duplicated likes were counted twice, the counters of the affected entries are fixed too."""
+    BlogEntry = apps.get_model('api', 'BlogEntry')
+    BlogLike = apps.get_model('api', 'BlogLike')
+    for duplicate in dedupe(BlogLike, ('blog_entry', 'user')):
+        entry_id = duplicate['blog_entry']
+        BlogEntry.objects.filter(id=entry_id).update(like_count=BlogLike.objects.filter(blog_entry_id=entry_id).count())
+
+
+def dedupe_comment_likes(apps, schema_editor):
+    """As dedupe_blog_likes(), for comments."""
+    BlogComment = apps.get_model('api', 'BlogComment')
+    CommentLike = apps.get_model('api', 'CommentLike')
+    for duplicate in dedupe(CommentLike, ('comment', 'user')):
+        comment_id = duplicate['comment']
+        BlogComment.objects.filter(id=comment_id).update(like_count=CommentLike.objects.filter(comment_id=comment_id).count())
+
+
+def delete_duplicates(apps, schema_editor):
+    """Delete duplicated likes and friendships so the unique constraints can be built."""
+    dedupe_friendships(apps, schema_editor)
+    dedupe_blog_likes(apps, schema_editor)
+    dedupe_comment_likes(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are built CONCURRENTLY, which cannot run inside a transaction.
+    # Duplicates written by the running site between the first cleanup and a
+    # unique index build are cleaned up again by that operation, see
+    # AddUniqueConstraintConcurrently.
+    atomic = False
+
+    dependencies = [
+        ('api', '0010_engagement_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='blogcomment',
+            index=models.Index(fields=['blog_entry', '-created_at', '-id'], name='api_blogcomment_entry_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='blogentry',
+            index=models.Index(fields=['visibility', '-created_at', '-id'], name='api_blogentry_vis_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='blogentry',
+            index=models.Index(fields=['author', '-created_at', '-id'], name='api_blogentry_author_created'),
+        ),
+        AddIndexConcurrently(
+            model_name='friendrequest',
+            index=models.Index(fields=['receiver', 'is_accepted'], name='api_friendreq_receiver_acc'),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='bloglike',
+            constraint=models.UniqueConstraint(fields=('blog_entry', 'user'), name='api_bloglike_unique'),
+            deduplicate=dedupe_blog_likes,
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='commentlike',
+            constraint=models.UniqueConstraint(fields=('comment', 'user'), name='api_commentlike_unique'),
+            deduplicate=dedupe_comment_likes,
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='friendship',
+            constraint=models.UniqueConstraint(fields=('user', 'follower'), name='api_friendship_unique'),
+            deduplicate=dedupe_friendships,
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.2 on 2026-10-17 02:39
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+from api.migration_operations import AddIndexConcurrently
+
+# The search document: the title weighs more than the content. A stored
+# generated column would rewrite the whole table under an ACCESS EXCLUSIVE
+# lock when added, so the column is a plain nullable one kept up to date by a
+# trigger, and existing rows are filled in batches.
+DOCUMENT = (
+    "setweight(to_tsvector('english'::regconfig, COALESCE({row}title, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, COALESCE({row}content, '')), 'B')"
+)
+BACKFILL_BATCH_SIZE = 5000
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION api_blogentry_search_vector() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.search_vector := {DOCUMENT.format(row='NEW.')};
+            RETURN NEW;
+        END
+        $$
+    """)
+    schema_editor.execute(
+        'CREATE TRIGGER api_blogentry_search_vector '
+        'BEFORE INSERT OR UPDATE OF title, content ON api_blogentry '
+        'FOR EACH ROW EXECUTE FUNCTION api_blogentry_search_vector()'
+    )
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP TRIGGER IF EXISTS api_blogentry_search_vector ON api_blogentry')
+    schema_editor.execute('DROP FUNCTION IF EXISTS api_blogentry_search_vector()')
+
+
+def backfill(apps, schema_editor):
+    """Fill in the rows written before the trigger existed, one short transaction per id range."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MAX(id) FROM api_blogentry')
+        last_id = cursor.fetchone()[0] or 0
+        for start in range(0, last_id, BACKFILL_BATCH_SIZE):
+            cursor.execute(
+                f'UPDATE api_blogentry SET search_vector = {DOCUMENT.format(row="")} '
+                'WHERE id > %s AND id <= %s AND search_vector IS NULL',
+                [start, start + BACKFILL_BATCH_SIZE],
+            )
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits batch by batch and the GIN index is built
+    # CONCURRENTLY, neither can run inside one transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0011_hot_lookup_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blogentry',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='blogentry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='api_blogentry_search'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from api.migration_operations import PostgreSQLRunSQL, PostgreSQLTrigramExtension
+
+# auth_user belongs to django.contrib.auth, so its indexes are created here.
+# The expressions match the SQL Django emits for icontains/istartswith
+# (UPPER("column"::text) LIKE UPPER(...)), so the user search and the
+# autocomplete endpoint can both use them. Other databases go without.
+NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def create_index(field):
+    return PostgreSQLRunSQL(
+        sql=(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS auth_user_{field}_trgm '
+            f'ON auth_user USING gin (UPPER("{field}"::text) gin_trgm_ops)'
+        ),
+        reverse_sql=f'DROP INDEX CONCURRENTLY IF EXISTS auth_user_{field}_trgm',
+    )
+
+
+class Migration(migrations.Migration):
+
+    # Indexes are built CONCURRENTLY, which cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('api', '0012_blogentry_search_vector'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        PostgreSQLTrigramExtension(),
+        *[create_index(field) for field in NAME_FIELDS],
+    ]
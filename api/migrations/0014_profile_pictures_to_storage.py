@@ -0,0 +1,65 @@
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+from api.avatars import avatar_name, extension_for, save_avatar
+
+
+def move_pictures_to_storage(apps, schema_editor):
+    """
+    Write every stored picture to MEDIA_ROOT and keep its hash.
+
+    Only ids are listed up front; each blob is then read on its own, so at
+    most one picture is in memory at a time however many profiles there are.
+    """
+    UserProfile = apps.get_model('api', 'UserProfile')
+    profile_ids = (
+        UserProfile.objects.filter(profile_picture__isnull=False)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    for profile_id in profile_ids.iterator(chunk_size=1000):
+        picture, content_type = UserProfile.objects.filter(id=profile_id).values_list(
+            'profile_picture', 'profile_picture_content_type'
+        ).get()
+        if not picture:
+            continue
+        content_type = content_type or 'image/jpeg'
+        UserProfile.objects.filter(id=profile_id).update(
+            avatar_hash=save_avatar(bytes(picture), content_type),
+            profile_picture_content_type=content_type,
+        )
+
+
+def move_pictures_to_database(apps, schema_editor):
+    UserProfile = apps.get_model('api', 'UserProfile')
+    profiles = (
+        UserProfile.objects.filter(avatar_hash__isnull=False)
+        .order_by('id')
+        .values_list('id', 'avatar_hash', 'profile_picture_content_type')
+    )
+    for profile_id, avatar_hash, content_type in profiles.iterator(chunk_size=1000):
+        name = avatar_name(avatar_hash, extension_for(content_type))
+        if not default_storage.exists(name):
+            continue
+        with default_storage.open(name, 'rb') as f:
+            UserProfile.objects.filter(id=profile_id).update(profile_picture=f.read())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_user_name_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(move_pictures_to_storage, move_pictures_to_database),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='profile_picture',
+        ),
+    ]
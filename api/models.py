@@ -1,5 +1,110 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+
+# Text search configuration of blog entry search queries; the search document
+# trigger (migration 0012) uses the same one
+SEARCH_CONFIG = 'english'
+
+class BlogEntryQuerySet(models.QuerySet):
+    """
+    QuerySet for blog entries with a visibility-aware UNION ALL mode.
+
+    Once visible_to() has split a queryset into branches, filters, annotations
+    and select_related() are pushed down into every branch, so callers can keep
+    composing it like a plain queryset (pagination, search terms, cards).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._visibility_branches = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._visibility_branches = self._visibility_branches
+        return clone
+
+    def _union_branches(self, branches):
+        # Ordering is applied to the combined query, never inside a branch
+        branches = [branch.order_by() for branch in branches]
+        first, *rest = branches
+        combined = first.union(*rest, all=True)
+        combined._visibility_branches = branches
+        return combined
+
+    def _pushdown(self, method, *args, **kwargs):
+        branches = [getattr(branch, method)(*args, **kwargs) for branch in self._visibility_branches]
+        return self._union_branches(branches).order_by(*self.query.order_by)
+
+    def filter(self, *args, **kwargs):
+        if self._visibility_branches is not None:
+            return self._pushdown('filter', *args, **kwargs)
+        return super().filter(*args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        if self._visibility_branches is not None:
+            return self._pushdown('exclude', *args, **kwargs)
+        return super().exclude(*args, **kwargs)
+
+    def annotate(self, *args, **kwargs):
+        if self._visibility_branches is not None:
+            return self._pushdown('annotate', *args, **kwargs)
+        return super().annotate(*args, **kwargs)
+
+    def select_related(self, *fields):
+        if self._visibility_branches is not None:
+            return self._pushdown('select_related', *fields)
+        return super().select_related(*fields)
+
+    def defer(self, *fields):
+        if self._visibility_branches is not None:
+            return self._pushdown('defer', *fields)
+        return super().defer(*fields)
+
+    def as_cards(self, user):
+        """
+        Annotate everything a feed card needs so a page is rendered from one query:
+        the author row, the author's avatar and whether `user` liked the entry.
+        Like and comment counts are already stored on the entry. The search
+        document is left out, cards never display it.
+        """
+        if user and user.is_authenticated:
+            viewer_has_liked = models.Exists(BlogLike.objects.filter(blog_entry=models.OuterRef('pk'), user=user))
+        else:
+            viewer_has_liked = models.Value(False)
+        return self.select_related('author').defer('search_vector').annotate(
+            author_avatar_hash=models.F('author__profile__avatar_hash'),
+            viewer_has_liked=viewer_has_liked,
+        )
+
+    def visible_to(self, user, timeline=False):
+        """
+        Entries of this queryset that `user` is allowed to see.
+
+        Authenticated viewers get a UNION ALL of three disjoint branches, each of
+        which can be answered from an index: their own entries, public entries
+        by others, and friends-only entries by authors they follow (an IN
+        subquery on friendships, so no JOIN and no DISTINCT). With
+        timeline=True the friends branch is read from the home timeline table.
+        """
+        if not user or not user.is_authenticated:
+            return self.filter(visibility='public')
+
+        if timeline:
+            from .timeline import timeline_q
+            friends = self.filter(timeline_q(user))
+        else:
+            friends = self.filter(
+                visibility='friends',
+                author__in=Friendship.objects.filter(follower=user).values('user_id'),
+            )
+
+        return self._union_branches([
+            self.filter(author=user),
+            self.filter(visibility='public').exclude(author=user),
+            friends.exclude(author=user),
+        ])
 
 class BlogEntry(models.Model):
     VISIBILITY_CHOICES = [
@@ -14,10 +119,23 @@ class BlogEntry(models.Model):
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='public')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters, kept in sync by the like/comment views
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Full-text search document (title weighted above content), written by a
+    # database trigger on PostgreSQL, see migration 0012
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BlogEntryQuerySet.as_manager()
 
     class Meta:
         ordering = ['-created_at']
         unique_together = ('title', 'author')
+        indexes = [
+            models.Index(fields=['visibility', '-created_at', '-id'], name='api_blogentry_vis_created'),
+            models.Index(fields=['author', '-created_at', '-id'], name='api_blogentry_author_created'),
+            GinIndex(fields=['search_vector'], name='api_blogentry_search'),
+        ]
 
     def __str__(self):
         return self.title
@@ -28,17 +146,33 @@ class BlogComment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    like_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['blog_entry', '-created_at', '-id'], name='api_blogcomment_entry_created'),
+        ]
     
 class BlogLike(models.Model):
     blog_entry = models.ForeignKey(BlogEntry, on_delete=models.CASCADE, related_name='likes')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blog_entry', 'user'], name='api_bloglike_unique'),
+        ]
     
 class CommentLike(models.Model):
     comment = models.ForeignKey(BlogComment, on_delete=models.CASCADE, related_name='likes')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['comment', 'user'], name='api_commentlike_unique'),
+        ]
+
 class Friendship(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friendships')
     follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friends')
@@ -46,6 +180,9 @@ class Friendship(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'follower'], name='api_friendship_unique'),
+        ]
 
     def __str__(self):
         return f"{self.follower.username} is following {self.user.username}"
@@ -58,19 +195,60 @@ class FriendRequest(models.Model):
 
     class Meta:
         unique_together = ('sender', 'receiver')
+        indexes = [
+            models.Index(fields=['receiver', 'is_accepted'], name='api_friendreq_receiver_acc'),
+        ]
 
     def __str__(self):
         return f"Friend request from {self.sender.username} to {self.receiver.username}"
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    profile_picture = models.BinaryField(blank=True, null=True)
+    # SHA-256 of the picture, which is stored under MEDIA_ROOT (see api.avatars)
+    avatar_hash = models.CharField(max_length=64, blank=True, null=True)
     profile_picture_content_type = models.CharField(max_length=100, blank=True, null=True)
     biography = models.TextField(blank=True, null=True, max_length=500)
+    # Set once the user has too many followers to fan their posts out on write
+    timeline_fanout_on_read = models.BooleanField(default=False)
 
     def __str__(self):
         return self.user.username
 
+class TimelineEntry(models.Model):
+    """Friends-only post materialized into the home timeline of one follower."""
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    blog_entry = models.ForeignKey(BlogEntry, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ('owner', 'blog_entry')
+        indexes = [
+            models.Index(fields=['owner', '-created_at'], name='api_timeline_owner_created'),
+            models.Index(fields=['owner', 'author'], name='api_timeline_owner_author'),
+        ]
+
+    def __str__(self):
+        return f"{self.blog_entry_id} in timeline of {self.owner_id}"
+
+class RevokedToken(models.Model):
+    """Refresh token that may no longer be used, kept until it would have expired anyway (see api.revocation)."""
+    jti = models.CharField(max_length=255, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.jti
+
+class DeletedBlogEntry(models.Model):
+    """Id of a deleted blog entry, kept for a while so in-process search indexes can drop it (see api.search)."""
+    blog_entry_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return str(self.blog_entry_id)
+
 User.add_to_class(
     'followers', 
     property(lambda u: Friendship.objects.filter(user=u))
@@ -0,0 +1,198 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+MAX_PAGE_SIZE = 100
+
+# How listings count their rows in page-number mode:
+# - exact: a full COUNT(*)
+# - capped: count at most COUNT_CAP rows and report "COUNT_CAP+" past that
+# - estimate: the planner's row estimate, for unfiltered listings only
+COUNT_MODES = ('exact', 'capped', 'estimate')
+COUNT_CAP = 1000
+
+# Cursor ids must fit the bigint primary keys
+MAX_ID = 2 ** 63
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def is_cursor_request(request):
+    """Cursor mode is used when the client sends a cursor or asks for it explicitly."""
+    return 'cursor' in request.query_params or request.query_params.get('pagination') == 'cursor'
+
+
+def get_page_size(request, default, param='page_size'):
+    return min(int(request.query_params.get(param, default)), MAX_PAGE_SIZE)
+
+
+def encode_cursor(instance, reverse, ordering=('created_at', 'id')):
+    time_field, id_field = ordering
+    payload = [getattr(instance, time_field).isoformat(), getattr(instance, id_field), int(reverse)]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk, reverse = json.loads(raw)
+        value, pk = datetime.fromisoformat(value), int(pk)
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    # Cursors are made from stored rows: aware times and ids that fit a bigint
+    if value.tzinfo is None or not 0 <= pk < MAX_ID:
+        raise InvalidCursor(cursor)
+    return value, pk, bool(reverse)
+
+
+def cursor_paginate(queryset, cursor, page_size, ordering=('created_at', 'id')):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    Each page is a single index range scan bounded by the cursor position, so
+    deep pages cost the same as the first one and no COUNT is issued.
+    Returns the page items and the response metadata (opaque next/prev tokens).
+    """
+    time_field, id_field = ordering
+    reverse = False
+    if cursor:
+        value, pk, reverse = decode_cursor(cursor)
+        if reverse:
+            queryset = queryset.filter(**{f'{time_field}__gte': value}).exclude(
+                **{time_field: value, f'{id_field}__lte': pk}
+            )
+        else:
+            queryset = queryset.filter(**{f'{time_field}__lte': value}).exclude(
+                **{time_field: value, f'{id_field}__gte': pk}
+            )
+
+    if reverse:
+        queryset = queryset.order_by(time_field, id_field)
+    else:
+        queryset = queryset.order_by(f'-{time_field}', f'-{id_field}')
+
+    items = list(queryset[:page_size + 1])
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if reverse:
+        items.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, bool(cursor)
+
+    next_cursor = prev_cursor = None
+    if items:
+        if has_next:
+            next_cursor = encode_cursor(items[-1], False, ordering)
+        if has_prev:
+            prev_cursor = encode_cursor(items[0], True, ordering)
+
+    return items, {
+        'next': next_cursor,
+        'prev': prev_cursor,
+        'page_size': page_size,
+    }
+
+
+def get_count_mode(request, default='exact', allow_estimate=False):
+    return count_mode_from_params(request.query_params, default, allow_estimate)
+
+
+def count_mode_from_params(query_params, default='exact', allow_estimate=False):
+    mode = query_params.get('count', default)
+    if mode not in COUNT_MODES:
+        mode = default
+    if mode == 'estimate' and not allow_estimate:
+        mode = 'capped'
+    return mode
+
+
+def estimate_count(queryset):
+    """Row estimate from the query planner, or None when the database cannot provide one."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.explain(format='json'))
+    if isinstance(plan, list):
+        plan = plan[0]
+    return int(plan['Plan']['Plan Rows'])
+
+
+def count_rows(queryset, mode='exact'):
+    """Count a listing according to `mode`. Returns the count and whether it is exact."""
+    if mode == 'estimate':
+        estimate = estimate_count(queryset)
+        if estimate is not None:
+            return estimate, False
+        mode = 'capped'
+    if mode == 'capped':
+        total_count = queryset.order_by()[:COUNT_CAP + 1].count()
+        if total_count > COUNT_CAP:
+            return COUNT_CAP, False
+        return total_count, True
+    return queryset.count(), True
+
+
+def page_number_paginate(queryset, page, page_size, count_mode='exact'):
+    """Offset pagination with a total count, kept for existing clients."""
+    total_count, count_exact = count_rows(queryset, count_mode)
+    start = (page - 1) * page_size
+    end = start + page_size
+    return queryset[start:end], {
+        'count': total_count,
+        'count_exact': count_exact,
+        'total_pages': (total_count + page_size - 1) // page_size,
+        'current_page': page,
+        'page_size': page_size,
+    }
+
+
+def paginate(request, queryset, default_page_size, ordering=('created_at', 'id'),
+             default_count_mode='exact', allow_estimate=False):
+    """
+    Paginate a listing using either cursor or page-number mode.
+
+    Query Parameters:
+    - cursor: Opaque token taken from a previous response's next/prev (cursor mode)
+    - pagination: "cursor" to request the first cursor page
+    - page: Page number (page-number mode, default: 1)
+    - page_size: Number of items per page (max: 100)
+    - count: "exact", "capped" or "estimate" (page-number mode, default depends on the endpoint)
+    """
+    page_size = get_page_size(request, default_page_size)
+    if is_cursor_request(request):
+        return cursor_paginate(queryset, request.query_params.get('cursor'), page_size, ordering)
+    page = int(request.query_params.get('page', 1))
+    count_mode = get_count_mode(request, default_count_mode, allow_estimate)
+    return page_number_paginate(queryset, page, page_size, count_mode)
+
+
+class CursorOrPageNumberPagination(PageNumberPagination):
+    """DRF pagination class for generic views that understands the cursor mode as well."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_meta = None
+        if not is_cursor_request(request):
+            return super().paginate_queryset(queryset, request, view)
+        try:
+            items, self.cursor_meta = cursor_paginate(
+                queryset,
+                request.query_params.get('cursor'),
+                get_page_size(request, self.page_size),
+            )
+        except InvalidCursor:
+            # A 400, like the views that paginate by hand
+            raise ValidationError({'error': 'Invalid cursor'})
+        return items
+
+    def get_paginated_response(self, data):
+        if self.cursor_meta is None:
+            return super().get_paginated_response(data)
+        return Response({**self.cursor_meta, 'results': data})
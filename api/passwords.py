@@ -0,0 +1,205 @@
+import logging
+import multiprocessing
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.hashers import check_password as django_check_password, identify_hasher, make_password
+
+logger = logging.getLogger(__name__)
+
+PENDING_SLOT_KEY = 'passwords:pending:{}'
+# A slot held by a request that died without releasing it is freed after this
+# many seconds, longer than any wait for a hash
+PENDING_SLOT_TIMEOUT = 60
+
+
+class HashPoolBusy(Exception):
+    """Too many password hashes are already queued; the request should be retried later."""
+
+
+def _workers():
+    return getattr(settings, 'PASSWORD_HASH_WORKERS', 2)
+
+
+def _max_pending():
+    return getattr(settings, 'PASSWORD_HASH_MAX_PENDING', 8)
+
+
+def _acquire_slot():
+    """
+    Claim one of the PASSWORD_HASH_MAX_PENDING slots, which are cache keys and
+    so shared by every web process using the same cache. Returns the slot's
+    key, or None when all are taken.
+    """
+    slots = list(range(_max_pending()))
+    random.shuffle(slots)
+    for slot in slots:
+        key = PENDING_SLOT_KEY.format(slot)
+        if cache.add(key, 1, PENDING_SLOT_TIMEOUT):
+            return key
+    return None
+
+
+def _release_slot(key):
+    cache.delete(key)
+
+
+def _init_worker():
+    # Workers start from a fresh interpreter (forkserver), not a copy of the
+    # web worker, so they never share its database connections
+    import django
+    django.setup(set_prefix=False)
+
+
+def _timed_hash(password):
+    started = time.perf_counter()
+    encoded = make_password(password)
+    return encoded, time.perf_counter() - started
+
+
+def _timed_check(password, encoded):
+    started = time.perf_counter()
+    matches = django_check_password(password, encoded)
+    return matches, time.perf_counter() - started
+
+
+class HashPool:
+    """
+    Password hashing and verification on a few dedicated processes.
+
+    PBKDF2 takes hundreds of milliseconds of CPU. Run inline, a burst of
+    logins ties up every web worker and starves other requests of CPU. Here
+    at most PASSWORD_HASH_WORKERS hashes run at once per web process. At most
+    PASSWORD_HASH_MAX_PENDING requests, counted across every web process
+    sharing the cache (see _acquire_slot()), wait for or run one. Any more are
+    refused at once with HashPoolBusy rather than queued. With
+    PASSWORD_HASH_WORKERS = 0 hashing happens inline, which is simpler for
+    development and tests.
+
+    Waiting requests hold their web worker thread, so the limit only matters
+    with several threads per web process (gunicorn's gthread workers, see the
+    Dockerfile). With one request per process it can never be reached.
+
+    Each call records how long it waited for a worker and how long the hash
+    itself took, see stats().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stats = {
+            'hashes': 0,
+            'rejected': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+            'hash_ms_total': 0.0,
+            'hash_ms_max': 0.0,
+        }
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=_workers(),
+                    mp_context=multiprocessing.get_context('forkserver'),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _record(self, operation, wait, duration):
+        wait_ms, hash_ms = wait * 1000, duration * 1000
+        with self._lock:
+            stats = self._stats
+            stats['hashes'] += 1
+            stats['wait_ms_total'] += wait_ms
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], wait_ms)
+            stats['hash_ms_total'] += hash_ms
+            stats['hash_ms_max'] = max(stats['hash_ms_max'], hash_ms)
+        logger.info('Password hashed', extra={
+            'operation': operation,
+            'pool_wait_ms': round(wait_ms, 1),
+            'hash_ms': round(hash_ms, 1),
+        })
+
+    def run(self, operation, func, *args):
+        if not _workers():
+            result, duration = func(*args)
+            self._record(operation, 0.0, duration)
+            return result
+
+        slot = _acquire_slot()
+        if slot is None:
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning('Password hash rejected - pool saturated', extra={'operation': operation})
+            raise HashPoolBusy()
+        try:
+            executor = self._get_executor()
+            started = time.perf_counter()
+            result, duration = executor.submit(func, *args).result()
+            elapsed = time.perf_counter() - started
+        except BrokenProcessPool:
+            # A worker died; start a new pool for the next request
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            logger.error('Password hash pool broken', extra={'operation': operation}, exc_info=True)
+            raise HashPoolBusy()
+        finally:
+            _release_slot(slot)
+        self._record(operation, max(elapsed - duration, 0.0), duration)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        hashes = stats['hashes']
+        stats['wait_ms_avg'] = stats['wait_ms_total'] / hashes if hashes else None
+        stats['hash_ms_avg'] = stats['hash_ms_total'] / hashes if hashes else None
+        stats['workers'] = _workers()
+        stats['max_pending'] = _max_pending()
+        return stats
+
+
+_pool = HashPool()
+
+
+def hash_password(password):
+    """make_password() on the hash pool. Raises HashPoolBusy."""
+    return _pool.run('hash', _timed_hash, password)
+
+
+def check_password(password, encoded):
+    """check_password() on the hash pool. The stored hash is not upgraded, see must_update(). Raises HashPoolBusy."""
+    return _pool.run('check', _timed_check, password, encoded)
+
+
+def bulk_pool(workers=None):
+    """
+    A process pool for hashing many passwords at once outside of requests,
+    e.g. imports: map make_password over it. Unlike the request pool it is
+    not bounded, and the caller shuts it down. Uses every CPU by default.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('forkserver'),
+        initializer=_init_worker,
+    )
+
+
+def must_update(encoded):
+    """Whether a stored hash uses outdated settings and should be replaced on the next login."""
+    try:
+        return identify_hasher(encoded).must_update(encoded)
+    except ValueError:
+        return False
+
+
+def stats():
+    """Counters of this process's hash pool: hashes run and rejected, wait and hash times in ms."""
+    return _pool.stats()
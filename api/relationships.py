@@ -0,0 +1,82 @@
+from django.db import models
+from django.db.models.functions import Coalesce
+
+from .models import Friendship, FriendRequest
+from . import social_cache
+
+
+def _friendship_count(fk, user_ref):
+    rows = (
+        Friendship.objects.filter(**{fk: models.OuterRef(user_ref)})
+        .order_by()
+        .values(fk)
+        .annotate(total=models.Count('*'))
+        .values('total')
+    )
+    return Coalesce(models.Subquery(rows), models.Value(0))
+
+
+def with_social_counts(queryset, user_ref='pk'):
+    """
+    Annotate follower_count and following_count with correlated subqueries, so
+    a page of users is counted in the same query that loads it. `user_ref` is
+    the path to the user id: 'pk' for users, 'user' for user profiles.
+    """
+    return queryset.annotate(
+        follower_count=_friendship_count('user', user_ref),
+        following_count=_friendship_count('follower', user_ref),
+    )
+
+
+class Relationships:
+    """
+    The viewer's relationship to a set of users, worked out at once: follows
+    in both directions come from the cached follow graph and pending friend
+    requests from one query, after which every lookup is a set membership test.
+    """
+
+    def __init__(self, viewer, user_ids):
+        self.viewer_id = viewer.id if viewer and viewer.is_authenticated else None
+        self.following = self.followers = self.requests_sent = self.requests_received = frozenset()
+        if self.viewer_id is None:
+            return
+
+        self.following = social_cache.following_ids(self.viewer_id)
+        self.followers = social_cache.follower_ids(self.viewer_id)
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        pending = FriendRequest.objects.filter(
+            models.Q(sender_id=self.viewer_id, receiver_id__in=user_ids) |
+            models.Q(sender_id__in=user_ids, receiver_id=self.viewer_id),
+            is_accepted=False,
+        ).values_list('sender_id', 'receiver_id')
+        pending = list(pending)
+        self.requests_sent = frozenset(receiver for sender, receiver in pending if sender == self.viewer_id)
+        self.requests_received = frozenset(sender for sender, receiver in pending if receiver == self.viewer_id)
+
+    def search_status(self, user_id):
+        """Status shown on user search results."""
+        if self.viewer_id is None:
+            return 'none'
+        if user_id == self.viewer_id:
+            return 'self'
+        if user_id in self.following:
+            return 'following'
+        if user_id in self.followers:
+            return 'follower'
+        if user_id in self.requests_sent:
+            return 'request_sent'
+        if user_id in self.requests_received:
+            return 'request_received'
+        return 'none'
+
+    def profile_status(self, user_id):
+        """Status shown on a profile page."""
+        if self.viewer_id is None:
+            return None
+        if user_id in self.following:
+            return 'following'
+        if user_id in self.requests_sent:
+            return 'request_sent'
+        return None
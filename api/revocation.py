@@ -0,0 +1,129 @@
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from .bloom import BloomFilter
+from .models import RevokedToken
+
+# Starting size of each worker's filter; it is rebuilt twice as large when full
+INITIAL_CAPACITY = 100_000
+ERROR_RATE = 0.001
+
+PURGE_BATCH_SIZE = 5000
+
+
+def _sync_interval():
+    return getattr(settings, 'TOKEN_REVOCATION_SYNC_INTERVAL', 10)
+
+
+class RevocationStore:
+    """
+    Revoked refresh token ids: the RevokedToken table (unique on jti) is the
+    authority, and each worker keeps a Bloom filter of its rows in front of it.
+
+    A token the filter has never seen is certainly not revoked, so the common
+    case costs no query; only possible matches are looked up. The filter is
+    loaded lazily, and rows revoked by other workers are added by reading the
+    ids past the last one seen, at most every TOKEN_REVOCATION_SYNC_INTERVAL
+    seconds. Revoking goes through the unique index, so a token revoked by
+    another worker can never be revoked, and thus used, a second time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._last_id = 0
+        self._synced_at = 0.0
+
+    def _load(self, capacity):
+        now = timezone.now()
+        rows = RevokedToken.objects.filter(expires_at__gt=now).order_by('id').values_list('id', 'jti')
+        bloom = BloomFilter(capacity, ERROR_RATE)
+        last_id = 0
+        for row_id, jti in rows.iterator(chunk_size=PURGE_BATCH_SIZE):
+            bloom.add(jti)
+            last_id = row_id
+        self._filter = bloom
+        self._last_id = max(self._last_id, last_id)
+        self._synced_at = time.monotonic()
+
+    def _sync(self):
+        if self._filter is None:
+            self._load(INITIAL_CAPACITY)
+            return
+        if time.monotonic() - self._synced_at < _sync_interval():
+            return
+        rows = RevokedToken.objects.filter(id__gt=self._last_id).order_by('id').values_list('id', 'jti')
+        for row_id, jti in rows:
+            self._filter.add(jti)
+            self._last_id = row_id
+        self._synced_at = time.monotonic()
+        if self._filter.is_full:
+            # Also drops purged tokens, which only ever cause false positives
+            self._load(self._filter.capacity * 2)
+
+    def might_be_revoked(self, jti):
+        with self._lock:
+            self._sync()
+            return jti in self._filter
+
+    def is_revoked(self, jti):
+        return self.might_be_revoked(jti) and RevokedToken.objects.filter(jti=jti).exists()
+
+    def revoke(self, jti, expires_at):
+        """Revoke a token id. Returns False if it was revoked already."""
+        if self.is_revoked(jti):
+            return False
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+        except IntegrityError:
+            # Revoked in the meantime, possibly by another worker
+            return False
+        with self._lock:
+            # The next sync adds it again along with rows of other workers, which is
+            # harmless; after clear() there is no filter and the next load reads it
+            if self._filter is not None:
+                self._filter.add(jti)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._filter = None
+            self._last_id = 0
+
+
+_store = RevocationStore()
+
+
+def _token_fields(token):
+    return token[api_settings.JTI_CLAIM], datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+
+
+def revoke(token):
+    """
+    Revoke a verified refresh token until it expires. Returns False if it was
+    already revoked, in which case whoever holds it must not get new tokens.
+    """
+    jti, expires_at = _token_fields(token)
+    return _store.revoke(jti, expires_at)
+
+
+def is_revoked(token):
+    return _store.is_revoked(token[api_settings.JTI_CLAIM])
+
+
+def purge(batch_size=PURGE_BATCH_SIZE):
+    """Delete revoked tokens past their expiry, which are rejected as expired anyway. Returns the count."""
+    now = timezone.now()
+    deleted = 0
+    while True:
+        ids = list(RevokedToken.objects.filter(expires_at__lte=now).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += RevokedToken.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,389 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from html import escape
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.core.cache import cache
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .avatars import SMALL, avatar_url
+from .models import BlogEntry, DeletedBlogEntry, SEARCH_CONFIG
+from .pagination import COUNT_CAP
+from .relationships import with_social_counts
+from .search_index import InvertedIndex, highlight, tokenize
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 20
+
+# Ranked index matches checked for visibility per query, best first
+INDEX_BATCH_SIZE = 500
+
+# Bumped on every entry write so each process's inverted index catches up
+INDEX_VERSION_KEY = 'search:index:version'
+
+# Entries changed this long before the last sync are read again, in case
+# their transaction committed only after that sync ran
+SYNC_OVERLAP = timedelta(minutes=1)
+
+# Deleted entry ids are kept this long; an index synced longer ago than that
+# (e.g. an old index file) checks every id it holds against the table instead
+DELETED_ENTRY_RETENTION = timedelta(days=7)
+
+PURGE_BATCH_SIZE = 5000
+
+
+def min_full_text_length():
+    return getattr(settings, 'SEARCH_MIN_FULL_TEXT_LENGTH', 3)
+
+
+def index_sync_interval():
+    return getattr(settings, 'SEARCH_INDEX_SYNC_INTERVAL', 30)
+
+
+def index_version():
+    return cache.get_or_set(INDEX_VERSION_KEY, 1, None)
+
+
+def index_changed():
+    try:
+        cache.incr(INDEX_VERSION_KEY)
+    except ValueError:
+        cache.add(INDEX_VERSION_KEY, 1, None)
+
+
+def uses_full_text(query):
+    """Very short queries are too vague for stemming, they are matched as substrings instead."""
+    return len(query) >= min_full_text_length()
+
+
+class SearchBackend:
+    """
+    Blog entry search engine. The one in use is chosen with settings.SEARCH_BACKEND
+    and reached through the module level functions below. Engines implement
+
+    - search_entries(query, user): cards of the entries visible to `user`
+      matching `query`, best first, with a `rank`;
+    - add_headlines(entries, query): evaluate a page of results, attaching a
+      highlighted `headline` to each entry;
+
+    and may override the write hooks below, which run once the write commits.
+    """
+
+    def entry_saved(self, blog_entry):
+        pass
+
+    def entry_deleted(self, blog_entry_id):
+        pass
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """PostgreSQL full-text search on the search_vector column (GIN index)."""
+
+    def search_entries(self, query, user):
+        """
+        Queries of at least SEARCH_MIN_FULL_TEXT_LENGTH characters are matched
+        against search_vector (web search syntax: quoted phrases, "or", -word)
+        and ordered by relevance, with titles weighing more than content.
+        Shorter queries fall back to a substring match, newest first.
+        """
+        if not uses_full_text(query):
+            entries = BlogEntry.objects.filter(
+                models.Q(title__icontains=query) |
+                models.Q(content__icontains=query)
+            )
+            return entries.visible_to(user).as_cards(user).order_by('-created_at', '-id')
+
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        entries = BlogEntry.objects.filter(search_vector=search_query).annotate(
+            rank=SearchRank(models.F('search_vector'), search_query),
+        )
+        return entries.visible_to(user).as_cards(user).order_by('-rank', '-created_at', '-id')
+
+    def add_headlines(self, entries, query):
+        """
+        The headline is the best matching fragments of the content with the
+        search terms wrapped in <mark> tags. ts_headline() re-parses the whole
+        document, so it is only run for the entries of the page, in one query.
+        The content is HTML escaped, the <mark> tags are the only markup.
+        """
+        entries = list(entries)
+        for entry in entries:
+            entry.headline = None
+        if not entries or not uses_full_text(query):
+            return entries
+
+        search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+        headlines = dict(
+            BlogEntry.objects.filter(id__in=[entry.id for entry in entries]).annotate(
+                headline=SearchHeadline(
+                    'content',
+                    search_query,
+                    config=SEARCH_CONFIG,
+                    start_sel=HIGHLIGHT_START,
+                    stop_sel=HIGHLIGHT_STOP,
+                    max_words=35,
+                    min_words=15,
+                    max_fragments=2,
+                ),
+            ).values_list('id', 'headline')
+        )
+        for entry in entries:
+            headline = headlines.get(entry.id)
+            if headline is not None:
+                entry.headline = (
+                    escape(headline)
+                    .replace(escape(HIGHLIGHT_START), HIGHLIGHT_START)
+                    .replace(escape(HIGHLIGHT_STOP), HIGHLIGHT_STOP)
+                )
+        return entries
+
+
+class InvertedIndexSearchBackend(SearchBackend):
+    """
+    BM25 search over an in-process inverted index of titles and contents
+    (api.search_index), for databases without full-text search and for
+    comparing engines on the same corpus.
+
+    The index is loaded from settings.SEARCH_INDEX_PATH when that file exists
+    (see the build_search_index command) and caught up with entries changed
+    since it was saved, otherwise it is built from the database on first use.
+    Saved and deleted entries are applied to the index of the process that
+    wrote them and bump a version key in the cache. Before searching, every
+    other process catches up from the database (sync_index()) once that key
+    has moved, and at least every SEARCH_INDEX_SYNC_INTERVAL seconds for
+    changes made without model signals, such as QuerySet.update().
+    """
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._version = None
+        self._synced_at = 0.0
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.load_index()
+        return self._index
+
+    def load_index(self):
+        # Read first, so writes during the load show up as a newer version
+        self._version = index_version()
+        self._synced_at = time.monotonic()
+        path = getattr(settings, 'SEARCH_INDEX_PATH', None)
+        if path and os.path.exists(path):
+            index = InvertedIndex.load(path)
+            sync_index(index)
+            return index
+        return build_index()
+
+    def sync(self):
+        """Catch the loaded index up with writes of other processes, see the class docstring."""
+        if self._index is None:
+            return
+        version = index_version()
+        if version == self._version and time.monotonic() - self._synced_at < index_sync_interval():
+            return
+        # One thread syncs, the others search the index as it is meanwhile
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._version = version
+            self._synced_at = time.monotonic()
+            sync_index(self._index)
+        finally:
+            self._sync_lock.release()
+
+    def search_entries(self, query, user):
+        """
+        The index ranks every match, then the database keeps the ones `user`
+        may see: INDEX_BATCH_SIZE ranked ids at a time, best first, until
+        COUNT_CAP + 1 visible ones are found. Entries the viewer cannot see
+        thus never crowd out those they can, and capped counts are right.
+        Past COUNT_CAP matches, exact counts stop at COUNT_CAP + 1 as well.
+        """
+        self.sync()
+        matches = self.index.search(query, limit=None)
+        results = []
+        for start in range(0, len(matches), INDEX_BATCH_SIZE):
+            batch = dict(matches[start:start + INDEX_BATCH_SIZE])
+            visible = set(BlogEntry.objects.filter(id__in=batch).visible_to(user).values_list('id', flat=True))
+            results += [(doc_id, score) for doc_id, score in batch.items() if doc_id in visible]
+            if len(results) > COUNT_CAP:
+                results = results[:COUNT_CAP + 1]
+                break
+        if not results:
+            return BlogEntry.objects.none().as_cards(user)
+
+        rank = models.Case(
+            *[models.When(id=doc_id, then=models.Value(score)) for doc_id, score in results],
+            output_field=models.FloatField(),
+        )
+        # Already checked, but the page is still built through visible_to() so
+        # it can be composed like the other backend's results
+        entries = BlogEntry.objects.filter(id__in=[doc_id for doc_id, _ in results]).annotate(rank=rank)
+        return entries.visible_to(user).as_cards(user).order_by('-rank', '-created_at', '-id')
+
+    def add_headlines(self, entries, query):
+        terms = set(tokenize(query))
+        entries = list(entries)
+        for entry in entries:
+            entry.headline = highlight(entry.content, terms, start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP)
+        return entries
+
+    def entry_saved(self, blog_entry):
+        # An index that is not loaded yet will read the entry from the database
+        if self._index is not None:
+            self._index.add(blog_entry.id, blog_entry.title, blog_entry.content)
+        index_changed()
+
+    def entry_deleted(self, blog_entry_id):
+        if self._index is not None:
+            self._index.remove(blog_entry_id)
+        index_changed()
+
+
+def build_index():
+    """Index every blog entry."""
+    index = InvertedIndex()
+    index.synced_at = timezone.now().isoformat()
+    entries = BlogEntry.objects.order_by().values_list('id', 'title', 'content')
+    for entry_id, title, content in entries.iterator(chunk_size=2000):
+        index.add(entry_id, title, content)
+    return index
+
+
+def sync_index(index):
+    """
+    Catch up an index with the entries edited, created or deleted since it was
+    last synced. Deletions are read from the DeletedBlogEntry rows written
+    since then, so only changed ids are looked at.
+    """
+    now = timezone.now()
+    since = datetime.fromisoformat(index.synced_at) - SYNC_OVERLAP
+    if since < now - DELETED_ENTRY_RETENTION:
+        # Older deletions may have been purged already
+        existing = set(BlogEntry.objects.values_list('id', flat=True))
+        deleted = set(index.documents) - existing
+    else:
+        deleted = set(DeletedBlogEntry.objects.filter(deleted_at__gte=since).values_list('blog_entry_id', flat=True))
+    for entry_id in deleted:
+        index.remove(entry_id)
+    changed = BlogEntry.objects.filter(updated_at__gte=since).order_by().values_list('id', 'title', 'content')
+    for entry_id, title, content in changed.iterator(chunk_size=2000):
+        index.add(entry_id, title, content)
+    index.synced_at = now.isoformat()
+
+
+def purge_deleted_entries(batch_size=PURGE_BATCH_SIZE):
+    """Delete DeletedBlogEntry rows past DELETED_ENTRY_RETENTION. Returns the count."""
+    cutoff = timezone.now() - DELETED_ENTRY_RETENTION
+    deleted = 0
+    while True:
+        ids = list(DeletedBlogEntry.objects.filter(deleted_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += DeletedBlogEntry.objects.filter(id__in=ids).delete()[0]
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(settings, 'SEARCH_BACKEND', 'api.search.DatabaseSearchBackend'))()
+    return _backend
+
+
+def search_entries(query, user):
+    return get_backend().search_entries(query, user)
+
+
+def add_headlines(entries, query):
+    return get_backend().add_headlines(entries, query)
+
+
+def entry_saved(blog_entry):
+    """Tell the search backend about a new or edited entry once the transaction commits."""
+    transaction.on_commit(lambda: get_backend().entry_saved(blog_entry))
+
+
+def entry_deleted(blog_entry_id):
+    transaction.on_commit(lambda: get_backend().entry_deleted(blog_entry_id))
+
+
+def blog_entry_saved(sender, instance, **kwargs):
+    """post_save receiver for BlogEntry, so edits from every code path (admin included) reach the backend."""
+    entry_saved(instance)
+
+
+def blog_entry_deleted(sender, instance, **kwargs):
+    """
+    post_delete receiver for BlogEntry, also sent for entries deleted along with
+    their author. The DeletedBlogEntry row commits with the deletion, for the
+    indexes of other processes (see sync_index()).
+    """
+    DeletedBlogEntry.objects.create(blog_entry_id=instance.pk)
+    entry_deleted(instance.pk)
+
+
+def search_users(query):
+    """
+    Users whose username or name contains `query`, alphabetically, loaded with
+    their profile and social counts for SearchUserSerializer.
+
+    The UPPER(...) LIKE conditions Django generates for icontains are served by
+    the trigram indexes on auth_user (migration 0013).
+    """
+    users = User.objects.filter(
+        models.Q(username__icontains=query) |
+        models.Q(first_name__icontains=query) |
+        models.Q(last_name__icontains=query)
+    ).select_related('profile').order_by('username')
+    return with_social_counts(users)
+
+
+def autocomplete_users(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Users whose username, first or last name starts with `prefix`, as plain dicts.
+
+    One query against the trigram indexes, with the profile joined in for the
+    avatar reference. Username matches come first.
+    """
+    users = User.objects.filter(
+        models.Q(username__istartswith=prefix) |
+        models.Q(first_name__istartswith=prefix) |
+        models.Q(last_name__istartswith=prefix)
+    ).annotate(
+        username_match=models.ExpressionWrapper(
+            models.Q(username__istartswith=prefix),
+            output_field=models.BooleanField(),
+        ),
+    ).order_by('-username_match', 'username').values(
+        'id', 'username', 'first_name', 'last_name',
+        'profile__avatar_hash',
+    )
+
+    return [
+        {
+            'id': user['id'],
+            'username': user['username'],
+            'display_name': f"{user['first_name']} {user['last_name']}".strip() or user['username'],
+            'has_avatar': bool(user['profile__avatar_hash']),
+            'avatar': avatar_url(user['profile__avatar_hash'], SMALL),
+        }
+        for user in users[:limit]
+    ]
@@ -0,0 +1,161 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+
+from .models import BlogEntry
+from .pagination import COUNT_CAP, count_rows
+from .relationships import with_social_counts
+from . import search
+
+VERSION_KEY = 'search:version'
+HITS_KEY = 'search:hits'
+MISSES_KEY = 'search:misses'
+USERS_KEY = 'search:{version}:users:{query}:{page}:{page_size}'
+ENTRIES_KEY = 'search:{version}:entries:{query}:{page}:{page_size}'
+
+
+def _timeout():
+    return getattr(settings, 'SEARCH_CACHE_TIMEOUT', 60)
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+def _query_key(query):
+    # Keeps keys short and free of characters memcached rejects
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+
+def version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def invalidate():
+    """Make every cached result stale; called when entries are created or deleted and when users are renamed."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def _get(key, compute):
+    value = cache.get(key)
+    if value is None:
+        _count(MISSES_KEY)
+        value = compute()
+        cache.set(key, value, _timeout())
+    else:
+        _count(HITS_KEY)
+    return value
+
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else None,
+        'version': version(),
+    }
+
+
+def _pagination(count, count_exact, page, page_size):
+    return {
+        'count': count,
+        'count_exact': count_exact,
+        'total_pages': (count + page_size - 1) // page_size,
+        'current_page': page,
+        'page_size': page_size,
+    }
+
+
+def user_page(query, page, page_size):
+    """
+    A page of search.search_users() in capped count mode. The ids and count are
+    cached per query and page; the users themselves, with their counts and
+    profiles, are loaded in one query so the viewer's relationships stay live.
+    """
+    def compute():
+        users = search.search_users(query)
+        count, count_exact = count_rows(users, 'capped')
+        start = (page - 1) * page_size
+        ids = list(users.values_list('id', flat=True)[start:start + page_size])
+        return {'ids': ids, 'count': count, 'count_exact': count_exact}
+
+    key = USERS_KEY.format(version=version(), query=_query_key(query), page=page, page_size=page_size)
+    cached = _get(key, compute)
+    users = with_social_counts(User.objects.filter(id__in=cached['ids']).select_related('profile')).in_bulk()
+    results = [users[user_id] for user_id in cached['ids'] if user_id in users]
+    return results, _pagination(cached['count'], cached['count_exact'], page, page_size)
+
+
+def _sort_key(rank, created_at, entry_id):
+    return (rank or 0.0, created_at, entry_id)
+
+
+def entry_page(query, user, page, page_size):
+    """
+    A page of search.search_entries() in capped count mode.
+
+    Public matches are the same for everyone, so their ranking (id, rank and
+    creation time of everything up to the end of the page) and count are
+    cached per query and page. Anonymous viewers are served from that alone.
+    For signed-in viewers the entries only they can see (their own non-public
+    entries and friends-only entries of people they follow) are searched per
+    request and merged in by rank.
+    """
+    end = page * page_size
+
+    def compute():
+        entries = search.search_entries(query, AnonymousUser())
+        count, count_exact = count_rows(entries, 'capped')
+        fields = ['id', 'created_at'] + (['rank'] if 'rank' in entries.query.annotations else [])
+        rows = [
+            (row.get('rank'), row['created_at'].timestamp(), row['id'])
+            for row in entries.values(*fields)[:end]
+        ]
+        return {'rows': rows, 'count': count, 'count_exact': count_exact}
+
+    key = ENTRIES_KEY.format(version=version(), query=_query_key(query), page=page, page_size=page_size)
+    public = _get(key, compute)
+    count, count_exact = public['count'], public['count_exact']
+    # (sort key, id, rank, entry): public entries are loaded once the page is known
+    candidates = [(_sort_key(*row), row[2], row[0], None) for row in public['rows']]
+
+    if user and user.is_authenticated:
+        private_entries = search.search_entries(query, user).exclude(visibility='public')
+        private_count, private_exact = count_rows(private_entries, 'capped')
+        count = count + private_count
+        count_exact = count_exact and private_exact and count <= COUNT_CAP
+        count = min(count, COUNT_CAP)
+        candidates += [
+            (_sort_key(getattr(entry, 'rank', None), entry.created_at.timestamp(), entry.id), entry.id, None, entry)
+            for entry in private_entries[:end]
+        ]
+
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    page_candidates = candidates[(page - 1) * page_size:end]
+
+    public_ids = [entry_id for _, entry_id, _, entry in page_candidates if entry is None]
+    public_entries = BlogEntry.objects.filter(id__in=public_ids).as_cards(user).in_bulk() if public_ids else {}
+    results = []
+    for _, entry_id, rank, entry in page_candidates:
+        if entry is None:
+            entry = public_entries.get(entry_id)
+            if entry is None:
+                continue
+            entry.rank = rank
+        results.append(entry)
+    return results, _pagination(count, count_exact, page, page_size)
@@ -0,0 +1,151 @@
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from html import escape
+
+TOKEN_RE = re.compile(r'\w+')
+
+STOPWORDS = frozenset('''
+a an and are as at be but by for from has have i in is it its of on or so that
+the this to was were will with
+'''.split())
+
+# Title terms count this many times in the term frequency, so titles rank above content
+TITLE_WEIGHT = 3
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+FORMAT_VERSION = 1
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def highlight(text, terms, max_words=35, start_sel='<mark>', stop_sel='</mark>'):
+    """
+    Window of `max_words` words of `text` around the first occurrence of one of
+    `terms` (or from the start when there is none), HTML escaped, with the
+    matching words wrapped in start_sel/stop_sel.
+    """
+    words = list(TOKEN_RE.finditer(text))
+    if not words:
+        return escape(text)
+    first = next((i for i, word in enumerate(words) if word.group().lower() in terms), 0)
+
+    start = max(first - max_words // 3, 0)
+    end = min(start + max_words, len(words)) - 1
+    parts = []
+    # Text before the first word is kept when the window starts at the beginning
+    position = words[start].start() if start else 0
+    for word in words[start:end + 1]:
+        parts.append(escape(text[position:word.start()]))
+        if word.group().lower() in terms:
+            parts.append(f'{start_sel}{escape(word.group())}{stop_sel}')
+        else:
+            parts.append(escape(word.group()))
+        position = word.end()
+    return ''.join(parts)
+
+
+class InvertedIndex:
+    """
+    In-memory inverted index over documents made of a title and a body, scored with BM25.
+
+    Postings map each term to {document id: term frequency}. Documents can be
+    added, replaced and removed one at a time, and the whole index can be
+    saved to a gzipped JSON file and loaded back. All methods are thread safe.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}  # id -> {term: frequency}
+        self.lengths = {}
+        self.total_length = 0
+        self.synced_at = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id, title, body):
+        frequencies = Counter(tokenize(body))
+        for term in tokenize(title):
+            frequencies[term] += TITLE_WEIGHT
+        with self._lock:
+            self.remove(doc_id)
+            self._add_frequencies(doc_id, dict(frequencies))
+
+    def _add_frequencies(self, doc_id, frequencies):
+        self.documents[doc_id] = frequencies
+        length = sum(frequencies.values())
+        self.lengths[doc_id] = length
+        self.total_length += length
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+
+    def remove(self, doc_id):
+        with self._lock:
+            frequencies = self.documents.pop(doc_id, None)
+            if frequencies is None:
+                return
+            self.total_length -= self.lengths.pop(doc_id)
+            for term in frequencies:
+                posting = self.postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query, limit=100):
+        """The `limit` best (document id, score) pairs for `query`, best first; every match with limit=None."""
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self.documents)
+            if not terms or not count:
+                return []
+            average_length = self.total_length / count
+            scores = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, frequency in posting.items():
+                    norm = K1 * (1 - B + B * self.lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+        if limit is None:
+            return sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+
+    def save(self, path):
+        with self._lock:
+            payload = {
+                'version': FORMAT_VERSION,
+                'synced_at': self.synced_at,
+                'documents': self.documents,
+            }
+            data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        # Written next to the target and renamed, so readers never see a partial file
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rb') as f:
+            payload = json.loads(f.read())
+        if payload.get('version') != FORMAT_VERSION:
+            raise ValueError(f'Unsupported search index format in {path}')
+        index = cls()
+        index.synced_at = payload['synced_at']
+        for doc_id, frequencies in payload['documents'].items():
+            index._add_frequencies(int(doc_id), frequencies)
+        return index
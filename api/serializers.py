@@ -1,6 +1,13 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from .models import BlogEntry, UserProfile, Friendship, FriendRequest, BlogComment, BlogLike, CommentLike
+from .relationships import Relationships
+from .avatars import LARGE, MEDIUM, SMALL, InvalidImage, avatar_url, store_upload
+from . import passwords, revocation
 import base64
 
 class SignupSerializer(serializers.ModelSerializer):
@@ -18,33 +25,83 @@ class SignupSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data.pop('password2')  # Remove the extra password field
-        user = User.objects.create_user(**validated_data)
-        
-        # Create a UserProfile for the new user
-        UserProfile.objects.create(user=user)
+        password = validated_data.pop('password')
+        # Hashed on the password pool; the rest is what create_user() does
+        user = User(
+            username=User.normalize_username(validated_data.pop('username')),
+            email=User.objects.normalize_email(validated_data.pop('email', '')),
+            **validated_data
+        )
+        user.password = passwords.hash_password(password)
+        with transaction.atomic():
+            user.save()
+            # Create a UserProfile for the new user
+            UserProfile.objects.create(user=user)
         
         return user
 
+class CookieTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that enforces api.revocation: with ROTATE_REFRESH_TOKENS and
+    BLACKLIST_AFTER_ROTATION the refresh token is revoked before new tokens
+    are issued, and a token revoked already (used before, or logged out) is
+    refused. simplejwt's own blacklist app is not used.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if jwt_settings.ROTATE_REFRESH_TOKENS and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            if not revocation.revoke(refresh):
+                raise TokenError('Token is revoked')
+        elif revocation.is_revoked(refresh):
+            raise TokenError('Token is revoked')
+        return super().validate(attrs)
+
 class BlogEntrySerializer(serializers.ModelSerializer):
     author_name = serializers.CharField(source='author.username', read_only=True)  # Fetch the username of the author
 
     class Meta:
         model = BlogEntry
-        fields = ['id', 'title', 'content', 'visibility', 'author', 'author_name', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'author', 'author_name', 'created_at', 'updated_at']
+        fields = ['id', 'title', 'content', 'visibility', 'author', 'author_name', 'like_count', 'comment_count', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'author', 'author_name', 'like_count', 'comment_count', 'created_at', 'updated_at']
 
     def create(self, validated_data):
         # Assign the logged-in user as the author
         validated_data['author'] = self.context['request'].user
         return super().create(validated_data)
     
+class BlogEntryCardSerializer(BlogEntrySerializer):
+    """Blog entry as shown in listings; expects a queryset built with BlogEntry.objects.as_cards()."""
+    author_has_avatar = serializers.SerializerMethodField()
+    author_avatar = serializers.SerializerMethodField()
+    viewer_has_liked = serializers.BooleanField(read_only=True)
+
+    class Meta(BlogEntrySerializer.Meta):
+        fields = BlogEntrySerializer.Meta.fields + ['author_has_avatar', 'author_avatar', 'viewer_has_liked']
+        read_only_fields = fields
+
+    def get_author_has_avatar(self, obj):
+        return bool(obj.author_avatar_hash)
+
+    def get_author_avatar(self, obj):
+        return avatar_url(obj.author_avatar_hash, SMALL)
+
+class BlogEntrySearchResultSerializer(BlogEntryCardSerializer):
+    """Card with the search relevance and highlighted snippet, see api.search."""
+    rank = serializers.FloatField(read_only=True, allow_null=True)
+    headline = serializers.CharField(read_only=True, allow_null=True)
+
+    class Meta(BlogEntryCardSerializer.Meta):
+        fields = BlogEntryCardSerializer.Meta.fields + ['rank', 'headline']
+        read_only_fields = fields
+
 class BlogCommentSerializer(serializers.ModelSerializer):
     author_name = serializers.CharField(source='author.username', read_only=True)
 
     class Meta:
         model = BlogComment
-        fields = ['id', 'content', 'author', 'author_name', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'author', 'author_name', 'created_at', 'updated_at']
+        fields = ['id', 'content', 'author', 'author_name', 'like_count', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'author', 'author_name', 'like_count', 'created_at', 'updated_at']
 
 class BlogLikeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -68,7 +125,53 @@ class CommentLikeSerializer(serializers.ModelSerializer):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class RelationshipListSerializer(serializers.ListSerializer):
+    """Works out the viewer's relationship to every user of the page before serializing them."""
+
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        self.context['relationships'] = Relationships(
+            request.user if request else None,
+            [self.child.relationship_user_id(item) for item in items],
+        )
+        return super().to_representation(items)
+
+class RelationshipFieldsMixin:
+    """
+    follower_count, following_count and friendship_status for user serializers.
+
+    Counts are read from with_social_counts() annotations and relationships
+    from the Relationships of the page (RelationshipListSerializer); objects
+    loaded without them fall back to querying one by one.
+    """
+
+    # Attribute of the serialized object holding the id of the user it describes
+    relationship_user_field = 'id'
+
+    def relationship_user_id(self, obj):
+        return getattr(obj, self.relationship_user_field)
+
+    def get_relationships(self, obj):
+        relationships = self.context.get('relationships')
+        if relationships is None:
+            request = self.context.get('request')
+            relationships = Relationships(request.user if request else None, [self.relationship_user_id(obj)])
+        return relationships
+
+    def get_follower_count(self, obj):
+        count = getattr(obj, 'follower_count', None)
+        if count is None:
+            count = Friendship.objects.filter(user_id=self.relationship_user_id(obj)).count()
+        return count
+
+    def get_following_count(self, obj):
+        count = getattr(obj, 'following_count', None)
+        if count is None:
+            count = Friendship.objects.filter(follower_id=self.relationship_user_id(obj)).count()
+        return count
+
+class UserProfileSerializer(RelationshipFieldsMixin, serializers.ModelSerializer):
     # Include fields from the User model
     id = serializers.IntegerField(source='user.id')
     username = serializers.CharField(source='user.username')
@@ -76,7 +179,10 @@ class UserProfileSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField(source='user.first_name')
     last_name = serializers.CharField(source='user.last_name')
     
-    # Follower and Following counts (using properties you added to the User model)
+    # URL of the stored picture; clients upload it as base64 (see to_internal_value)
+    profile_picture = serializers.SerializerMethodField()
+
+    # Annotated by with_social_counts(..., user_ref='user') when available
     follower_count = serializers.SerializerMethodField()
     following_count = serializers.SerializerMethodField()
     friendship_status = serializers.SerializerMethodField()
@@ -84,53 +190,41 @@ class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserProfile
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'profile_picture', 'profile_picture_content_type', 'follower_count', 'following_count', 'friendship_status', 'biography']
+        # Read from the uploaded image itself, see to_internal_value
+        read_only_fields = ['profile_picture_content_type']
+        list_serializer_class = RelationshipListSerializer
 
-    def get_follower_count(self, obj):
-        # Use the 'followers' property added to the User model to get the count
-        return obj.user.followers.count()
-
-    def get_following_count(self, obj):
-        # Use the 'following' property added to the User model to get the count
-        return obj.user.following.count()
+    relationship_user_field = 'user_id'
 
     def get_friendship_status(self, obj):
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
-            return None
-        
-        current_user = request.user
-        target_user = obj.user
-
-        # Check if they are friends
-        if Friendship.objects.filter(user=target_user, follower=current_user).exists():
-            return 'following'
-        
-        # Check if there's a pending friend request
-        if FriendRequest.objects.filter(sender=current_user, receiver=target_user, is_accepted=False).exists():
-            return 'request_sent'
-        
-        return None
+        return self.get_relationships(obj).profile_status(obj.user_id)
 
-    def to_representation(self, instance):
-        """Convert the binary image data to base64 for JSON serialization."""
-        ret = super().to_representation(instance)
-        if instance.profile_picture:
-            ret['profile_picture'] = base64.b64encode(instance.profile_picture).decode('utf-8')
-        return ret
+    def get_profile_picture(self, obj):
+        return avatar_url(obj.avatar_hash, LARGE)
 
     def to_internal_value(self, data):
-        """Convert image data to binary for storage."""
+        """
+        Check and store an uploaded picture (file or base64 string) and keep its
+        hash; resized variants are made in the background (see api.avatars).
+        The content type is taken from the image itself.
+        """
         ret = super().to_internal_value(data)
         if 'profile_picture' in data:
             profile_picture = data['profile_picture']
-            if hasattr(profile_picture, 'read'):  # It's a file upload
-                ret['profile_picture'] = profile_picture.read()
-            else:  # It's a base64 string
-                ret['profile_picture'] = base64.b64decode(profile_picture)
-            ret['profile_picture_content_type'] = data.get('profile_picture_content_type', 'image/jpeg')
+            if not profile_picture:
+                ret['avatar_hash'] = None
+                ret['profile_picture_content_type'] = None
+                return ret
+            try:
+                if not hasattr(profile_picture, 'read'):  # It's a base64 string
+                    profile_picture = base64.b64decode(profile_picture)
+                ret['avatar_hash'], ret['profile_picture_content_type'] = store_upload(profile_picture)
+            except (InvalidImage, ValueError) as e:
+                raise serializers.ValidationError({'profile_picture': f'Not a valid image: {e}'})
         return ret
 
-class SearchUserSerializer(serializers.ModelSerializer):
+class SearchUserSerializer(RelationshipFieldsMixin, serializers.ModelSerializer):
+    """User search result; expects users loaded with select_related('profile') and with_social_counts()."""
     follower_count = serializers.SerializerMethodField()
     following_count = serializers.SerializerMethodField()
     profile_picture = serializers.SerializerMethodField()
@@ -145,19 +239,11 @@ class SearchUserSerializer(serializers.ModelSerializer):
             'follower_count', 'following_count', 'profile_picture',
             'profile_picture_content_type', 'friendship_status', 'biography'
         ]
-
-    def get_follower_count(self, obj):
-        return Friendship.objects.filter(user=obj).count()
-
-    def get_following_count(self, obj):
-        return Friendship.objects.filter(follower=obj).count()
+        list_serializer_class = RelationshipListSerializer
 
     def get_profile_picture(self, obj):
         try:
-            profile = obj.profile
-            if profile.profile_picture:
-                return base64.b64encode(profile.profile_picture).decode('utf-8')
-            return None
+            return avatar_url(obj.profile.avatar_hash, MEDIUM)
         except UserProfile.DoesNotExist:
             return None
 
@@ -174,24 +260,4 @@ class SearchUserSerializer(serializers.ModelSerializer):
             return None
 
     def get_friendship_status(self, obj):
-        request = self.context.get('request')
-        if not request or not request.user.is_authenticated:
-            return 'none'
-        
-        if request.user == obj:
-            return 'self'
-            
-        # Check if they are friends
-        if Friendship.objects.filter(user=obj, follower=request.user).exists():
-            return 'following'
-        if Friendship.objects.filter(user=request.user, follower=obj).exists():
-            return 'follower'
-            
-        # Check for pending friend requests
-        if FriendRequest.objects.filter(sender=request.user, receiver=obj, is_accepted=False).exists():
-            return 'request_sent'
-        if FriendRequest.objects.filter(sender=obj, receiver=request.user, is_accepted=False).exists():
-            return 'request_received'
-            
-        return 'none'
-
+        return self.get_relationships(obj).search_status(obj.id)
@@ -0,0 +1,69 @@
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Friendship
+
+VERSION_KEY = 'social:version:{}'
+FOLLOWERS_KEY = 'social:followers:{}:{}'
+FOLLOWING_KEY = 'social:following:{}:{}'
+
+
+def _timeout():
+    return getattr(settings, 'SOCIAL_GRAPH_CACHE_TIMEOUT', 300)
+
+
+def _version(user_id):
+    return cache.get_or_set(VERSION_KEY.format(user_id), 1, None)
+
+
+def _load(key, user_id, queryset):
+    # The version is read before the database: a set read just before a
+    # friendship changed is stored under the version invalidate() replaces,
+    # so it is never served afterwards
+    key = key.format(user_id, _version(user_id))
+    packed = cache.get(key)
+    if packed is None:
+        ids = sorted(queryset)
+        # Stored as a packed array of 64-bit ints, which is much smaller than a pickled set
+        packed = array('q', ids).tobytes()
+        cache.set(key, packed, _timeout())
+        return frozenset(ids)
+    ids = array('q')
+    ids.frombytes(packed)
+    return frozenset(ids)
+
+
+def follower_ids(user_id):
+    """IDs of the users following `user_id`."""
+    return _load(
+        FOLLOWERS_KEY, user_id,
+        Friendship.objects.filter(user_id=user_id).values_list('follower_id', flat=True),
+    )
+
+
+def following_ids(user_id):
+    """
+    IDs of the users `user_id` follows. Shown to users (friendship statuses),
+    not used for access decisions: with a cache that is not shared between
+    processes it can be SOCIAL_GRAPH_CACHE_TIMEOUT seconds out of date.
+    """
+    return _load(
+        FOLLOWING_KEY, user_id,
+        Friendship.objects.filter(follower_id=user_id).values_list('user_id', flat=True),
+    )
+
+
+def _bump(user_id):
+    key = VERSION_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def invalidate(user_id, follower_id):
+    """Forget the cached sets touched by a friendship between `user_id` and `follower_id`."""
+    _bump(user_id)
+    _bump(follower_id)
@@ -1,3 +1,1253 @@
-from django.test import TestCase
+import base64
+import importlib
+import io
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import ExifTags, Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import avatars, login_throttle, pagination, passwords, revocation, search, search_cache, social_cache, timeline, token_cache, user_cache
+from .access import JOURNAL, LOGIN_REQUIRED, NOT_FRIENDS, EntryAccess
+from .bloom import BloomFilter
+from .client_ip import client_ip
+from .models import BlogComment, BlogEntry, BlogLike, CommentLike, DeletedBlogEntry, FriendRequest, Friendship, RevokedToken, TimelineEntry, UserProfile
+from .search_index import InvertedIndex, highlight
+from .views import blog_views
+
+
+class InvertedIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, 'Tomato soup', 'A warm soup for cold days')
+        self.index.add(2, 'Garden notes', 'The tomato plants need water')
+        self.index.add(3, 'Bread', 'Flour, water and salt')
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual([doc_id for doc_id, _ in self.index.search('tomato')], [1, 2])
+
+    def test_limit_none_returns_every_match(self):
+        results = self.index.search('water tomato', limit=None)
+        self.assertEqual({doc_id for doc_id, _ in results}, {1, 2, 3})
+        scores = [score for _, score in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_add_replaces_and_remove_forgets(self):
+        self.index.add(1, 'Potato soup', 'A warm soup')
+        self.assertEqual([doc_id for doc_id, _ in self.index.search('tomato')], [2])
+        self.index.remove(2)
+        self.assertEqual(self.index.search('tomato'), [])
+        self.assertNotIn('tomato', self.index.postings)
+
+    def test_save_and_load(self):
+        self.index.synced_at = timezone.now().isoformat()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'index.json.gz')
+            self.index.save(path)
+            loaded = InvertedIndex.load(path)
+        self.assertEqual(loaded.synced_at, self.index.synced_at)
+        self.assertEqual(loaded.search('tomato'), self.index.search('tomato'))
+
+    def test_highlight_escapes_content(self):
+        self.assertEqual(
+            highlight('<b>tomato</b> & basil', {'tomato'}),
+            '&lt;b&gt;<mark>tomato</mark>&lt;/b&gt; &amp; basil',
+        )
+
+
+@override_settings(SEARCH_INDEX_PATH=os.path.join(tempfile.gettempdir(), 'missing-search-index.json.gz'))
+class InvertedIndexSearchBackendTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.backend = search.InvertedIndexSearchBackend()
+
+    def entry(self, author, title, content='', visibility='public'):
+        return BlogEntry.objects.create(author=author, title=title, content=content, visibility=visibility)
+
+    def result_ids(self, query, user):
+        return [entry.id for entry in self.backend.search_entries(query, user)]
+
+    def test_visible_matches_ranked_below_hidden_ones_are_found(self):
+        for i in range(5):
+            self.entry(self.bob, f'tomato tomato {i}', 'tomato', visibility='journal')
+        public = self.entry(self.bob, 'Garden', 'a tomato')
+        with mock.patch.object(search, 'INDEX_BATCH_SIZE', 2):
+            self.assertEqual(self.result_ids('tomato', self.alice), [public.id])
+            self.assertEqual(self.result_ids('tomato', AnonymousUser()), [public.id])
+
+    def test_friends_only_matches_follow_the_visibility_rules(self):
+        friends = self.entry(self.bob, 'Tomato', visibility='friends')
+        public = self.entry(self.bob, 'Garden', 'tomato')
+        self.assertEqual(self.result_ids('tomato', self.alice), [public.id])
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+        self.assertEqual(self.result_ids('tomato', self.alice), [friends.id, public.id])
+        self.assertEqual(self.result_ids('tomato', self.bob), [friends.id, public.id])
+
+    def test_results_stop_past_the_count_cap(self):
+        for i in range(6):
+            self.entry(self.bob, f'tomato {i}')
+        with mock.patch.object(search, 'INDEX_BATCH_SIZE', 2), mock.patch.object(search, 'COUNT_CAP', 3):
+            self.assertEqual(len(self.result_ids('tomato', self.alice)), 4)
+
+    def test_writes_of_other_processes_are_synced_when_the_version_moves(self):
+        old = self.entry(self.bob, 'Tomato')
+        self.assertEqual(self.result_ids('tomato', self.alice), [old.id])
+
+        # Written elsewhere: no signal reaches this backend's index
+        new = BlogEntry.objects.bulk_create([BlogEntry(author=self.bob, title='Tomato salad', content='')])[0]
+        BlogEntry.objects.filter(id=old.id).delete()
+        self.assertEqual(self.result_ids('tomato', self.alice), [])
+        search.index_changed()
+        self.assertEqual(self.result_ids('tomato', self.alice), [new.id])
+        self.assertNotIn(old.id, self.backend.index.documents)
+
+    def test_sync_reads_only_changed_and_deleted_ids(self):
+        kept = self.entry(self.bob, 'Tomato')
+        gone = self.entry(self.bob, 'Tomato soup')
+        self.result_ids('tomato', self.alice)
+        BlogEntry.objects.filter(id=gone.id).delete()
+        with CaptureQueriesContext(connection) as queries:
+            search.sync_index(self.backend.index)
+        self.assertEqual(set(self.backend.index.documents), {kept.id})
+        entry_queries = [query['sql'] for query in queries if 'FROM "api_blogentry"' in query['sql']]
+        self.assertTrue(entry_queries)
+        for sql in entry_queries:
+            self.assertIn('WHERE', sql)
+
+    def test_indexes_older_than_the_retention_check_every_id(self):
+        kept = self.entry(self.bob, 'Tomato')
+        gone = self.entry(self.bob, 'Tomato soup')
+        index = search.build_index()
+        BlogEntry.objects.filter(id=gone.id).delete()
+        DeletedBlogEntry.objects.update(deleted_at=timezone.now() - timedelta(days=8))
+        out = io.StringIO()
+        call_command('purge_deleted_entries', stdout=out)
+        self.assertIn('Deleted 1 deleted entry ids', out.getvalue())
+        self.assertFalse(DeletedBlogEntry.objects.exists())
+
+        index.synced_at = (timezone.now() - timedelta(days=8)).isoformat()
+        search.sync_index(index)
+        self.assertEqual(set(index.documents), {kept.id})
+
+    def test_bulk_updates_are_synced_after_the_interval(self):
+        entry = self.entry(self.bob, 'Tomato')
+        self.result_ids('tomato', self.alice)
+        BlogEntry.objects.filter(id=entry.id).update(title='Potato', updated_at=timezone.now())
+        self.assertEqual(self.result_ids('potato', self.alice), [])
+        with override_settings(SEARCH_INDEX_SYNC_INTERVAL=0):
+            self.assertEqual(self.result_ids('potato', self.alice), [entry.id])
+
+    def test_saves_and_deletes_reach_the_backend_on_commit(self):
+        self.result_ids('tomato', self.alice)
+        with mock.patch.object(search, '_backend', self.backend):
+            with self.captureOnCommitCallbacks(execute=True):
+                entry = self.entry(self.bob, 'Tomato')
+            self.assertIn(entry.id, self.backend.index.documents)
+            with self.captureOnCommitCallbacks(execute=True):
+                entry.delete()
+            self.assertNotIn(entry.id, self.backend.index.documents)
+
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        entry = BlogEntry(id=42, created_at=timezone.now())
+        for reverse in (False, True):
+            self.assertEqual(
+                pagination.decode_cursor(pagination.encode_cursor(entry, reverse)),
+                (entry.created_at, 42, reverse),
+            )
+
+    def test_tampered_cursors_are_rejected(self):
+        def encode(raw):
+            return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+        cursors = [
+            '',
+            'not a cursor!',
+            'é',
+            encode(b'\xff\xfe'),
+            encode(b'not json'),
+            encode(b'{"a": 1}'),
+            encode(b'[1, 2]'),
+            encode(b'"abc"'),
+            encode(b'[null, 1, 0]'),
+            encode(b'["yesterday", 1, 0]'),
+            encode(b'["2026-01-01T00:00:00+00:00", "one", 0]'),
+            encode(b'["2026-01-01T00:00:00+00:00", 100000000000000000000, 0]'),
+            encode(b'["2026-01-01T00:00:00", 1, 0]'),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor), self.assertRaises(pagination.InvalidCursor):
+                pagination.decode_cursor(cursor)
+
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.entries = [
+            BlogEntry.objects.create(author=cls.author, title=f'Entry {i}', content='') for i in range(7)
+        ]
+        # Ties on created_at must be broken by id, both ways
+        tied = timezone.now()
+        BlogEntry.objects.filter(id__in=[entry.id for entry in cls.entries[1:5]]).update(created_at=tied)
+        cls.expected = list(BlogEntry.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def walk(self, cursor=None, direction='next'):
+        pages = []
+        while True:
+            items, meta = pagination.cursor_paginate(BlogEntry.objects.all(), cursor, 2)
+            pages.append(([item.id for item in items], meta))
+            cursor = meta[direction]
+            if cursor is None:
+                return pages
+
+    def test_forward_walk_visits_every_entry_once_in_order(self):
+        pages = self.walk()
+        self.assertEqual([entry_id for ids, _ in pages for entry_id in ids], self.expected)
+        self.assertEqual([len(ids) for ids, _ in pages], [2, 2, 2, 1])
+        self.assertIsNone(pages[0][1]['prev'])
+        self.assertIsNone(pages[-1][1]['next'])
+
+    def test_prev_and_next_are_symmetric(self):
+        forward = self.walk()
+        # Walking back from the last page gives the earlier pages in reverse...
+        backward = self.walk(forward[-1][1]['prev'], 'prev')
+        self.assertEqual([ids for ids, _ in backward], [ids for ids, _ in reversed(forward[:-1])])
+        # ...and each of them leads forward to the page after it
+        for (_, meta), (next_ids, _) in zip(reversed(backward), forward[1:]):
+            items, _ = pagination.cursor_paginate(BlogEntry.objects.all(), meta['next'], 2)
+            self.assertEqual([item.id for item in items], next_ids)
+
+    def test_views_reject_invalid_cursors(self):
+        client = APIClient()
+        response = client.get('/api/blog/all/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        # Generic views paginated by CursorOrPageNumberPagination as well
+        client.force_authenticate(self.author)
+        response = client.get('/api/blog/my/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+        client.force_authenticate(None)
+        response = client.get('/api/blog/all/', {'pagination': 'cursor', 'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.json())
+        self.assertEqual(len(response.json()['results']), 3)
+
+
+def explain(sql, params=()):
+    """
+    PostgreSQL plan of a query with sequential scans disabled. Test tables are
+    tiny, so the planner would scan them whatever the indexes; with seq scans
+    off a Seq Scan in the plan means no index can serve the query.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET enable_seqscan = off')
+        try:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.execute('RESET enable_seqscan')
+
+
+class VisibleToTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice')
+        cls.bob = User.objects.create_user('bob')
+        cls.carol = User.objects.create_user('carol')
+        Friendship.objects.create(user=cls.bob, follower=cls.alice)
+        cls.entries = {}
+        for author in (cls.alice, cls.bob, cls.carol):
+            for visibility in ('public', 'friends', 'journal'):
+                cls.entries[author.username, visibility] = BlogEntry.objects.create(
+                    author=author, title=f'{author.username} {visibility}', content='', visibility=visibility,
+                )
+
+    def visible(self, user, **kwargs):
+        ids = list(BlogEntry.objects.visible_to(user, **kwargs).as_cards(user).order_by('-created_at').values_list('id', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+        return set(ids)
+
+    def expected(self, *keys):
+        return {self.entries[key].id for key in keys}
+
+    def test_viewer_sees_own_public_and_followed_friends_entries(self):
+        self.assertEqual(self.visible(self.alice), self.expected(
+            ('alice', 'public'), ('alice', 'friends'), ('alice', 'journal'),
+            ('bob', 'public'), ('bob', 'friends'),
+            ('carol', 'public'),
+        ))
+
+    def test_anonymous_viewer_sees_public_entries(self):
+        self.assertEqual(self.visible(AnonymousUser()), self.expected(
+            ('alice', 'public'), ('bob', 'public'), ('carol', 'public'),
+        ))
+
+    def test_query_is_a_union_all_without_distinct(self):
+        sql = str(BlogEntry.objects.visible_to(self.alice).as_cards(self.alice).order_by('-created_at').query).upper()
+        self.assertIn('UNION ALL', sql)
+        self.assertNotIn('DISTINCT', sql)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL')
+    def test_plans_use_indexes_without_hash_distinct(self):
+        cases = [(self.alice, False), (self.alice, True), (AnonymousUser(), False)]
+        for user, timeline in cases:
+            with self.subTest(user=user, timeline=timeline):
+                queryset = BlogEntry.objects.visible_to(user, timeline=timeline).as_cards(user).order_by('-created_at', '-id')[:10]
+                sql, params = queryset.query.sql_with_params()
+                plan = explain(sql, params)
+                self.assertNotIn('Seq Scan', plan)
+                self.assertNotIn('HashAggregate', plan)
+                self.assertNotIn('Unique', plan)
+
+
+class HotLookupIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice')
+        cls.bob = User.objects.create_user('bob')
+        UserProfile.objects.create(user=cls.bob)
+        Friendship.objects.create(user=cls.bob, follower=cls.alice)
+        FriendRequest.objects.create(sender=cls.bob, receiver=cls.alice)
+        cls.entry = BlogEntry.objects.create(author=cls.bob, title='Entry', content='', like_count=1, comment_count=1)
+        cls.comment = BlogComment.objects.create(blog_entry=cls.entry, author=cls.alice, content='Hi', like_count=1)
+        BlogLike.objects.create(blog_entry=cls.entry, user=cls.alice)
+        CommentLike.objects.create(comment=cls.comment, user=cls.bob)
+
+    def test_indexes_and_unique_constraints_exist(self):
+        expected = {
+            'api_blogentry': {'api_blogentry_vis_created', 'api_blogentry_author_created'},
+            'api_blogcomment': {'api_blogcomment_entry_created'},
+            'api_bloglike': {'api_bloglike_unique'},
+            'api_commentlike': {'api_commentlike_unique'},
+            'api_friendship': {'api_friendship_unique'},
+            'api_friendrequest': {'api_friendreq_receiver_acc'},
+        }
+        constraints = {}
+        with connection.cursor() as cursor:
+            for table in expected:
+                constraints.update(connection.introspection.get_constraints(cursor, table))
+        for names in expected.values():
+            for name in names:
+                with self.subTest(name=name):
+                    self.assertIn(name, constraints)
+                    self.assertEqual(constraints[name]['unique'], name.endswith('_unique'))
+
+    @skipUnless(connection.vendor == 'postgresql', 'Query plans are checked on PostgreSQL')
+    def test_view_queries_use_indexes(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        entry_id, comment_id = self.entry.id, self.comment.id
+        requests = [
+            ('get', '/api/blog/all/', {}),
+            ('get', '/api/blog/all/', {'pagination': 'cursor'}),
+            ('post', '/api/blog/user/', {'username': 'bob'}),
+            ('get', '/api/blog/my/', {}),
+            ('get', f'/api/blog/{entry_id}/', {}),
+            ('get', f'/api/blog/comments/{entry_id}/', {}),
+            ('get', f'/api/blog/likes/{entry_id}/', {}),
+            ('get', f'/api/blog/like-count/{entry_id}/', {}),
+            ('get', f'/api/blog/comment-count/{entry_id}/', {}),
+            ('get', '/api/blog/engagement/', {'ids': str(entry_id)}),
+            ('get', f'/api/comment/likes/{comment_id}/', {}),
+            ('get', f'/api/comment/like-count/{comment_id}/', {}),
+            ('get', '/api/friend-requests/pending/', {}),
+            ('get', '/api/friend-requests/pending/sent/', {}),
+            ('get', '/api/followers/', {}),
+            ('get', '/api/following/', {}),
+            ('get', '/api/profile/', {'user_id': self.bob.id}),
+        ]
+        for method, url, data in requests:
+            with self.subTest(url=url, data=data):
+                with CaptureQueriesContext(connection) as queries:
+                    response = getattr(client, method)(url, data)
+                self.assertEqual(response.status_code, 200)
+                for query in queries:
+                    if query['sql'].lstrip().upper().startswith('SELECT'):
+                        self.assertNotIn('Seq Scan', explain(query['sql']), query['sql'])
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def jpeg_with_location():
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = 6
+    exif[ExifTags.Base.Make] = 'Camera'
+    exif[ExifTags.Base.GPSInfo] = {ExifTags.GPS.GPSLatitude: (52.0, 13.0, 0.0)}
+    buffer = io.BytesIO()
+    Image.new('RGB', (80, 40), 'red').save(buffer, 'JPEG', exif=exif, comment=b'home')
+    return buffer.getvalue()
+
+
+class AvatarStorageTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        overrides = override_settings(MEDIA_ROOT=media.name, AVATAR_WORKERS=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        for user in (self.alice, self.bob):
+            UserProfile.objects.create(user=user)
+
+    def upload(self, user, picture):
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.put('/api/profile/picture/', picture, content_type='image/png')
+        self.assertEqual(response.status_code, 200)
+        return UserProfile.objects.get(user=user).avatar_hash
+
+    def age(self, *avatar_hashes):
+        two_hours_ago = time.time() - 7200
+        for avatar_hash in avatar_hashes:
+            for name in avatars.stored_names(avatar_hash):
+                os.utime(default_storage.path(name), (two_hours_ago, two_hours_ago))
+
+    def remove_picture(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch('/api/profile/', {'profile_picture': ''}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_replaced_pictures_are_deleted_once_unused(self):
+        shared = self.upload(self.alice, png('red'))
+        self.assertEqual(self.upload(self.bob, png('red')), shared)
+        self.assertEqual(len(avatars.stored_names(shared)), 1 + len(avatars.VARIANT_SIZES))
+        self.age(shared)
+
+        self.upload(self.alice, png('blue'))
+        self.assertEqual(len(avatars.stored_names(shared)), 1 + len(avatars.VARIANT_SIZES))
+
+        self.remove_picture(self.bob)
+        self.assertEqual(avatars.stored_names(shared), [])
+
+    def test_pictures_stored_again_lately_are_kept(self):
+        picture = self.upload(self.alice, png('red'))
+        self.age(picture)
+        # Someone else's upload of the same picture, not committed yet
+        self.assertEqual(avatars.save_avatar(png('red'), 'image/png'), picture)
+        self.remove_picture(self.alice)
+        self.assertEqual(len(avatars.stored_names(picture)), 1 + len(avatars.VARIANT_SIZES))
+
+    def test_uploads_write_back_a_picture_deleted_before_their_commit(self):
+        picture = self.upload(self.alice, png('red'))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.assertEqual(avatars.store_upload(png('red'))[0], picture)
+                UserProfile.objects.filter(user=self.bob).update(avatar_hash=picture, profile_picture_content_type='image/png')
+                # Deleted by the removal of Alice's picture, which did not see Bob's yet
+                for name in avatars.stored_names(picture):
+                    default_storage.delete(name)
+        self.assertEqual(len(avatars.stored_names(picture)), 1 + len(avatars.VARIANT_SIZES))
+
+    def test_purge_deletes_old_unused_files(self):
+        used = self.upload(self.alice, png('red'))
+        unused = avatars.save_avatar(png('green'), 'image/png')
+        fresh = avatars.save_avatar(png('blue'), 'image/png')
+        self.age(used, unused)
+
+        call_command('purge_unused_avatars', stdout=io.StringIO())
+        self.assertEqual(avatars.stored_names(unused), [])
+        self.assertEqual(len(avatars.stored_names(fresh)), 1)
+        self.assertEqual(len(avatars.stored_names(used)), 1 + len(avatars.VARIANT_SIZES))
+
+    def assert_stored_without_metadata(self, avatar_hash):
+        with default_storage.open(avatars.avatar_name(avatar_hash, 'jpg'), 'rb') as f, Image.open(f) as image:
+            self.assertEqual(dict(image.getexif()), {})
+            self.assertNotIn('comment', image.info)
+            # Turned upright according to the dropped orientation
+            self.assertEqual(image.size, (40, 80))
+
+    def test_originals_are_stored_without_metadata(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch('/api/profile/', {
+                'profile_picture': base64.b64encode(jpeg_with_location()).decode(),
+                'profile_picture_content_type': 'image/gif',
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['profile_picture_content_type'], 'image/jpeg')
+        self.assert_stored_without_metadata(UserProfile.objects.get(user=self.alice).avatar_hash)
+
+        response = client.patch('/api/profile/', {'profile_picture_content_type': 'image/gif'}, format='json')
+        self.assertEqual(response.json()['profile_picture_content_type'], 'image/jpeg')
+
+    def test_animated_originals_keep_their_frames(self):
+        frames = [Image.new('RGB', (32, 32), color) for color in ('red', 'green', 'blue')]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:], duration=[50, 60, 70], comment=b'home')
+        with avatars.strip_metadata(io.BytesIO(buffer.getvalue())) as clean, Image.open(clean) as image:
+            self.assertEqual(image.n_frames, 3)
+            self.assertNotIn('comment', image.info)
+            durations = []
+            for frame in range(3):
+                image.seek(frame)
+                durations.append(image.info['duration'])
+            self.assertEqual(durations, [50, 60, 70])
+
+    def test_uploads_over_the_pixel_cap_of_all_frames_are_refused(self):
+        # Each frame is within the cap, all of them together are not
+        frames = [Image.new('RGB', (100, 100), color) for color in ('red', 'green', 'blue')]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True, append_images=frames[1:])
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        with mock.patch.object(avatars, 'MAX_PIXELS', 20_000):
+            response = client.put('/api/profile/picture/', buffer.getvalue(), content_type='image/gif')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('3 frames of 100x100', response.json()['error'])
+            with mock.patch.object(avatars, 'MAX_FRAMES', 2):
+                response = client.put('/api/profile/picture/', buffer.getvalue(), content_type='image/gif')
+            self.assertEqual(response.status_code, 400)
+        self.assertIsNone(UserProfile.objects.get(user=self.alice).avatar_hash)
+        self.assertFalse(default_storage.exists(avatars.AVATAR_DIR))
+
+    def test_uploads_over_the_size_limit_are_refused_before_reading(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        with override_settings(AVATAR_MAX_UPLOAD_SIZE=1000):
+            response = client.put('/api/profile/picture/', png('red') + b'\0' * 1000, content_type='image/png')
+        self.assertEqual(response.status_code, 413)
+
+    def test_strip_command_stores_old_originals_again(self):
+        old_hash = avatars.save_avatar(jpeg_with_location(), 'image/jpeg')
+        self.age(old_hash)
+        UserProfile.objects.filter(user__in=[self.alice, self.bob]).update(
+            avatar_hash=old_hash, profile_picture_content_type='image/jpeg',
+        )
+        call_command('strip_avatar_metadata', stdout=io.StringIO())
+        new_hashes = set(UserProfile.objects.values_list('avatar_hash', flat=True))
+        self.assertEqual(len(new_hashes), 1)
+        new_hash = new_hashes.pop()
+        self.assertNotEqual(new_hash, old_hash)
+        self.assert_stored_without_metadata(new_hash)
+        self.assertEqual(len(avatars.stored_names(new_hash)), 1 + len(avatars.VARIANT_SIZES))
+        self.assertEqual(avatars.stored_names(old_hash), [])
+
+
+class UserProfileUpdateTests(TestCase):
+    def test_rename_does_not_overwrite_other_fields_of_a_stale_user(self):
+        user = User.objects.create_user('alice', email='old@example.com', password='old password')
+        UserProfile.objects.create(user=user)
+        stale = User.objects.get(id=user.id)
+        # Changed elsewhere after the cached copy was loaded
+        User.objects.filter(id=user.id).update(email='new@example.com', is_active=False)
+
+        client = APIClient()
+        client.force_authenticate(stale)
+        response = client.patch('/api/profile/', {'first_name': 'Alice', 'last_name': 'Liddell'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.last_name), ('Alice', 'Liddell'))
+        self.assertEqual(user.email, 'new@example.com')
+        self.assertFalse(user.is_active)
+
+
+class ClientIpTests(SimpleTestCase):
+    def ip(self, forwarded=None, proxies=1):
+        headers = {'HTTP_X_FORWARDED_FOR': forwarded} if forwarded is not None else {}
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', **headers)
+        with override_settings(TRUSTED_PROXY_COUNT=proxies):
+            return client_ip(request)
+
+    def test_client_is_read_from_the_trusted_proxies_entries(self):
+        self.assertEqual(self.ip('203.0.113.7'), '203.0.113.7')
+        # Entries left of the proxies' own are written by the client
+        self.assertEqual(self.ip('198.51.100.1, 203.0.113.7'), '203.0.113.7')
+        self.assertEqual(self.ip('198.51.100.1, 203.0.113.7, 10.0.0.2', proxies=2), '203.0.113.7')
+        self.assertEqual(self.ip('2001:db8::1'), '2001:db8::1')
+
+    def test_forwarded_header_is_ignored_by_default(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='1.2.3.4', HTTP_X_FORWARDED_FOR='6.6.6.6')
+        self.assertEqual(client_ip(request), '1.2.3.4')
+
+    def test_remote_addr_is_used_without_proxies_or_header(self):
+        self.assertEqual(self.ip('203.0.113.7', proxies=0), '10.0.0.1')
+        self.assertEqual(self.ip(), '10.0.0.1')
+        self.assertEqual(self.ip(''), '10.0.0.1')
+        self.assertEqual(self.ip('not an address'), '10.0.0.1')
+
+
+@override_settings(TRUSTED_PROXY_COUNT=1, LOGIN_MAX_FAILURES_PER_USERNAME=100, LOGIN_MAX_FAILURES_PER_IP=2)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def login(self, forwarded):
+        return APIClient().post(
+            '/api/token/', {'username': 'nobody', 'password': 'wrong'}, format='json',
+            REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=forwarded,
+        )
+
+    def test_failures_are_counted_per_client_behind_the_proxy(self):
+        for _ in range(2):
+            self.assertEqual(self.login('203.0.113.7').status_code, 401)
+        self.assertEqual(self.login('203.0.113.7').status_code, 429)
+        # Same proxy, another client
+        self.assertEqual(self.login('203.0.113.8').status_code, 401)
+        # A forged entry in front does not give the client a fresh counter
+        self.assertEqual(self.login('198.51.100.1, 203.0.113.7').status_code, 429)
+
+    def test_any_username_gives_a_valid_cache_key(self):
+        for username in ('name with spaces', 'x' * 300, 5, ['a'], None):
+            with self.subTest(username=username):
+                for key in login_throttle._keys(username, '203.0.113.7'):
+                    cache.validate_key(key)
+                    self.assertLessEqual(len(key), 250)
+                    self.assertNotIn(' ', key)
+                login_throttle.record_failure(username, '203.0.113.7')
+                self.assertFalse(login_throttle.is_throttled(username, '203.0.113.9'))
+
+    def test_non_string_username_is_refused_without_error(self):
+        response = APIClient().post('/api/token/', {'username': 5, 'password': 'wrong'}, format='json')
+        self.assertIn(response.status_code, (400, 401))
+
+
+@override_settings(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_MAX_PENDING=2)
+class HashPoolLimitTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_pending_slots_are_shared_through_the_cache(self):
+        # Held by requests of other web processes
+        slots = [passwords._acquire_slot() for _ in range(2)]
+        self.assertNotIn(None, slots)
+        self.assertIsNone(passwords._acquire_slot())
+        with self.assertRaises(passwords.HashPoolBusy):
+            passwords.hash_password('secret')
+        passwords._release_slot(slots[0])
+        self.assertIsNotNone(passwords._acquire_slot())
+
+
+class FollowerAccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+        self.entry = BlogEntry.objects.create(author=self.bob, title='Friends only', content='', visibility='friends')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_removed_follower_loses_access_at_once(self):
+        url = f'/api/blog/{self.entry.id}/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.get(f'/api/blog/comments/{self.entry.id}/').status_code, 200)
+        self.assertIn(self.bob.id, social_cache.following_ids(self.alice.id))
+
+        # Removed by another process: this one's cache is not told
+        Friendship.objects.filter(user=self.bob, follower=self.alice).delete()
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(f'/api/blog/comments/{self.entry.id}/').status_code, 403)
+        self.assertEqual(self.client.post(f'/api/blog/like/{self.entry.id}/').status_code, 403)
+
+    def test_sets_read_before_an_invalidation_are_not_served_after_it(self):
+        stale = [self.bob.id]
+
+        class ReadBeforeUnfollow:
+            def __iter__(inner):
+                # The friendship goes away while this reader is on its way to the cache
+                Friendship.objects.filter(user=self.bob, follower=self.alice).delete()
+                social_cache.invalidate(self.bob.id, self.alice.id)
+                return iter(stale)
+
+        self.assertEqual(
+            social_cache._load(social_cache.FOLLOWING_KEY, self.alice.id, ReadBeforeUnfollow()),
+            frozenset(stale),
+        )
+        self.assertEqual(social_cache.following_ids(self.alice.id), frozenset())
+
+
+class EntryAccessTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+        self.entries = {
+            visibility: BlogEntry.objects.create(author=self.bob, title=visibility, content='', visibility=visibility)
+            for visibility in ('public', 'friends', 'journal')
+        }
+
+    def test_denials_by_viewer_and_visibility(self):
+        expected = {
+            # viewer: (public, friends, journal) view denials
+            'author': (None, None, None),
+            'follower': (None, None, JOURNAL),
+            'user': (None, NOT_FRIENDS, JOURNAL),
+            'anonymous': (None, LOGIN_REQUIRED, JOURNAL),
+        }
+        for viewer in (self.bob, self.alice, self.carol, AnonymousUser()):
+            access = EntryAccess(viewer)
+            viewer_class = access.viewer_class(self.entries['public'])
+            denials = tuple(access.view_denial(self.entries[v]) for v in ('public', 'friends', 'journal'))
+            with self.subTest(viewer=viewer_class):
+                self.assertEqual(denials, expected[viewer_class])
+                self.assertEqual(access.can_like(self.entries['friends']), denials[1] is None)
+                # Nobody comments on journal entries, not even their author
+                self.assertEqual(access.comment_denial(self.entries['journal']), JOURNAL)
+
+    def test_entries_and_follows_are_loaded_once_per_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.alice
+        access = EntryAccess.for_request(request)
+        self.assertIs(EntryAccess.for_request(request), access)
+        # One query per entry and one for the follow, however often they are checked
+        with self.assertNumQueries(3):
+            for _ in range(2):
+                for visibility in ('public', 'friends'):
+                    entry = access.get_entry(self.entries[visibility].id)
+                    self.assertTrue(access.can_view(entry))
+            self.assertEqual(entry.author.username, 'bob')
+        self.assertEqual(access.viewer_class(entry), 'follower')
+
+    def test_missing_entries_are_not_found(self):
+        access = EntryAccess(self.alice)
+        with self.assertRaises(BlogEntry.DoesNotExist):
+            access.get_entry(self.entries['journal'].id + 100)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        self.assertEqual(client.get(f"/api/blog/{self.entries['journal'].id + 100}/").status_code, 404)
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        for user in (self.alice, self.bob, self.carol):
+            UserProfile.objects.create(user=user)
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def create(self, author, title, visibility):
+        response = self.client_for(author).post('/api/blog/create/', {'title': title, 'content': 'Text', 'visibility': visibility}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return BlogEntry.objects.get(author=author, title=title)
+
+    def timeline(self, user):
+        return set(TimelineEntry.objects.filter(owner=user).values_list('blog_entry_id', flat=True))
+
+    def feed(self, user):
+        ids = list(BlogEntry.objects.visible_to(user, timeline=True).values_list('id', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+        return set(ids)
+
+    def test_friends_only_entries_are_fanned_out_to_followers(self):
+        friends = self.create(self.bob, 'Friends', 'friends')
+        public = self.create(self.bob, 'Public', 'public')
+        self.assertEqual(self.timeline(self.alice), {friends.id})
+        self.assertEqual(self.timeline(self.carol), set())
+        self.assertIn(friends.id, self.feed(self.alice))
+        self.assertEqual(self.feed(self.carol), {public.id})
+
+    def test_accepting_a_request_backfills_and_unfollowing_removes(self):
+        friends = self.create(self.bob, 'Friends', 'friends')
+        request = FriendRequest.objects.create(sender=self.carol, receiver=self.bob)
+        response = self.client_for(self.bob).post(f'/api/friend-requests/accept/{request.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timeline(self.carol), {friends.id})
+
+        response = self.client_for(self.carol).delete(f'/api/unfollow/{self.bob.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timeline(self.carol), set())
+        self.assertNotIn(friends.id, self.feed(self.carol))
+
+    def test_removing_a_follower_removes_from_their_timeline(self):
+        friends = self.create(self.bob, 'Friends', 'friends')
+        response = self.client_for(self.bob).delete(f'/api/remove-follower/{self.alice.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.timeline(self.alice), set())
+        self.assertNotIn(friends.id, self.feed(self.alice))
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+    def test_authors_with_many_followers_are_read_at_read_time(self):
+        Friendship.objects.create(user=self.bob, follower=self.carol)
+        friends = self.create(self.bob, 'Friends', 'friends')
+        self.assertTrue(UserProfile.objects.get(user=self.bob).timeline_fanout_on_read)
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+        self.assertIn(friends.id, self.feed(self.alice))
+        self.assertIn(friends.id, self.feed(self.carol))
+
+        # New followers are not backfilled either, their feed still has the entry
+        timeline.backfill_follower(self.bob, self.carol)
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+
+    def test_visibility_changes_of_a_fanned_out_entry(self):
+        entry = self.create(self.bob, 'Friends', 'friends')
+        BlogEntry.objects.filter(id=entry.id).update(visibility='journal')
+        self.assertNotIn(entry.id, self.feed(self.alice))
+        BlogEntry.objects.filter(id=entry.id).update(visibility='public')
+        self.assertIn(entry.id, self.feed(self.alice))
+        self.assertIn(entry.id, self.feed(self.carol))
+        BlogEntry.objects.filter(id=entry.id).update(visibility='friends')
+        self.assertIn(entry.id, self.feed(self.alice))
+        self.assertNotIn(entry.id, self.feed(self.carol))
+
+    def test_migration_backfills_existing_entries(self):
+        friends = BlogEntry.objects.create(author=self.bob, title='Friends', content='', visibility='friends')
+        BlogEntry.objects.create(author=self.bob, title='Public', content='')
+        migration = importlib.import_module('api.migrations.0009_timelineentry')
+        migration.backfill_timelines(apps, None)
+        migration.backfill_timelines(apps, None)
+        self.assertEqual(list(TimelineEntry.objects.values_list('owner_id', 'blog_entry_id')), [(self.alice.id, friends.id)])
+
+
+class EngagementCounterTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.entry = BlogEntry.objects.create(author=self.bob, title='Entry', content='')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def counts(self):
+        self.entry.refresh_from_db()
+        return self.entry.like_count, self.entry.comment_count
+
+    def test_likes_and_comments_move_the_counters(self):
+        url = f'/api/blog/like/{self.entry.id}/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(self.counts(), (1, 0))
+
+        response = self.client.post(f'/api/blog/comment/{self.entry.id}/', {'content': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        comment = BlogComment.objects.get(blog_entry=self.entry)
+        self.assertEqual(self.counts(), (1, 1))
+
+        self.assertEqual(self.client.post(f'/api/comment/like/{comment.id}/').status_code, 201)
+        comment.refresh_from_db()
+        self.assertEqual(comment.like_count, 1)
+        self.assertEqual(self.client.delete(f'/api/comment/like/{comment.id}/').status_code, 204)
+        comment.refresh_from_db()
+        self.assertEqual(comment.like_count, 0)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(self.client.delete(f'/api/blog/comment/{self.entry.id}/{comment.id}/').status_code, 204)
+        self.assertEqual(self.counts(), (0, 0))
+
+    def race(self, model):
+        """Make delete() of `model` find its row already deleted by a concurrent request."""
+        original = model.delete
+
+        def delete(instance, *args, **kwargs):
+            model.objects.filter(pk=instance.pk).delete()
+            return original(instance, *args, **kwargs)
+
+        return mock.patch.object(model, 'delete', delete)
+
+    def test_counters_only_drop_when_this_request_deleted_the_row(self):
+        BlogLike.objects.create(blog_entry=self.entry, user=self.alice)
+        comment = BlogComment.objects.create(blog_entry=self.entry, author=self.alice, content='Hi')
+        CommentLike.objects.create(comment=comment, user=self.alice)
+        BlogEntry.objects.filter(id=self.entry.id).update(like_count=1, comment_count=1)
+        BlogComment.objects.filter(id=comment.id).update(like_count=1)
+
+        with self.race(BlogLike):
+            self.client.delete(f'/api/blog/like/{self.entry.id}/')
+        with self.race(CommentLike):
+            self.client.delete(f'/api/comment/like/{comment.id}/')
+        comment.refresh_from_db()
+        self.assertEqual(comment.like_count, 1)
+        with self.race(BlogComment):
+            self.client.delete(f'/api/blog/comment/{self.entry.id}/{comment.id}/')
+        # The concurrent requests that did delete the rows decrement them
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_recompute_counters_fixes_drifted_counters(self):
+        BlogLike.objects.create(blog_entry=self.entry, user=self.alice)
+        comment = BlogComment.objects.create(blog_entry=self.entry, author=self.alice, content='Hi')
+        BlogEntry.objects.filter(id=self.entry.id).update(like_count=5, comment_count=0)
+        BlogComment.objects.filter(id=comment.id).update(like_count=3)
+        out = io.StringIO()
+        call_command('recompute_counters', stdout=out)
+        self.assertEqual(self.counts(), (1, 1))
+        comment.refresh_from_db()
+        self.assertEqual(comment.like_count, 0)
+        self.assertIn('BlogEntry.like_count: 1 row(s) corrected', out.getvalue())
+        call_command('recompute_counters', stdout=out)
+        self.assertIn('BlogComment.like_count: 0 row(s) corrected', out.getvalue())
+
+
+class RevocationTests(TestCase):
+    def setUp(self):
+        revocation._store.clear()
+        self.addCleanup(revocation._store.clear)
+        self.user = User.objects.create_user('alice')
+        self.client = APIClient()
+
+    def refresh(self, token):
+        self.client.cookies[settings.SIMPLE_JWT['AUTH_COOKIE_REFRESH']] = str(token)
+        return self.client.post('/api/token/refresh/')
+
+    def test_rotated_token_cannot_be_reused(self):
+        token = RefreshToken.for_user(self.user)
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, 200)
+        rotated = response.cookies[settings.SIMPLE_JWT['AUTH_COOKIE_REFRESH']].value
+        self.assertNotEqual(rotated, str(token))
+
+        self.assertEqual(self.refresh(token).status_code, 401)
+        self.assertEqual(self.refresh(rotated).status_code, 200)
+
+    def test_refresh_after_logout_is_refused(self):
+        token = RefreshToken.for_user(self.user)
+        self.client.cookies[settings.SIMPLE_JWT['AUTH_COOKIE_REFRESH']] = str(token)
+        self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        self.assertTrue(revocation.is_revoked(token))
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_bloom_false_positive_falls_back_to_the_database(self):
+        token = RefreshToken.for_user(self.user)
+        with mock.patch.object(BloomFilter, '__contains__', return_value=True):
+            self.assertTrue(revocation._store.might_be_revoked(token['jti']))
+            self.assertFalse(revocation.is_revoked(token))
+            self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertTrue(RevokedToken.objects.filter(jti=token['jti']).exists())
+
+    def test_revoke_after_clear_reloads_the_filter(self):
+        token = RefreshToken.for_user(self.user)
+        with mock.patch.object(revocation.RevocationStore, 'is_revoked', return_value=False):
+            self.assertTrue(revocation.revoke(token))
+        self.assertTrue(revocation.is_revoked(token))
+        self.assertFalse(revocation.revoke(token))
+
+
+class ConditionalResponseTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.entry = BlogEntry.objects.create(author=self.bob, title='Entry', content='Text', visibility='public')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_matching_etag_gets_304_until_the_entry_is_liked(self):
+        for url in (f'/api/blog/{self.entry.id}/', f'/api/blog/like-count/{self.entry.id}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                self.assertIn('Cookie', response['Vary'])
+
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                self.assertIn('Cookie', response['Vary'])
+
+                self.client.post(f'/api/blog/like/{self.entry.id}/')
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                self.client.delete(f'/api/blog/like/{self.entry.id}/')
+
+    def test_etag_differs_per_viewer_class(self):
+        etag = self.client.get(f'/api/blog/{self.entry.id}/')['ETag']
+        author = APIClient()
+        author.force_authenticate(self.bob)
+        response = author.get(f'/api/blog/{self.entry.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        for user in (self.alice, self.bob):
+            UserProfile.objects.create(user=user)
+        self.public = BlogEntry.objects.create(author=self.bob, title='Zq public', content='', visibility='public')
+        self.friends = BlogEntry.objects.create(author=self.bob, title='Zq friends', content='', visibility='friends')
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+
+    def search(self, query, user=None):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        response = client.get('/api/search/', {'q': query, 'blog_page_size': 10})
+        self.assertEqual(response.status_code, 200)
+        return [entry['id'] for entry in response.data['blog_entries']['results']]
+
+    def test_public_results_are_shared_and_private_ones_merged_per_viewer(self):
+        self.assertEqual(self.search('zq'), [self.public.id])
+        misses = search_cache.stats()['misses']
+        # Same normalized query: served from the cache, plus the follower's friends-only match
+        self.assertEqual(self.search('  ZQ ', self.alice), [self.friends.id, self.public.id])
+        self.assertEqual(search_cache.stats()['misses'], misses)
+        self.assertEqual(self.search('zq', self.bob), [self.friends.id, self.public.id])
+        self.assertEqual(self.search('zq'), [self.public.id])
+        self.assertGreaterEqual(search_cache.stats()['hits'], 3)
+
+    def test_new_entries_invalidate_cached_results(self):
+        self.assertEqual(self.search('zq'), [self.public.id])
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/blog/create/', {'title': 'Zq new', 'content': 'Text', 'visibility': 'public'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.search('zq'), [response.data['id'], self.public.id])
+
+    def test_missing_query_and_stats_for_non_staff_are_refused(self):
+        self.assertEqual(APIClient().get('/api/search/', {'q': ' '}).status_code, 400)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        self.assertEqual(client.get('/api/search/cache-stats/').status_code, 403)
+
+
+class AsyncSearchViewTests(TransactionTestCase):
+    # The two halves of the search run in worker threads with their own connections
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob', first_name='Zq')
+        for user in (self.alice, self.bob):
+            UserProfile.objects.create(user=user)
+        BlogEntry.objects.create(author=self.bob, title='Zq public', content='', visibility='public')
+        BlogEntry.objects.create(author=self.bob, title='Zq friends', content='', visibility='friends')
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+
+    def test_same_results_as_the_sync_view(self):
+        self.client.cookies[settings.SIMPLE_JWT['AUTH_COOKIE']] = str(AccessToken.for_user(self.alice))
+        params = {'q': 'zq', 'blog_page_size': 10}
+        expected = self.client.get('/api/search/', params).json()
+        response = self.client.get('/api/search/async/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(response.json()['blog_entries']['count'], 2)
+        self.assertEqual([user['id'] for user in response.json()['users']['results']], [self.bob.id])
+
+    def test_halves_run_at_the_same_time(self):
+        # Each half waits for the other: run one after the other, the barrier would time out
+        barrier = threading.Barrier(2, timeout=5)
+
+        def half(*args):
+            barrier.wait()
+            return {'count': 0, 'results': []}
+
+        with mock.patch.object(blog_views, '_search_users_page', half), \
+                mock.patch.object(blog_views, '_search_entries_page', half):
+            response = self.client.get('/api/search/async/', {'q': 'zq'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_query_and_bad_parameters_are_reported(self):
+        response = self.client.get('/api/search/async/', {'q': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Search query is required'})
+        response = self.client.get('/api/search/async/', {'q': 'zq', 'user_page': 'x'})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('error', response.json())
+
+
+class ImportUsersTests(TestCase):
+    def write(self, name, text):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_valid_rows_are_created_and_bad_ones_reported(self):
+        User.objects.create_user('taken')
+        path = self.write('users.csv', (
+            'username,email,password,first_name\n'
+            'carol,carol@example.com,s3cret-pass,Carol\n'
+            'dave,not-an-email,,\n'
+            'taken,,,\n'
+            ',nobody@example.com,,\n'
+            'erin,,,Erin\n'
+            'carol,,,\n'
+        ))
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_users', path, batch_size=2, workers=1, stdout=out, stderr=err)
+
+        carol = User.objects.get(username='carol')
+        self.assertEqual((carol.email, carol.first_name), ('carol@example.com', 'Carol'))
+        self.assertTrue(carol.check_password('s3cret-pass'))
+        erin = User.objects.get(username='erin')
+        self.assertFalse(erin.has_usable_password())
+        self.assertFalse(User.objects.filter(username='dave').exists())
+        self.assertEqual(
+            set(UserProfile.objects.values_list('user__username', flat=True)), {'carol', 'erin'}
+        )
+
+        errors = err.getvalue()
+        self.assertIn('Line 3: Enter a valid email address.', errors)
+        self.assertIn("Line 4: username 'taken' is taken", errors)
+        self.assertIn('Line 5: Missing username', errors)
+        self.assertIn("Line 7: username 'carol' is taken", errors)
+        self.assertIn('Created 2 users (2 duplicates, 2 invalid rows skipped)', out.getvalue())
+
+    def test_ndjson_rows_that_are_not_objects_are_invalid(self):
+        path = self.write('users.jsonl', '{"username": "frank"}\n\n[1, 2]\nnot json\n')
+        err = io.StringIO()
+        call_command('import_users', path, workers=1, stdout=io.StringIO(), stderr=err)
+        self.assertTrue(UserProfile.objects.filter(user__username='frank').exists())
+        self.assertIn('Line 3: Not a JSON object', err.getvalue())
+        self.assertIn('Line 4: Not a JSON object', err.getvalue())
+
+    def test_unknown_format_is_refused(self):
+        path = self.write('users.txt', 'username\ngrace\n')
+        with self.assertRaisesMessage(CommandError, 'Cannot tell the input format'):
+            call_command('import_users', path)
+        self.assertFalse(User.objects.filter(username='grace').exists())
+
+
+class BlogEngagementTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.public = BlogEntry.objects.create(author=self.bob, title='Public', content='', visibility='public')
+        self.friends = BlogEntry.objects.create(author=self.bob, title='Friends', content='', visibility='friends')
+        self.journal = BlogEntry.objects.create(author=self.bob, title='Journal', content='', visibility='journal')
+        BlogLike.objects.create(blog_entry=self.public, user=self.alice)
+        BlogEntry.objects.filter(id=self.public.id).update(like_count=1, comment_count=4)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def engagement(self, ids, client=None):
+        response = (client or self.client).get('/api/blog/engagement/', {'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        return sorted(response.data['results'], key=lambda result: result['id'])
+
+    def test_counts_and_liked_flags_of_visible_entries_in_two_queries(self):
+        ids = f'{self.public.id},{self.friends.id},{self.journal.id},{self.journal.id + 100}'
+        with self.assertNumQueries(2):
+            results = self.engagement(ids)
+        self.assertEqual(results, [
+            {'id': self.public.id, 'like_count': 1, 'comment_count': 4, 'viewer_has_liked': True},
+        ])
+
+        Friendship.objects.create(user=self.bob, follower=self.alice)
+        self.assertEqual([result['id'] for result in self.engagement(ids)], [self.public.id, self.friends.id])
+        self.assertEqual(
+            self.engagement(ids, APIClient()),
+            [{'id': self.public.id, 'like_count': 1, 'comment_count': 4, 'viewer_has_liked': False}],
+        )
+
+    def test_bad_ids_are_refused(self):
+        for ids in ('', '1,x', ','.join(str(i) for i in range(1, 102))):
+            with self.subTest(ids=ids[:10]):
+                response = self.client.get('/api/blog/engagement/', {'ids': ids})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = User.objects.create_user('alice')
+
+    def verified(self):
+        return mock.patch.object(token_cache, 'AccessToken', wraps=AccessToken)
+
+    def test_tokens_are_verified_once_until_they_expire(self):
+        raw = str(AccessToken.for_user(self.user))
+        with self.verified() as verify:
+            first = token_cache.access_token(raw)
+            self.assertIs(token_cache.access_token(raw), first)
+            self.assertEqual(verify.call_count, 1)
+            with mock.patch.object(token_cache.time, 'time', return_value=first['exp'] + 1):
+                token_cache.access_token(raw)
+            self.assertEqual(verify.call_count, 2)
+
+    def test_bad_and_expired_tokens_are_refused_and_not_kept(self):
+        expired = AccessToken.for_user(self.user)
+        expired.set_exp(from_time=timezone.now() - timedelta(hours=2))
+        for raw in (str(expired), 'not-a-token', str(AccessToken.for_user(self.user))[:-2] + 'xx'):
+            with self.assertRaises(TokenError):
+                token_cache.access_token(raw)
+        self.assertEqual(len(token_cache._tokens), 0)
+
+        client = APIClient()
+        client.cookies[settings.SIMPLE_JWT['AUTH_COOKIE']] = str(expired)
+        self.assertEqual(client.get('/api/blog/my/').status_code, 401)
+        client.cookies[settings.SIMPLE_JWT['AUTH_COOKIE']] = str(AccessToken.for_user(self.user))
+        self.assertEqual(client.get('/api/blog/my/').status_code, 200)
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.clear()
+        self.addCleanup(cache.clear)
+        self.addCleanup(user_cache.clear)
+        self.user = User.objects.create_user('alice')
+        self.client = APIClient()
+        self.client.cookies[settings.SIMPLE_JWT['AUTH_COOKIE']] = str(AccessToken.for_user(self.user))
+
+    def saved_elsewhere(self, user):
+        """Save `user` as another process would: this process's entry is not cleared."""
+        with mock.patch.object(user_cache, 'invalidate'), self.captureOnCommitCallbacks(execute=True):
+            user.save()
+
+    def test_users_are_loaded_once_until_they_change(self):
+        user_cache.get_user(self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_cache.get_user(self.user.id).username, 'alice')
+        self.user.first_name = 'Alice'
+        self.saved_elsewhere(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(user_cache.get_user(self.user.id).first_name, 'Alice')
+
+    def test_user_deactivated_by_another_process_is_refused(self):
+        self.assertEqual(self.client.get('/api/blog/my/').status_code, 200)
+        self.user.is_active = False
+        self.saved_elsewhere(self.user)
+        self.assertEqual(self.client.get('/api/blog/my/').status_code, 401)
+
+    def test_users_read_before_a_change_are_not_served_after_it(self):
+        stale = User.objects.get(id=self.user.id)
+
+        def get_then_deactivate(**kwargs):
+            # Deactivated while this reader is on its way to the cache
+            self.user.is_active = False
+            self.saved_elsewhere(self.user)
+            return stale
+
+        with mock.patch.object(User.objects, 'get', get_then_deactivate):
+            self.assertTrue(user_cache.get_user(self.user.id).is_active)
+        self.assertFalse(user_cache.get_user(self.user.id).is_active)
+
+    def test_missing_users_raise(self):
+        with self.assertRaises(User.DoesNotExist):
+            user_cache.get_user(self.user.id + 100)
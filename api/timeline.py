@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import models
+
+from .models import BlogEntry, Friendship, TimelineEntry, UserProfile
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def fanout_max_followers():
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 5000)
+
+
+def is_fanout_on_read(author):
+    return UserProfile.objects.filter(user=author, timeline_fanout_on_read=True).exists()
+
+
+def fan_out_entry(blog_entry):
+    """
+    Push a freshly saved friends-only entry into the timelines of the author's followers.
+
+    Authors above TIMELINE_FANOUT_MAX_FOLLOWERS are switched to fan-out on read
+    instead; their friends-only entries are then picked up by timeline_q().
+    """
+    if blog_entry.visibility != 'friends':
+        return 0
+
+    author = blog_entry.author
+    if is_fanout_on_read(author):
+        return 0
+
+    follower_ids = list(
+        Friendship.objects.filter(user=author).values_list('follower_id', flat=True)[:fanout_max_followers() + 1]
+    )
+    if len(follower_ids) > fanout_max_followers():
+        UserProfile.objects.filter(user=author).update(timeline_fanout_on_read=True)
+        return 0
+
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                owner_id=follower_id,
+                blog_entry=blog_entry,
+                author=author,
+                created_at=blog_entry.created_at,
+            )
+            for follower_id in follower_ids
+        ],
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    return len(follower_ids)
+
+
+def backfill_follower(user, follower):
+    """Copy the friends-only entries of `user` into the timeline of a new follower."""
+    if is_fanout_on_read(user):
+        return
+
+    entries = BlogEntry.objects.filter(author=user, visibility='friends').values_list('id', 'created_at')
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(
+                owner=follower,
+                blog_entry_id=entry_id,
+                author=user,
+                created_at=created_at,
+            )
+            for entry_id, created_at in entries.iterator(chunk_size=FANOUT_BATCH_SIZE)
+        ],
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def remove_follower(user, follower):
+    """Drop the entries of `user` from the timeline of someone who no longer follows them."""
+    TimelineEntry.objects.filter(owner=follower, author=user).delete()
+
+
+def timeline_q(user):
+    """
+    Friends-only entries visible to `user`, without joining through friendships.
+
+    Entries fanned out on write come from the timeline table; authors on
+    fan-out on read are matched through a small IN subquery. Timeline rows
+    are kept when an entry's visibility changes, so the visibility is checked
+    here too: an entry made public or journal drops out of this branch, and
+    comes back if it is made friends-only again.
+    """
+    return models.Q(visibility='friends') & (
+        models.Q(id__in=TimelineEntry.objects.filter(owner=user).values('blog_entry_id')) |
+        models.Q(
+            author__in=Friendship.objects.filter(
+                follower=user,
+                user__profile__timeline_fanout_on_read=True,
+            ).values('user_id'),
+        )
+    )
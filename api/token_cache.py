@@ -0,0 +1,45 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+# Most tokens kept per process; the least recently used are dropped first
+MAX_TOKENS = 10_000
+
+_tokens = OrderedDict()  # SHA-256 of the token -> (exp, AccessToken)
+_lock = threading.Lock()
+
+
+def access_token(raw_token):
+    """
+    The verified AccessToken for `raw_token`, like AccessToken(raw_token).
+
+    Browsers send the same access token on every request until it expires, so
+    verified tokens are remembered in a per-process LRU keyed by their SHA-256,
+    and a token seen before skips decoding and signature verification. An
+    entry is only used until the token's `exp`; after that the token is
+    verified again, which rejects it as expired. Raises TokenError.
+    """
+    key = hashlib.sha256(raw_token.encode('utf-8')).digest()
+    now = time.time()
+    with _lock:
+        cached = _tokens.get(key)
+        if cached is not None:
+            if cached[0] > now:
+                _tokens.move_to_end(key)
+                return cached[1]
+            del _tokens[key]
+
+    token = AccessToken(raw_token)
+    with _lock:
+        _tokens[key] = (token['exp'], token)
+        while len(_tokens) > MAX_TOKENS:
+            _tokens.popitem(last=False)
+    return token
+
+
+def clear():
+    with _lock:
+        _tokens.clear()
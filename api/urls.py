@@ -15,7 +15,11 @@ from .views.blog_views import (
     GetCommentLikeCountView,
     GetBlogCommentCountView,
     GetBlogEntryView,
-    SearchView
+    BlogEngagementView,
+    SearchView,
+    AsyncSearchView,
+    SearchCacheStatsView,
+    UserAutocompleteView
 )
 from .views.social_views import (
     SendFriendRequestAPIView,
@@ -31,7 +35,7 @@ from .views.social_views import (
 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from .views.views import CookieTokenRefreshView, CookieTokenObtainPairView, LogoutView, CurrentUserView, UserProfileView
+from .views.views import CookieTokenRefreshView, CookieTokenObtainPairView, LogoutView, CurrentUserView, UserProfileView, ProfilePictureView, AvatarView, PasswordPoolStatsView
 
 urlpatterns = [
     path('api/sanity/', sanity),
@@ -39,6 +43,7 @@ urlpatterns = [
     path('api/token/', CookieTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', CookieTokenRefreshView.as_view(), name='token_refresh'),
     path('api/logout/', LogoutView.as_view(), name='logout'),
+    path('api/auth/password-pool-stats/', PasswordPoolStatsView.as_view(), name='password-pool-stats'),
     path('api/blog/my/', BlogEntryAPIView.as_view(), name='blog'),
     path('api/blog/all/', VisibleBlogEntriesView.as_view(), name='visible-blog-entries'),
     path('api/blog/user/', BlogEntryQueryAPIView.as_view(), name='blog-query'),
@@ -51,6 +56,7 @@ urlpatterns = [
     path('api/blog/likes/<int:blog_entry_id>/', GetBlogLikesView.as_view(), name='get-blog-likes'),
     path('api/blog/like-count/<int:blog_entry_id>/', GetBlogLikeCountView.as_view(), name='get-blog-like-count'),
     path('api/blog/comment-count/<int:blog_entry_id>/', GetBlogCommentCountView.as_view(), name='get-blog-comment-count'),
+    path('api/blog/engagement/', BlogEngagementView.as_view(), name='blog-engagement'),
     path('api/comment/like/<int:comment_id>/', CommentLikeAPIView.as_view(), name='comment-like'),
     path('api/comment/likes/<int:comment_id>/', GetCommentLikesView.as_view(), name='get-comment-likes'),
     path('api/comment/like-count/<int:comment_id>/', GetCommentLikeCountView.as_view(), name='get-comment-like-count'),
@@ -65,5 +71,11 @@ urlpatterns = [
     path('api/remove-follower/<int:user_id>/', RemoveFollowerAPIView.as_view(), name='remove-follower'),
     path("api/user/", CurrentUserView.as_view(), name="current-user"),
     path("api/profile/", UserProfileView.as_view(), name="user-profile"),
+    path("api/profile/picture/", ProfilePictureView.as_view(), name="profile-picture"),
+    path("api/avatars/<str:avatar_hash>_<int:size>.<str:extension>", AvatarView.as_view(), name="avatar-variant"),
+    path("api/avatars/<str:avatar_hash>.<str:extension>", AvatarView.as_view(), name="avatar"),
     path("api/search/", SearchView.as_view(), name="search"),
+    path("api/search/async/", AsyncSearchView.as_view(), name="search-async"),
+    path("api/search/cache-stats/", SearchCacheStatsView.as_view(), name="search-cache-stats"),
+    path("api/search/users/", UserAutocompleteView.as_view(), name="user-autocomplete"),
 ]
\ No newline at end of file
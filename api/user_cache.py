@@ -0,0 +1,86 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+
+# Most users kept per process; the least recently used are dropped first
+MAX_USERS = 10_000
+
+# Bumped in the shared cache whenever a user is saved or deleted
+VERSION_KEY = 'auth:user:version:{}'
+
+_users = OrderedDict()  # user id -> (expires at, version, user)
+_lock = threading.Lock()
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60)
+
+
+def _version(user_id):
+    return cache.get_or_set(VERSION_KEY.format(user_id), 1, None)
+
+
+def get_user(user_id):
+    """
+    The user with this id, from a per-process cache that keeps users for
+    AUTH_USER_CACHE_TIMEOUT seconds. Each call returns its own copy, so views
+    may change the user they are given; as it may be that many seconds old,
+    they save only the fields they changed (save(update_fields=...)), never
+    the whole row. Raises User.DoesNotExist.
+
+    Saving or deleting a user clears its entry in this process and, once the
+    transaction commits, bumps the user's version in the shared cache (see
+    ApiConfig.ready()). An entry is only used while that version is the one
+    it was loaded under, so a deactivated user is refused by every process
+    on its next request; this costs a cache read per call, not a query.
+    Changes made with QuerySet.update() only show up on expiry.
+    """
+    # Read before the database, so a user loaded just before a change is
+    # kept under the version that change replaces and never served after it
+    version = _version(user_id)
+    now = time.monotonic()
+    with _lock:
+        cached = _users.get(user_id)
+        if cached is not None and cached[0] > now and cached[1] == version:
+            _users.move_to_end(user_id)
+            return copy.copy(cached[2])
+
+    user = User.objects.get(id=user_id)
+    with _lock:
+        _users[user_id] = (now + _timeout(), version, user)
+        _users.move_to_end(user_id)
+        while len(_users) > MAX_USERS:
+            _users.popitem(last=False)
+    return copy.copy(user)
+
+
+def invalidate(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+def clear():
+    with _lock:
+        _users.clear()
+
+
+def _bump(user_id):
+    key = VERSION_KEY.format(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def user_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for User."""
+    user_id = instance.pk
+    invalidate(user_id)
+    # After the commit, or other processes could load the old row again under the new version
+    transaction.on_commit(lambda: _bump(user_id))
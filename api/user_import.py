@@ -0,0 +1,141 @@
+import csv
+import json
+import os
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .models import UserProfile
+from . import passwords, search_cache
+
+# Columns (CSV) or keys (NDJSON) read from each row; only username is required.
+# A row without a password gets an unusable one, so the user must reset it.
+FIELDS = ('username', 'email', 'first_name', 'last_name')
+BATCH_SIZE = 1000
+
+
+def read_csv(stream):
+    """(line number, row) pairs of a CSV file whose first line names the columns."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_ndjson(stream):
+    """(line number, row) pairs of a file with one JSON object per line. Blank lines are skipped."""
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            row = None
+        yield line, row
+
+
+def _clean(row):
+    """The User fields and the password of a row. Raises ValidationError."""
+    if not isinstance(row, dict):
+        raise ValidationError('Not a JSON object')
+    fields = {name: str(row.get(name) or '').strip() for name in FIELDS}
+    fields['username'] = User.normalize_username(fields['username'])
+    fields['email'] = User.objects.normalize_email(fields['email'])
+    if not fields['username']:
+        raise ValidationError('Missing username')
+    for name, value in fields.items():
+        if value:
+            User._meta.get_field(name).run_validators(value)
+    return fields, row.get('password') or None
+
+
+def _check(batch, seen):
+    """Split a batch into rows to create, duplicate usernames and invalid rows."""
+    cleaned, duplicates, invalid = [], [], []
+    for line, row in batch:
+        try:
+            fields, password = _clean(row)
+        except ValidationError as e:
+            invalid.append((line, '; '.join(e.messages)))
+            continue
+        if fields['username'] in seen:
+            duplicates.append((line, fields['username']))
+            continue
+        seen.add(fields['username'])
+        cleaned.append((line, fields, password))
+
+    existing = set(
+        User.objects.filter(username__in=[fields['username'] for _, fields, _ in cleaned])
+        .values_list('username', flat=True)
+    )
+    accepted = []
+    for line, fields, password in cleaned:
+        if fields['username'] in existing:
+            duplicates.append((line, fields['username']))
+        else:
+            accepted.append((line, fields, password))
+    return accepted, duplicates, invalid
+
+
+def _insert(accepted, duplicates, invalid, hashes):
+    users = [User(password=encoded, **fields) for (_, fields, _), encoded in zip(accepted, hashes)]
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+        created = len(users)
+    except IntegrityError:
+        # A username was taken after the batch was checked, e.g. by a signup:
+        # insert this batch one user at a time to find which
+        created = 0
+        with transaction.atomic():
+            for (line, _, _), user in zip(accepted, users):
+                user.pk = None
+                try:
+                    with transaction.atomic():
+                        user.save()
+                        UserProfile.objects.create(user=user)
+                    created += 1
+                except IntegrityError:
+                    duplicates.append((line, user.username))
+    return {'created': created, 'duplicates': duplicates, 'invalid': invalid}
+
+
+def import_users(rows, batch_size=BATCH_SIZE, workers=None):
+    """
+    Create users, and their profiles, from (line number, row) pairs such as
+    read_csv() and read_ndjson() produce. Yields one result per batch of
+    `batch_size` rows: the number of users created, and (line, username)
+    duplicates and (line, message) invalid rows, which are skipped.
+
+    Passwords are hashed on `workers` processes (default: one per CPU); each
+    batch is hashed while the one before it is inserted. A batch goes in with
+    two bulk_create() calls in one transaction. Usernames already taken in
+    the database or earlier in the input are reported as duplicates.
+    """
+    workers = workers or os.cpu_count()
+    pool = passwords.bulk_pool(workers)
+    rows = iter(rows)
+    seen = set()
+    pending = None
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            accepted, duplicates, invalid = _check(batch, seen)
+            hashes = pool.map(
+                make_password,
+                [password for _, _, password in accepted],
+                chunksize=max(1, len(accepted) // (workers * 4)),
+            )
+            if pending is not None:
+                yield _insert(*pending)
+            pending = (accepted, duplicates, invalid, hashes)
+        if pending is not None:
+            yield _insert(*pending)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        search_cache.invalidate()
@@ -1,17 +1,29 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from ..serializers import SignupSerializer, SearchUserSerializer
 from rest_framework.generics import ListCreateAPIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from ..models import BlogEntry, FriendRequest, Friendship, BlogComment, BlogLike, CommentLike
-from ..serializers import BlogEntrySerializer, BlogCommentSerializer, BlogLikeSerializer, CommentLikeSerializer
-from django.db import models
-from django.contrib.auth.models import User
+from ..serializers import BlogEntrySerializer, BlogEntryCardSerializer, BlogEntrySearchResultSerializer, BlogCommentSerializer, BlogLikeSerializer, CommentLikeSerializer
+from django.db import close_old_connections, models, transaction
+from django.db.models import F
+from django.contrib.auth.models import AnonymousUser, User
 from django.db.utils import IntegrityError
 from ..authentication import CookieJWTAuthentication
+from ..client_ip import client_ip
+from ..pagination import paginate, page_number_paginate, count_mode_from_params, InvalidCursor, CursorOrPageNumberPagination
+from .. import search
+from .. import search_cache
+from .. import timeline
+from .. import access as entry_access
+from .. import conditional
+from ..access import EntryAccess
+from asgiref.sync import sync_to_async
+import asyncio
 import logging
 
 logger = logging.getLogger('api')
@@ -19,12 +31,20 @@ logger = logging.getLogger('api')
 class BlogEntryAPIView(ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = BlogEntrySerializer
+    pagination_class = CursorOrPageNumberPagination
 
     def get_queryset(self):
-        return BlogEntry.objects.filter(author=self.request.user)
+        return BlogEntry.objects.filter(author=self.request.user).as_cards(self.request.user)
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return BlogEntryCardSerializer
+        return BlogEntrySerializer
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        blog_entry = serializer.save(author=self.request.user)
+        timeline.fan_out_entry(blog_entry)
+        transaction.on_commit(search_cache.invalidate)
 
 class BlogEntryQueryAPIView(APIView):
     permission_classes = [AllowAny]  # Allow public access to view public posts
@@ -42,6 +62,7 @@ class BlogEntryQueryAPIView(APIView):
         Query Parameters:
         - page: Page number (default: 1)
         - page_size: Number of items per page (default: 3, max: 100)
+        - cursor / pagination=cursor: Use keyset pagination instead of page numbers
         """
         username = request.data.get('username')
         if not username:
@@ -51,44 +72,27 @@ class BlogEntryQueryAPIView(APIView):
             )
 
         try:
-            # Get pagination parameters
-            page = int(request.query_params.get('page', 1))
-            page_size = min(int(request.query_params.get('page_size', 3)), 100)  # Cap at 100 items per page
-
             target_user = User.objects.get(username=username)
             
-            blog_entries = BlogEntry.objects.filter(author=target_user)
-
             # Filter based on visibility and authentication
-            if request.user.is_authenticated:
-                if request.user == target_user:
-                    pass
-                else:
-                    blog_entries = blog_entries.filter(
-                        models.Q(visibility='public') |
-                        models.Q(visibility='friends', author__friendships__follower=request.user)
-                    )
-            else:
-                blog_entries = blog_entries.filter(visibility='public')
+            blog_entries = BlogEntry.objects.filter(author=target_user).visible_to(request.user).as_cards(request.user)
 
             blog_entries = blog_entries.order_by('-created_at')
             
-            # Calculate pagination
-            total_count = blog_entries.count()
-            start = (page - 1) * page_size
-            end = start + page_size
-            paginated_entries = blog_entries[start:end]
+            paginated_entries, pagination = paginate(request, blog_entries, default_page_size=3)
 
-            serializer = BlogEntrySerializer(paginated_entries, many=True)
+            serializer = BlogEntryCardSerializer(paginated_entries, many=True)
             
             return Response({
-                'count': total_count,
-                'total_pages': (total_count + page_size - 1) // page_size,
-                'current_page': page,
-                'page_size': page_size,
+                **pagination,
                 'results': serializer.data
             })
 
+        except InvalidCursor:
+            return Response(
+                {"error": "Invalid cursor"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except User.DoesNotExist:
             return Response(
                 {"error": f"User with username '{username}' not found"},
@@ -105,34 +109,38 @@ class VisibleBlogEntriesView(APIView):
     authentication_classes = [CookieJWTAuthentication]
 
     def get(self, request):
-        # Get pagination parameters
-        page = int(request.query_params.get('page', 1))
-        page_size = min(int(request.query_params.get('page_size', 10)), 100)
+        """
+        Get all blog entries visible to the requesting user, newest first.
 
-        if request.user.is_authenticated:
-            # For authenticated users
-            blog_entries = BlogEntry.objects.filter(
-                models.Q(author=request.user) |  # Own entries
-                models.Q(visibility='public') |  # Public entries
-                models.Q(visibility='friends', author__friendships__follower=request.user)  # Friend's entries
-            ).distinct().order_by('-created_at')
-        else:
-            # For unauthenticated users
-            blog_entries = BlogEntry.objects.filter(visibility='public').order_by('-created_at')
-
-        # Calculate pagination
-        total_count = blog_entries.count()
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_entries = blog_entries[start:end]
-
-        serializer = BlogEntrySerializer(paginated_entries, many=True)
+        Query Parameters:
+        - page: Page number (default: 1)
+        - page_size: Number of items per page (default: 10, max: 100)
+        - cursor / pagination=cursor: Use keyset pagination instead of page numbers
+        - count: exact | capped | estimate (default: estimate for anonymous users, capped otherwise)
+        """
+        # Own, public and friends' entries (from the home timeline) for authenticated
+        # users, only public entries for unauthenticated users
+        blog_entries = BlogEntry.objects.visible_to(request.user, timeline=True).as_cards(request.user).order_by('-created_at')
+
+        try:
+            # The anonymous feed is the unfiltered public listing, so the planner estimate is good enough
+            paginated_entries, pagination = paginate(
+                request,
+                blog_entries,
+                default_page_size=10,
+                default_count_mode='capped' if request.user.is_authenticated else 'estimate',
+                allow_estimate=not request.user.is_authenticated,
+            )
+        except InvalidCursor:
+            return Response(
+                {"error": "Invalid cursor"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        serializer = BlogEntryCardSerializer(paginated_entries, many=True)
         
         return Response({
-            'count': total_count,
-            'total_pages': (total_count + page_size - 1) // page_size,
-            'current_page': page,
-            'page_size': page_size,
+            **pagination,
             'results': serializer.data
         })
 
@@ -160,11 +168,14 @@ class CreateBlogEntryView(APIView):
             serializer = BlogEntrySerializer(data=request.data, context={'request': request})
             if serializer.is_valid():
                 blog_entry = serializer.save()
+                fanned_out = timeline.fan_out_entry(blog_entry)
+                transaction.on_commit(search_cache.invalidate)
                 logger.info('Blog entry created successfully', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry.id,
                     'title': blog_entry.title,
-                    'visibility': blog_entry.visibility
+                    'visibility': blog_entry.visibility,
+                    'fanned_out': fanned_out
                 })
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             
@@ -215,10 +226,12 @@ class BlogCommentAPIView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to comment
-            if blog_entry.visibility == 'journal':
+            denial = access.comment_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Comment creation failed - private journal entry', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id
@@ -228,14 +241,11 @@ class BlogCommentAPIView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and not Friendship.objects.filter(
-                user=blog_entry.author,
-                follower=request.user
-            ).exists():
+            if denial:
                 logger.warning('Comment creation failed - not friends with author', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot comment on friends-only entries unless you are friends with the author"},
@@ -244,10 +254,12 @@ class BlogCommentAPIView(APIView):
 
             serializer = BlogCommentSerializer(data=request.data, context={'request': request})
             if serializer.is_valid():
-                comment = serializer.save(
-                    author=request.user,
-                    blog_entry=blog_entry
-                )
+                with transaction.atomic():
+                    comment = serializer.save(
+                        author=request.user,
+                        blog_entry=blog_entry
+                    )
+                    BlogEntry.objects.filter(id=blog_entry.id).update(comment_count=F('comment_count') + 1)
                 logger.info('Comment created successfully', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id,
@@ -289,23 +301,29 @@ class BlogCommentAPIView(APIView):
                 'comment_id': comment_id
             })
 
-            comment = BlogComment.objects.get(id=comment_id, blog_entry_id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            comment = access.get_comment(comment_id, blog_entry_id=blog_entry_id)
             
             # Check if user has permission to delete the comment
-            if request.user != comment.author and request.user != comment.blog_entry.author:
+            if request.user.id != comment.author_id and not access.is_author(comment.blog_entry):
                 logger.warning('Comment deletion failed - insufficient permissions', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id,
                     'comment_id': comment_id,
-                    'comment_author_id': comment.author.id,
-                    'blog_author_id': comment.blog_entry.author.id
+                    'comment_author_id': comment.author_id,
+                    'blog_author_id': comment.blog_entry.author_id
                 })
                 return Response(
                     {"error": "You can only delete your own comments or comments on your own blog entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            comment.delete()
+            with transaction.atomic():
+                # Only count the row this request removed: a concurrent delete of
+                # the same comment finds nothing left and must not decrement again
+                _, deleted = comment.delete()
+                if deleted.get(BlogComment._meta.label):
+                    BlogEntry.objects.filter(id=blog_entry_id).update(comment_count=F('comment_count') - 1)
             logger.info('Comment deleted successfully', extra={
                 'user_id': request.user.id,
                 'blog_entry_id': blog_entry_id,
@@ -338,6 +356,7 @@ class GetBlogCommentsView(APIView):
         Query Parameters:
         - page: Page number (default: 1)
         - page_size: Number of items per page (default: 10, max: 100)
+        - cursor / pagination=cursor: Use keyset pagination instead of page numbers
         """
         try:
             logger.info('Blog comments retrieval initiated', extra={
@@ -347,76 +366,88 @@ class GetBlogCommentsView(APIView):
                 'page_size': request.query_params.get('page_size', 10)
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to view the blog entry
-            if blog_entry.visibility == 'journal' and request.user != blog_entry.author:
+            denial = access.view_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Blog comments retrieval failed - private journal entry', extra={
                     'user_id': request.user.id if request.user.is_authenticated else None,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot view private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends':
-                if not request.user.is_authenticated:
-                    logger.warning('Blog comments retrieval failed - not authenticated for friends-only entry', extra={
-                        'blog_entry_id': blog_entry_id,
-                        'author_id': blog_entry.author.id
-                    })
-                    return Response(
-                        {"error": "Must be logged in to view friends-only entries"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
-                if request.user != blog_entry.author:
-                    if not Friendship.objects.filter(
-                        user=blog_entry.author,
-                        follower=request.user
-                    ).exists():
-                        logger.warning('Blog comments retrieval failed - not friends with author', extra={
-                            'user_id': request.user.id,
-                            'blog_entry_id': blog_entry_id,
-                            'author_id': blog_entry.author.id
-                        })
-                        return Response(
-                            {"error": "Cannot view friends-only entries unless you are friends with the author"},
-                            status=status.HTTP_403_FORBIDDEN
-                        )
-
-            # Get pagination parameters
-            page = int(request.query_params.get('page', 1))
-            page_size = min(int(request.query_params.get('page_size', 10)), 100)  # Cap at 100 items per page
+            if denial == entry_access.LOGIN_REQUIRED:
+                logger.warning('Blog comments retrieval failed - not authenticated for friends-only entry', extra={
+                    'blog_entry_id': blog_entry_id,
+                    'author_id': blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Must be logged in to view friends-only entries"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            if denial == entry_access.NOT_FRIENDS:
+                logger.warning('Blog comments retrieval failed - not friends with author', extra={
+                    'user_id': request.user.id,
+                    'blog_entry_id': blog_entry_id,
+                    'author_id': blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Cannot view friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
 
             # Get comments ordered by newest first
-            comments = BlogComment.objects.filter(blog_entry=blog_entry).order_by('-created_at')
-            
-            # Calculate pagination
-            total_count = comments.count()
-            start = (page - 1) * page_size
-            end = start + page_size
-            paginated_comments = comments[start:end]
+            comments = BlogComment.objects.filter(blog_entry=blog_entry).select_related('author').order_by('-created_at')
+
+            # One aggregate over the entry's comments stands in for every page of
+            # them: additions, deletions, edits, likes and renamed authors all
+            # change it. The page itself is part of the URL.
+            state = BlogComment.objects.filter(blog_entry=blog_entry).aggregate(
+                total=models.Count('id'),
+                last_updated=models.Max('updated_at'),
+                likes=models.Sum('like_count'),
+            )
+            etag = conditional.make_etag(
+                'blog_comments', blog_entry.id, state['total'], state['last_updated'], state['likes'],
+                conditional.users_version(), access.viewer_class(blog_entry),
+            )
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                logger.info('Blog comments not modified', extra={
+                    'user_id': request.user.id if request.user.is_authenticated else None,
+                    'blog_entry_id': blog_entry_id
+                })
+                return not_modified
+
+            paginated_comments, pagination = paginate(request, comments, default_page_size=10)
 
             serializer = BlogCommentSerializer(paginated_comments, many=True)
             
             logger.info('Blog comments retrieved successfully', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
                 'blog_entry_id': blog_entry_id,
-                'total_comments': total_count,
-                'page': page,
-                'page_size': page_size
+                'total_comments': pagination.get('count'),
+                'page': pagination.get('current_page'),
+                'page_size': pagination['page_size']
             })
             
-            return Response({
-                'count': total_count,
-                'total_pages': (total_count + page_size - 1) // page_size,
-                'current_page': page,
-                'page_size': page_size,
+            return conditional.add_validators(Response({
+                **pagination,
                 'results': serializer.data
-            })
+            }), etag)
             
+        except InvalidCursor:
+            return Response(
+                {"error": "Invalid cursor"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except BlogEntry.DoesNotExist:
             logger.warning('Blog comments retrieval failed - blog entry not found', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
@@ -443,28 +474,27 @@ class BlogLikeAPIView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to like
-            if blog_entry.visibility == 'journal' and request.user != blog_entry.author:
+            denial = access.like_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Blog like creation failed - private journal entry', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot like private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and not Friendship.objects.filter(
-                user=blog_entry.author,
-                follower=request.user
-            ).exists():
+            if denial:
                 logger.warning('Blog like creation failed - not friends with author', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot like friends-only entries unless you are friends with the author"},
@@ -482,11 +512,23 @@ class BlogLikeAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Create the like
-            like = BlogLike.objects.create(
-                blog_entry=blog_entry,
-                user=request.user
-            )
+            # Create the like; the unique constraint catches a concurrent duplicate
+            try:
+                with transaction.atomic():
+                    like = BlogLike.objects.create(
+                        blog_entry=blog_entry,
+                        user=request.user
+                    )
+                    BlogEntry.objects.filter(id=blog_entry.id).update(like_count=F('like_count') + 1)
+            except IntegrityError:
+                logger.warning('Blog like creation failed - already liked', extra={
+                    'user_id': request.user.id,
+                    'blog_entry_id': blog_entry_id
+                })
+                return Response(
+                    {"error": "You have already liked this blog entry"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             logger.info('Blog like created successfully', extra={
                 'user_id': request.user.id,
@@ -520,7 +562,7 @@ class BlogLikeAPIView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            blog_entry = BlogEntry.objects.defer('search_vector').get(id=blog_entry_id)
             
             # Find and delete the like
             like = BlogLike.objects.filter(blog_entry=blog_entry, user=request.user).first()
@@ -534,7 +576,11 @@ class BlogLikeAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            like.delete()
+            with transaction.atomic():
+                # A concurrent unlike may have removed the row already
+                deleted, _ = like.delete()
+                if deleted:
+                    BlogEntry.objects.filter(id=blog_entry.id).update(like_count=F('like_count') - 1)
             logger.info('Blog unlike successful', extra={
                 'user_id': request.user.id,
                 'blog_entry_id': blog_entry_id
@@ -562,30 +608,28 @@ class GetBlogLikesView(APIView):
         - blog_entry_id: ID of the blog entry to get likes for
         """
         try:
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to view likes
-            if blog_entry.visibility == 'journal' and request.user != blog_entry.author:
+            denial = access.view_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 return Response(
                     {"error": "Cannot view likes on private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and not request.user.is_authenticated:
+            if denial == entry_access.LOGIN_REQUIRED:
                 return Response(
                     {"error": "Must be logged in to view likes on friends-only entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and request.user != blog_entry.author:
-                if not Friendship.objects.filter(
-                    user=blog_entry.author,
-                    follower=request.user
-                ).exists():
-                    return Response(
-                        {"error": "Cannot view likes on friends-only entries unless you are friends with the author"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            if denial == entry_access.NOT_FRIENDS:
+                return Response(
+                    {"error": "Cannot view likes on friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
 
             likes = BlogLike.objects.filter(blog_entry=blog_entry).order_by('-created_at')
             serializer = BlogLikeSerializer(likes, many=True)
@@ -613,52 +657,55 @@ class GetBlogLikeCountView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to view like count
-            if blog_entry.visibility == 'journal' and request.user != blog_entry.author:
+            denial = access.view_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Blog like count retrieval failed - private journal entry', extra={
                     'user_id': request.user.id if request.user.is_authenticated else None,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot view like count on private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and not request.user.is_authenticated:
+            if denial == entry_access.LOGIN_REQUIRED:
                 logger.warning('Blog like count retrieval failed - not authenticated for friends-only entry', extra={
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Must be logged in to view like count on friends-only entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and request.user != blog_entry.author:
-                if not Friendship.objects.filter(
-                    user=blog_entry.author,
-                    follower=request.user
-                ).exists():
-                    logger.warning('Blog like count retrieval failed - not friends with author', extra={
-                        'user_id': request.user.id,
-                        'blog_entry_id': blog_entry_id,
-                        'author_id': blog_entry.author.id
-                    })
-                    return Response(
-                        {"error": "Cannot view like count on friends-only entries unless you are friends with the author"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            if denial == entry_access.NOT_FRIENDS:
+                logger.warning('Blog like count retrieval failed - not friends with author', extra={
+                    'user_id': request.user.id,
+                    'blog_entry_id': blog_entry_id,
+                    'author_id': blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Cannot view like count on friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            like_count = blog_entry.like_count
+            etag = conditional.make_etag('blog_like_count', blog_entry.id, like_count, access.viewer_class(blog_entry))
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                return not_modified
 
-            like_count = BlogLike.objects.filter(blog_entry=blog_entry).count()
             logger.info('Blog like count retrieved successfully', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
                 'blog_entry_id': blog_entry_id,
                 'like_count': like_count
             })
-            return Response({"like_count": like_count})
+            return conditional.add_validators(Response({"like_count": like_count}), etag)
             
         except BlogEntry.DoesNotExist:
             logger.warning('Blog like count retrieval failed - blog entry not found', extra={
@@ -686,30 +733,29 @@ class CommentLikeAPIView(APIView):
                 'comment_id': comment_id
             })
 
-            comment = BlogComment.objects.get(id=comment_id)
+            access = EntryAccess.for_request(request)
+            comment = access.get_comment(comment_id)
             
             # Check if user has permission to like
-            if comment.blog_entry.visibility == 'journal' and request.user != comment.blog_entry.author:
+            denial = access.like_denial(comment.blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Comment like creation failed - private journal entry', extra={
                     'user_id': request.user.id,
                     'comment_id': comment_id,
-                    'blog_entry_id': comment.blog_entry.id,
-                    'author_id': comment.blog_entry.author.id
+                    'blog_entry_id': comment.blog_entry_id,
+                    'author_id': comment.blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot like comments on private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if comment.blog_entry.visibility == 'friends' and not Friendship.objects.filter(
-                user=comment.blog_entry.author,
-                follower=request.user
-            ).exists():
+            if denial:
                 logger.warning('Comment like creation failed - not friends with author', extra={
                     'user_id': request.user.id,
                     'comment_id': comment_id,
-                    'blog_entry_id': comment.blog_entry.id,
-                    'author_id': comment.blog_entry.author.id
+                    'blog_entry_id': comment.blog_entry_id,
+                    'author_id': comment.blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot like comments on friends-only entries unless you are friends with the author"},
@@ -727,11 +773,23 @@ class CommentLikeAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Create the like
-            like = CommentLike.objects.create(
-                comment=comment,
-                user=request.user
-            )
+            # Create the like; the unique constraint catches a concurrent duplicate
+            try:
+                with transaction.atomic():
+                    like = CommentLike.objects.create(
+                        comment=comment,
+                        user=request.user
+                    )
+                    BlogComment.objects.filter(id=comment.id).update(like_count=F('like_count') + 1)
+            except IntegrityError:
+                logger.warning('Comment like creation failed - already liked', extra={
+                    'user_id': request.user.id,
+                    'comment_id': comment_id
+                })
+                return Response(
+                    {"error": "You have already liked this comment"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             logger.info('Comment like created successfully', extra={
                 'user_id': request.user.id,
@@ -779,7 +837,11 @@ class CommentLikeAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            like.delete()
+            with transaction.atomic():
+                # A concurrent unlike may have removed the row already
+                deleted, _ = like.delete()
+                if deleted:
+                    BlogComment.objects.filter(id=comment.id).update(like_count=F('like_count') - 1)
             logger.info('Comment unlike successful', extra={
                 'user_id': request.user.id,
                 'comment_id': comment_id
@@ -807,30 +869,28 @@ class GetCommentLikesView(APIView):
         - comment_id: ID of the comment to get likes for
         """
         try:
-            comment = BlogComment.objects.get(id=comment_id)
+            access = EntryAccess.for_request(request)
+            comment = access.get_comment(comment_id)
             
             # Check if user has permission to view likes
-            if comment.blog_entry.visibility == 'journal' and request.user != comment.blog_entry.author:
+            denial = access.view_denial(comment.blog_entry)
+            if denial == entry_access.JOURNAL:
                 return Response(
                     {"error": "Cannot view likes on comments in private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if comment.blog_entry.visibility == 'friends' and not request.user.is_authenticated:
+            if denial == entry_access.LOGIN_REQUIRED:
                 return Response(
                     {"error": "Must be logged in to view likes on comments in friends-only entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if comment.blog_entry.visibility == 'friends' and request.user != comment.blog_entry.author:
-                if not Friendship.objects.filter(
-                    user=comment.blog_entry.author,
-                    follower=request.user
-                ).exists():
-                    return Response(
-                        {"error": "Cannot view likes on comments in friends-only entries unless you are friends with the author"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            if denial == entry_access.NOT_FRIENDS:
+                return Response(
+                    {"error": "Cannot view likes on comments in friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
 
             likes = CommentLike.objects.filter(comment=comment).order_by('-created_at')
             serializer = CommentLikeSerializer(likes, many=True)
@@ -858,55 +918,58 @@ class GetCommentLikeCountView(APIView):
                 'comment_id': comment_id
             })
 
-            comment = BlogComment.objects.get(id=comment_id)
+            access = EntryAccess.for_request(request)
+            comment = access.get_comment(comment_id)
             
             # Check if user has permission to view like count
-            if comment.blog_entry.visibility == 'journal' and request.user != comment.blog_entry.author:
+            denial = access.view_denial(comment.blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Comment like count retrieval failed - private journal entry', extra={
                     'user_id': request.user.id if request.user.is_authenticated else None,
                     'comment_id': comment_id,
-                    'blog_entry_id': comment.blog_entry.id,
-                    'author_id': comment.blog_entry.author.id
+                    'blog_entry_id': comment.blog_entry_id,
+                    'author_id': comment.blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot view like count on comments in private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if comment.blog_entry.visibility == 'friends' and not request.user.is_authenticated:
+            if denial == entry_access.LOGIN_REQUIRED:
                 logger.warning('Comment like count retrieval failed - not authenticated for friends-only entry', extra={
                     'comment_id': comment_id,
-                    'blog_entry_id': comment.blog_entry.id,
-                    'author_id': comment.blog_entry.author.id
+                    'blog_entry_id': comment.blog_entry_id,
+                    'author_id': comment.blog_entry.author_id
                 })
                 return Response(
                     {"error": "Must be logged in to view like count on comments in friends-only entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if comment.blog_entry.visibility == 'friends' and request.user != comment.blog_entry.author:
-                if not Friendship.objects.filter(
-                    user=comment.blog_entry.author,
-                    follower=request.user
-                ).exists():
-                    logger.warning('Comment like count retrieval failed - not friends with author', extra={
-                        'user_id': request.user.id,
-                        'comment_id': comment_id,
-                        'blog_entry_id': comment.blog_entry.id,
-                        'author_id': comment.blog_entry.author.id
-                    })
-                    return Response(
-                        {"error": "Cannot view like count on comments in friends-only entries unless you are friends with the author"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            if denial == entry_access.NOT_FRIENDS:
+                logger.warning('Comment like count retrieval failed - not friends with author', extra={
+                    'user_id': request.user.id,
+                    'comment_id': comment_id,
+                    'blog_entry_id': comment.blog_entry_id,
+                    'author_id': comment.blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Cannot view like count on comments in friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            like_count = comment.like_count
+            etag = conditional.make_etag('comment_like_count', comment.id, like_count, access.viewer_class(comment.blog_entry))
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                return not_modified
 
-            like_count = CommentLike.objects.filter(comment=comment).count()
             logger.info('Comment like count retrieved successfully', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
                 'comment_id': comment_id,
                 'like_count': like_count
             })
-            return Response({"like_count": like_count})
+            return conditional.add_validators(Response({"like_count": like_count}), etag)
             
         except BlogComment.DoesNotExist:
             logger.warning('Comment like count retrieval failed - comment not found', extra={
@@ -934,52 +997,55 @@ class GetBlogCommentCountView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to view comment count
-            if blog_entry.visibility == 'journal' and request.user != blog_entry.author:
+            denial = access.view_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Blog comment count retrieval failed - private journal entry', extra={
                     'user_id': request.user.id if request.user.is_authenticated else None,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot view comment count on private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and not request.user.is_authenticated:
+            if denial == entry_access.LOGIN_REQUIRED:
                 logger.warning('Blog comment count retrieval failed - not authenticated for friends-only entry', extra={
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Must be logged in to view comment count on friends-only entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends' and request.user != blog_entry.author:
-                if not Friendship.objects.filter(
-                    user=blog_entry.author,
-                    follower=request.user
-                ).exists():
-                    logger.warning('Blog comment count retrieval failed - not friends with author', extra={
-                        'user_id': request.user.id,
-                        'blog_entry_id': blog_entry_id,
-                        'author_id': blog_entry.author.id
-                    })
-                    return Response(
-                        {"error": "Cannot view comment count on friends-only entries unless you are friends with the author"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            if denial == entry_access.NOT_FRIENDS:
+                logger.warning('Blog comment count retrieval failed - not friends with author', extra={
+                    'user_id': request.user.id,
+                    'blog_entry_id': blog_entry_id,
+                    'author_id': blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Cannot view comment count on friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            comment_count = blog_entry.comment_count
+            etag = conditional.make_etag('blog_comment_count', blog_entry.id, comment_count, access.viewer_class(blog_entry))
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                return not_modified
 
-            comment_count = BlogComment.objects.filter(blog_entry=blog_entry).count()
             logger.info('Blog comment count retrieved successfully', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
                 'blog_entry_id': blog_entry_id,
                 'comment_count': comment_count
             })
-            return Response({"comment_count": comment_count})
+            return conditional.add_validators(Response({"comment_count": comment_count}), etag)
             
         except BlogEntry.DoesNotExist:
             logger.warning('Blog comment count retrieval failed - blog entry not found', extra={
@@ -991,6 +1057,64 @@ class GetBlogCommentCountView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+class BlogEngagementView(APIView):
+    permission_classes = [AllowAny]  # Allow both authenticated and unauthenticated users
+    authentication_classes = [CookieJWTAuthentication]  # Use our custom authentication
+
+    MAX_IDS = 100
+
+    def get(self, request):
+        """
+        Get like count, comment count and whether the user liked it, for many blog entries at once.
+        Entries the user is not allowed to see are left out of the response.
+        
+        Query Parameters:
+        - ids: Comma separated blog entry IDs (max: 100)
+        """
+        try:
+            ids = {int(blog_entry_id) for blog_entry_id in request.query_params.get('ids', '').split(',') if blog_entry_id}
+        except ValueError:
+            return Response(
+                {"error": "ids must be a comma separated list of blog entry IDs"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not ids:
+            return Response(
+                {"error": "ids is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > self.MAX_IDS:
+            return Response(
+                {"error": f"At most {self.MAX_IDS} ids can be requested at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        logger.info('Blog engagement retrieval initiated', extra={
+            'user_id': request.user.id if request.user.is_authenticated else None,
+            'blog_entry_count': len(ids)
+        })
+
+        # One query for the visible entries and their counters, one for the user's likes
+        blog_entries = BlogEntry.objects.filter(id__in=ids).visible_to(request.user).values_list(
+            'id', 'like_count', 'comment_count'
+        )
+        liked_ids = set()
+        if request.user.is_authenticated:
+            liked_ids = set(
+                BlogLike.objects.filter(user=request.user, blog_entry_id__in=ids).values_list('blog_entry_id', flat=True)
+            )
+
+        results = [
+            {
+                'id': blog_entry_id,
+                'like_count': like_count,
+                'comment_count': comment_count,
+                'viewer_has_liked': blog_entry_id in liked_ids,
+            }
+            for blog_entry_id, like_count, comment_count in blog_entries
+        ]
+        return Response({'results': results})
+
 class GetBlogEntryView(APIView):
     permission_classes = [AllowAny]  # Allow both authenticated and unauthenticated users
     authentication_classes = [CookieJWTAuthentication]  # Use our custom authentication
@@ -1008,53 +1132,64 @@ class GetBlogEntryView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user has permission to view the blog entry
-            if blog_entry.visibility == 'journal' and request.user != blog_entry.author:
+            denial = access.view_denial(blog_entry)
+            if denial == entry_access.JOURNAL:
                 logger.warning('Blog entry retrieval failed - private journal entry', extra={
                     'user_id': request.user.id if request.user.is_authenticated else None,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "Cannot view private journal entries"},
                     status=status.HTTP_403_FORBIDDEN
                 )
             
-            if blog_entry.visibility == 'friends':
-                if not request.user.is_authenticated:
-                    logger.warning('Blog entry retrieval failed - not authenticated for friends-only entry', extra={
-                        'blog_entry_id': blog_entry_id,
-                        'author_id': blog_entry.author.id
-                    })
-                    return Response(
-                        {"error": "Must be logged in to view friends-only entries"},
-                        status=status.HTTP_403_FORBIDDEN
-                    )
-                if request.user != blog_entry.author:
-                    if not Friendship.objects.filter(
-                        user=blog_entry.author,
-                        follower=request.user
-                    ).exists():
-                        logger.warning('Blog entry retrieval failed - not friends with author', extra={
-                            'user_id': request.user.id,
-                            'blog_entry_id': blog_entry_id,
-                            'author_id': blog_entry.author.id
-                        })
-                        return Response(
-                            {"error": "Cannot view friends-only entries unless you are friends with the author"},
-                            status=status.HTTP_403_FORBIDDEN
-                        )
+            if denial == entry_access.LOGIN_REQUIRED:
+                logger.warning('Blog entry retrieval failed - not authenticated for friends-only entry', extra={
+                    'blog_entry_id': blog_entry_id,
+                    'author_id': blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Must be logged in to view friends-only entries"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            if denial == entry_access.NOT_FRIENDS:
+                logger.warning('Blog entry retrieval failed - not friends with author', extra={
+                    'user_id': request.user.id,
+                    'blog_entry_id': blog_entry_id,
+                    'author_id': blog_entry.author_id
+                })
+                return Response(
+                    {"error": "Cannot view friends-only entries unless you are friends with the author"},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+
+            # Likes and comments update the counters without touching updated_at
+            etag = conditional.make_etag(
+                'blog_entry', blog_entry.id, blog_entry.updated_at, blog_entry.like_count,
+                blog_entry.comment_count, blog_entry.author.username, access.viewer_class(blog_entry),
+            )
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                logger.info('Blog entry not modified', extra={
+                    'user_id': request.user.id if request.user.is_authenticated else None,
+                    'blog_entry_id': blog_entry_id
+                })
+                return not_modified
 
             serializer = BlogEntrySerializer(blog_entry)
             logger.info('Blog entry retrieved successfully', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
                 'blog_entry_id': blog_entry_id,
-                'author_id': blog_entry.author.id,
+                'author_id': blog_entry.author_id,
                 'visibility': blog_entry.visibility
             })
-            return Response(serializer.data)
+            return conditional.add_validators(Response(serializer.data), etag, blog_entry.updated_at)
             
         except BlogEntry.DoesNotExist:
             logger.warning('Blog entry retrieval failed - not found', extra={
@@ -1079,14 +1214,15 @@ class GetBlogEntryView(APIView):
                 'blog_entry_id': blog_entry_id
             })
 
-            blog_entry = BlogEntry.objects.get(id=blog_entry_id)
+            access = EntryAccess.for_request(request)
+            blog_entry = access.get_entry(blog_entry_id)
             
             # Check if user is the author of the blog entry
-            if request.user != blog_entry.author:
+            if not access.is_author(blog_entry):
                 logger.warning('Blog entry deletion failed - not author', extra={
                     'user_id': request.user.id,
                     'blog_entry_id': blog_entry_id,
-                    'author_id': blog_entry.author.id
+                    'author_id': blog_entry.author_id
                 })
                 return Response(
                     {"error": "You can only delete your own blog entries"},
@@ -1094,6 +1230,7 @@ class GetBlogEntryView(APIView):
                 )
             
             blog_entry.delete()
+            transaction.on_commit(search_cache.invalidate)
             logger.info('Blog entry deleted successfully', extra={
                 'user_id': request.user.id,
                 'blog_entry_id': blog_entry_id
@@ -1110,6 +1247,53 @@ class GetBlogEntryView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+def _search_params(query_params):
+    """Pagination parameters shared by SearchView and AsyncSearchView."""
+    return {
+        'user_page': int(query_params.get('user_page', 1)),
+        'user_page_size': min(int(query_params.get('user_page_size', 3)), 100),
+        'blog_page': int(query_params.get('blog_page', 1)),
+        'blog_page_size': min(int(query_params.get('blog_page_size', 3)), 100),
+        'count_mode': count_mode_from_params(query_params, default='capped'),
+    }
+
+def _search_users_page(request, search_query, page, page_size, count_mode):
+    if count_mode == 'capped':
+        paginated_users, pagination = search_cache.user_page(search_query, page, page_size)
+    else:
+        users = search.search_users(search_query)
+        paginated_users, pagination = page_number_paginate(users, page, page_size, count_mode)
+    serializer = SearchUserSerializer(paginated_users, many=True, context={'request': request})
+    return {**pagination, 'results': serializer.data}
+
+def _search_entries_page(user, search_query, page, page_size, count_mode):
+    # Blog entries the user is allowed to see, best matches first
+    if count_mode == 'capped':
+        paginated_entries, pagination = search_cache.entry_page(search_query, user, page, page_size)
+    else:
+        blog_entries = search.search_entries(search_query, user)
+        paginated_entries, pagination = page_number_paginate(blog_entries, page, page_size, count_mode)
+    paginated_entries = search.add_headlines(paginated_entries, search_query)
+    serializer = BlogEntrySearchResultSerializer(paginated_entries, many=True)
+    return {**pagination, 'results': serializer.data}
+
+def _in_worker_thread(func):
+    """
+    Run a blocking function from async code in its own worker thread, so that
+    several of them can run at the same time. Each thread opens its own
+    database connection, which is released when the function returns.
+    """
+    def run(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+def _authenticate(request):
+    auth = CookieJWTAuthentication().authenticate(request)
+    return auth[0] if auth else AnonymousUser()
+
 class SearchView(APIView):
     permission_classes = [AllowAny]  # Allow both authenticated and unauthenticated users
     authentication_classes = [CookieJWTAuthentication]  # Use our custom authentication
@@ -1117,6 +1301,9 @@ class SearchView(APIView):
     def get(self, request):
         """
         Search across users and blog entries.
+
+        Blog entries are matched with full-text search and ranked by relevance
+        (see api.search); each result carries a highlighted `headline`.
         
         Query Parameters:
         - q: Search query string
@@ -1124,12 +1311,13 @@ class SearchView(APIView):
         - user_page_size: Number of users per page (default: 3, max: 100)
         - blog_page: Page number for blog entries (default: 1)
         - blog_page_size: Number of blog entries per page (default: 3, max: 100)
+        - count: exact | capped (default: capped, counts stop at 1000)
         """
         search_query = request.query_params.get('q', '').strip()
         if not search_query:
             logger.warning('Search attempted without query parameter', extra={
                 'user_id': request.user.id if request.user.is_authenticated else None,
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
             return Response(
                 {"error": "Search query is required"},
@@ -1137,89 +1325,36 @@ class SearchView(APIView):
             )
 
         try:
-            # Get pagination parameters for users
-            user_page = int(request.query_params.get('user_page', 1))
-            user_page_size = min(int(request.query_params.get('user_page_size', 3)), 100)
-
-            # Get pagination parameters for blog entries
-            blog_page = int(request.query_params.get('blog_page', 1))
-            blog_page_size = min(int(request.query_params.get('blog_page_size', 3)), 100)
+            params = _search_params(request.query_params)
 
             logger.info('Search initiated', extra={
                 'query': search_query,
                 'user_id': request.user.id if request.user.is_authenticated else None,
-                'user_page': user_page,
-                'user_page_size': user_page_size,
-                'blog_page': blog_page,
-                'blog_page_size': blog_page_size
+                'user_page': params['user_page'],
+                'user_page_size': params['user_page_size'],
+                'blog_page': params['blog_page'],
+                'blog_page_size': params['blog_page_size']
             })
 
-            # Search in users
-            users = User.objects.filter(
-                models.Q(username__icontains=search_query) |
-                models.Q(first_name__icontains=search_query) |
-                models.Q(last_name__icontains=search_query)
+            users = _search_users_page(
+                request, search_query, params['user_page'], params['user_page_size'], params['count_mode']
             )
-
-            # Search in blog entries
-            blog_entries = BlogEntry.objects.filter(
-                models.Q(title__icontains=search_query) |
-                models.Q(content__icontains=search_query)
+            blog_entries = _search_entries_page(
+                request.user, search_query, params['blog_page'], params['blog_page_size'], params['count_mode']
             )
 
-            # Filter blog entries based on visibility and authentication
-            if request.user.is_authenticated:
-                blog_entries = blog_entries.filter(
-                    models.Q(author=request.user) |
-                    models.Q(visibility='public') |
-                    models.Q(visibility='friends', author__friendships__follower=request.user)
-                ).distinct()
-            else:
-                blog_entries = blog_entries.filter(visibility='public')
-
-            users = users.order_by('username')
-            blog_entries = blog_entries.order_by('-created_at')
-
-            # Calculate pagination for users
-            total_users = users.count()
-            start_users = (user_page - 1) * user_page_size
-            end_users = start_users + user_page_size
-            paginated_users = users[start_users:end_users]
-
-            # Calculate pagination for blog entries
-            total_entries = blog_entries.count()
-            start_entries = (blog_page - 1) * blog_page_size
-            end_entries = start_entries + blog_page_size
-            paginated_entries = blog_entries[start_entries:end_entries]
-
-            # Serialize results
-            user_serializer = SearchUserSerializer(paginated_users, many=True, context={'request': request})
-            blog_serializer = BlogEntrySerializer(paginated_entries, many=True)
-
             logger.info('Search completed successfully', extra={
                 'query': search_query,
                 'user_id': request.user.id if request.user.is_authenticated else None,
-                'total_users': total_users,
-                'total_entries': total_entries,
-                'user_page': user_page,
-                'blog_page': blog_page
+                'total_users': users['count'],
+                'total_entries': blog_entries['count'],
+                'user_page': params['user_page'],
+                'blog_page': params['blog_page']
             })
 
             return Response({
-                'users': {
-                    'count': total_users,
-                    'total_pages': (total_users + user_page_size - 1) // user_page_size,
-                    'current_page': user_page,
-                    'page_size': user_page_size,
-                    'results': user_serializer.data
-                },
-                'blog_entries': {
-                    'count': total_entries,
-                    'total_pages': (total_entries + blog_page_size - 1) // blog_page_size,
-                    'current_page': blog_page,
-                    'page_size': blog_page_size,
-                    'results': blog_serializer.data
-                }
+                'users': users,
+                'blog_entries': blog_entries
             })
 
         except Exception as e:
@@ -1232,4 +1367,123 @@ class SearchView(APIView):
             return Response(
                 {"error": f"Error performing search: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+class AsyncSearchView(View):
+    """
+    SearchView as an async view. The user half and the blog entry half of the
+    search (each with its count, page and serialization) are independent, so
+    they run at the same time in two worker threads and the response takes
+    about as long as the slower half instead of both added up. Under ASGI
+    (blogmates.asgi) the request does not hold a worker while it waits.
+    """
+
+    async def get(self, request):
+        """
+        Search across users and blog entries; same parameters and response as SearchView.
+
+        Query Parameters:
+        - q: Search query string
+        - user_page: Page number for users (default: 1)
+        - user_page_size: Number of users per page (default: 3, max: 100)
+        - blog_page: Page number for blog entries (default: 1)
+        - blog_page_size: Number of blog entries per page (default: 3, max: 100)
+        - count: exact | capped (default: capped, counts stop at 1000)
+        """
+        request.user = await sync_to_async(_authenticate)(request)
+        user_id = request.user.id if request.user.is_authenticated else None
+
+        search_query = request.GET.get('q', '').strip()
+        if not search_query:
+            logger.warning('Search attempted without query parameter', extra={
+                'user_id': user_id,
+                'ip': client_ip(request)
+            })
+            return JsonResponse(
+                {"error": "Search query is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            params = _search_params(request.GET)
+
+            logger.info('Async search initiated', extra={
+                'query': search_query,
+                'user_id': user_id,
+                'user_page': params['user_page'],
+                'user_page_size': params['user_page_size'],
+                'blog_page': params['blog_page'],
+                'blog_page_size': params['blog_page_size']
+            })
+
+            users, blog_entries = await asyncio.gather(
+                _in_worker_thread(_search_users_page)(
+                    request, search_query, params['user_page'], params['user_page_size'], params['count_mode']
+                ),
+                _in_worker_thread(_search_entries_page)(
+                    request.user, search_query, params['blog_page'], params['blog_page_size'], params['count_mode']
+                ),
+            )
+
+            logger.info('Async search completed successfully', extra={
+                'query': search_query,
+                'user_id': user_id,
+                'total_users': users['count'],
+                'total_entries': blog_entries['count'],
+                'user_page': params['user_page'],
+                'blog_page': params['blog_page']
+            })
+
+            return JsonResponse({
+                'users': users,
+                'blog_entries': blog_entries
+            })
+
+        except Exception as e:
+            logger.error('Async search failed', extra={
+                'query': search_query,
+                'user_id': user_id,
+                'error': str(e),
+                'error_type': type(e).__name__
+            }, exc_info=True)
+            return JsonResponse(
+                {"error": f"Error performing search: {str(e)}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class UserAutocompleteView(APIView):
+    permission_classes = [AllowAny]
+    # Results do not depend on who is asking, skip the user lookup
+    authentication_classes = []
+
+    def get(self, request):
+        """
+        Suggest users while typing a name.
+
+        Query Parameters:
+        - q: Beginning of a username, first name or last name
+        - limit: Number of suggestions (default: 10, max: 20)
+        """
+        prefix = request.query_params.get('q', '').strip()
+        if not prefix:
+            return Response(
+                {"error": "Search query is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            limit = min(int(request.query_params.get('limit', search.AUTOCOMPLETE_LIMIT)), search.MAX_AUTOCOMPLETE_LIMIT)
+        except ValueError:
+            return Response(
+                {"error": "limit must be a number"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({'results': search.autocomplete_users(prefix, limit)})
+
+class SearchCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """Hit and miss counters of the search result cache (staff only)."""
+        return Response(search_cache.stats())
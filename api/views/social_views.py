@@ -8,8 +8,9 @@ from rest_framework.generics import ListCreateAPIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from ..models import BlogEntry, FriendRequest, Friendship
 from ..serializers import BlogEntrySerializer
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from .. import timeline, social_cache
 
 class SendFriendRequestAPIView(APIView):
     permission_classes = [IsAuthenticated]
@@ -76,9 +77,13 @@ class AcceptFriendRequestAPIView(APIView):
         try:
             friend_request = FriendRequest.objects.get(id=request_id, receiver=request.user, is_accepted=False)
             
-            Friendship.objects.create(user=request.user, follower=friend_request.sender)
-            
-            friend_request.delete()
+            with transaction.atomic():
+                # Already following (e.g. two accepts racing) is fine, the unique constraint keeps one row
+                Friendship.objects.get_or_create(user=request.user, follower=friend_request.sender)
+                timeline.backfill_follower(request.user, friend_request.sender)
+                transaction.on_commit(lambda: social_cache.invalidate(request.user.id, friend_request.sender_id))
+                
+                friend_request.delete()
 
             return Response({'message': 'Friend request accepted successfully.'}, status=status.HTTP_200_OK)
         except FriendRequest.DoesNotExist:
@@ -122,7 +127,10 @@ class UnfollowUserAPIView(APIView):
             followed = User.objects.get(id=user_id)
             print(followed)
             friendship = Friendship.objects.get(user=followed, follower=request.user)
-            friendship.delete()
+            with transaction.atomic():
+                friendship.delete()
+                timeline.remove_follower(followed, request.user)
+                transaction.on_commit(lambda: social_cache.invalidate(followed.id, request.user.id))
             return Response({'message': 'You have unfollowed the user.'}, status=status.HTTP_200_OK)
         except Friendship.DoesNotExist:
             return Response({'error': 'You are not following this user.'}, status=status.HTTP_404_NOT_FOUND)
@@ -134,7 +142,10 @@ class RemoveFollowerAPIView(APIView):
         try:
             follower = User.objects.get(id=user_id)
             friendship = Friendship.objects.get(user=request.user, follower=follower)
-            friendship.delete()
+            with transaction.atomic():
+                friendship.delete()
+                timeline.remove_follower(request.user, follower)
+                transaction.on_commit(lambda: social_cache.invalidate(request.user.id, follower.id))
             return Response({'message': 'Follower removed successfully.'}, status=status.HTTP_200_OK)
         except Friendship.DoesNotExist:
             return Response({'error': 'This user is not following you.'}, status=status.HTTP_404_NOT_FOUND)
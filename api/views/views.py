@@ -1,18 +1,31 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, HttpResponseRedirect
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from ..serializers import SignupSerializer
+from ..serializers import SignupSerializer, CookieTokenRefreshSerializer
 from rest_framework.generics import ListCreateAPIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from ..models import BlogEntry, FriendRequest, Friendship, UserProfile, User
 from ..serializers import BlogEntrySerializer, UserProfileSerializer
-from django.db import models
+from django.db import models, transaction
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.conf import settings
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework.exceptions import AuthenticationFailed
+from .. import login_throttle, passwords, revocation
+from ..passwords import HashPoolBusy
 from ..authentication import CookieJWTAuthentication
+from ..client_ip import client_ip
+from ..relationships import Relationships, with_social_counts
+from ..avatars import (
+    CACHE_CONTROL, EXTENSIONS, HASH_RE, VARIANT_EXTENSION, VARIANT_SIZES, AvatarUploadHandler,
+    InvalidImage, UploadTooLarge, content_type_for, find_original, make_variants_in_background,
+    max_upload_size, open_avatar, original_url, receive_raw_upload, replaced, store_upload,
+)
+from .. import conditional
+from .. import search_cache
 import logging
 
 logger = logging.getLogger('api')
@@ -28,11 +41,49 @@ class CookieTokenObtainPairView(TokenObtainPairView):
     def post(self, request, *args, **kwargs):
         logger.info('Login attempt', extra={
             'username': request.data.get('username'),
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
-        
-        response = super().post(request, *args, **kwargs)
+
+        # Refused before any password is hashed
+        username = request.data.get('username')
+        ip = client_ip(request)
+        if login_throttle.is_throttled(username, ip):
+            logger.warning('Login failed - too many failed attempts', extra={
+                'username': username,
+                'ip': ip
+            })
+            response = Response(
+                {"error": "Too many failed login attempts. Please try again later."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
+            response['Retry-After'] = str(login_throttle.retry_after())
+            return response
+
+        try:
+            response = super().post(request, *args, **kwargs)
+        except HashPoolBusy:
+            logger.warning('Login failed - password hashing pool saturated', extra={
+                'username': username,
+                'ip': ip
+            })
+            response = Response(
+                {"error": "The server is busy. Please try again in a moment."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = '1'
+            return response
+        except AuthenticationFailed:
+            # Wrong password or unknown user; the 401 itself is rendered by DRF
+            login_throttle.record_failure(username, ip)
+            logger.warning('Login failed', extra={
+                'username': username,
+                'ip': ip,
+                'status_code': status.HTTP_401_UNAUTHORIZED
+            })
+            raise
+
         if response.status_code == 200:
+            login_throttle.reset(username)
             data = response.data
             response.set_cookie(
                 settings.SIMPLE_JWT["AUTH_COOKIE"],
@@ -54,29 +105,34 @@ class CookieTokenObtainPairView(TokenObtainPairView):
             del response.data["refresh"]
             logger.info('Login successful', extra={
                 'username': request.data.get('username'),
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
         else:
             logger.warning('Login failed', extra={
                 'username': request.data.get('username'),
-                'ip': request.META.get('REMOTE_ADDR'),
+                'ip': client_ip(request),
                 'status_code': response.status_code
             })
         return response
 
 class CookieTokenRefreshView(TokenRefreshView):
-    """Refreshes the access token using the refresh token from the cookie."""
+    """
+    Refreshes the access token using the refresh token from the cookie. The
+    refresh token is rotated: the one sent is revoked and a new one is set.
+    """
     permission_classes = [AllowAny]
     authentication_classes = []
+    serializer_class = CookieTokenRefreshSerializer
+
     def post(self, request, *args, **kwargs):
         logger.info('Token refresh attempt', extra={
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
         
         refresh_token = request.COOKIES.get(settings.SIMPLE_JWT["AUTH_COOKIE_REFRESH"])
         if not refresh_token:
             logger.warning('Token refresh failed - no refresh token', extra={
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
             return Response({"error": "No refresh token"}, status=401)
 
@@ -93,37 +149,62 @@ class CookieTokenRefreshView(TokenRefreshView):
                 samesite=settings.SIMPLE_JWT["AUTH_COOKIE_SAMESITE"],
             )
             del response.data["access"]
+            if "refresh" in response.data:
+                response.set_cookie(
+                    settings.SIMPLE_JWT["AUTH_COOKIE_REFRESH"],
+                    response.data["refresh"],
+                    max_age=7 * 24 * 3600,
+                    httponly=True,
+                    secure=settings.SIMPLE_JWT["AUTH_COOKIE_SECURE"],
+                    samesite=settings.SIMPLE_JWT["AUTH_COOKIE_SAMESITE"],
+                )
+                del response.data["refresh"]
             logger.info('Token refresh successful', extra={
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
         else:
             logger.warning('Token refresh failed', extra={
-                'ip': request.META.get('REMOTE_ADDR'),
+                'ip': client_ip(request),
                 'status_code': response.status_code
             })
 
         return response
 
 class LogoutView(APIView):
-    """Clears authentication cookies on logout."""
+    """Revokes the refresh token and clears authentication cookies on logout."""
     permission_classes = [AllowAny]
     authentication_classes = []
     def post(self, request):
         logger.info('Logout attempt', extra={
             'user_id': request.user.id if request.user.is_authenticated else None,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
-        
+
+        refresh_token = request.COOKIES.get(settings.SIMPLE_JWT["AUTH_COOKIE_REFRESH"])
+        if refresh_token:
+            try:
+                revocation.revoke(RefreshToken(refresh_token))
+            except TokenError:
+                # Expired or invalid, it cannot be used anyway
+                pass
+
         response = Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
         response.delete_cookie(settings.SIMPLE_JWT["AUTH_COOKIE"])
         response.delete_cookie(settings.SIMPLE_JWT["AUTH_COOKIE_REFRESH"])
         
         logger.info('Logout successful', extra={
             'user_id': request.user.id if request.user.is_authenticated else None,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
         return response
 
+class PasswordPoolStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """Password hashing pool counters of the process serving the request: wait and hash times in ms (staff only)."""
+        return Response(passwords.stats())
+
 class SignupAPIView(APIView):
     permission_classes = [AllowAny]
     authentication_classes = []
@@ -132,16 +213,29 @@ class SignupAPIView(APIView):
         logger.info('Signup attempt', extra={
             'username': request.data.get('username'),
             'email': request.data.get('email'),
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
         
         serializer = SignupSerializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
+            try:
+                user = serializer.save()
+            except HashPoolBusy:
+                logger.warning('Signup failed - password hashing pool saturated', extra={
+                    'username': request.data.get('username'),
+                    'ip': client_ip(request)
+                })
+                response = Response(
+                    {"error": "The server is busy. Please try again in a moment."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+                response['Retry-After'] = '1'
+                return response
+            transaction.on_commit(search_cache.invalidate)
             logger.info('Signup successful', extra={
                 'user_id': user.id,
                 'username': user.username,
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
             return Response({'message': 'User created successfully!'}, status=status.HTTP_201_CREATED)
         
@@ -149,7 +243,7 @@ class SignupAPIView(APIView):
             'username': request.data.get('username'),
             'email': request.data.get('email'),
             'errors': serializer.errors,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -160,11 +254,14 @@ class CurrentUserView(APIView):
     def get(self, request):
         logger.info('Current user profile retrieval', extra={
             'user_id': request.user.id,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
         
         try:
-            user_profile = get_object_or_404(UserProfile, user__id=request.user.id)
+            user_profile = get_object_or_404(
+                with_social_counts(UserProfile.objects.select_related('user'), user_ref='user'),
+                user__id=request.user.id,
+            )
             logger.info('Current user profile retrieved successfully', extra={
                 'user_id': request.user.id,
                 'username': request.user.username
@@ -183,7 +280,22 @@ class CurrentUserView(APIView):
     
 class UserProfileView(APIView):
     permission_classes = [AllowAny]  # Allow public access to view profiles
-    
+
+    @staticmethod
+    def etag(user_profile, relationships):
+        """
+        Profiles have no modification time, so the ETag is made from every
+        value UserProfileSerializer shows: they are all on the row already
+        loaded, counts included, and the viewer's friendship status.
+        """
+        user = user_profile.user
+        return conditional.make_etag(
+            'user_profile', user.id, user.username, user.email, user.first_name, user.last_name,
+            user_profile.avatar_hash, user_profile.profile_picture_content_type, user_profile.biography,
+            user_profile.follower_count, user_profile.following_count,
+            relationships.profile_status(user.id),
+        )
+
     def get(self, request, *args, **kwargs):
         """
         Handle GET request to retrieve the user profile by ID.
@@ -192,7 +304,7 @@ class UserProfileView(APIView):
         user_id = request.query_params.get('user_id')
         if not user_id:
             logger.warning('User profile retrieval failed - no user_id provided', extra={
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
             return Response(
                 {"error": "User ID is required as a query parameter"},
@@ -202,17 +314,33 @@ class UserProfileView(APIView):
         logger.info('User profile retrieval by ID', extra={
             'requested_user_id': user_id,
             'requesting_user_id': request.user.id if request.user.is_authenticated else None,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
 
         try:
-            user_profile = get_object_or_404(UserProfile, user__id=user_id)
-            serializer = UserProfileSerializer(user_profile, context={'request': request})
+            user_profile = get_object_or_404(
+                with_social_counts(UserProfile.objects.select_related('user'), user_ref='user'),
+                user__id=user_id,
+            )
+            relationships = Relationships(request.user, [user_profile.user_id])
+            etag = self.etag(user_profile, relationships)
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                logger.info('User profile not modified', extra={
+                    'requested_user_id': user_id,
+                    'requesting_user_id': request.user.id if request.user.is_authenticated else None
+                })
+                return not_modified
+
+            serializer = UserProfileSerializer(
+                user_profile,
+                context={'request': request, 'relationships': relationships},
+            )
             logger.info('User profile retrieved successfully', extra={
                 'requested_user_id': user_id,
                 'requesting_user_id': request.user.id if request.user.is_authenticated else None
             })
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return conditional.add_validators(Response(serializer.data, status=status.HTTP_200_OK), etag)
             
         except Exception as e:
             logger.error('User profile retrieval failed', extra={
@@ -234,7 +362,7 @@ class UserProfileView(APIView):
         username = request.data.get('username')
         if not username:
             logger.warning('User profile retrieval failed - no username provided', extra={
-                'ip': request.META.get('REMOTE_ADDR')
+                'ip': client_ip(request)
             })
             return Response(
                 {"error": "Username is required in request body"},
@@ -244,11 +372,14 @@ class UserProfileView(APIView):
         logger.info('User profile retrieval by username', extra={
             'requested_username': username,
             'requesting_user_id': request.user.id if request.user.is_authenticated else None,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
 
         try:
-            user_profile = get_object_or_404(UserProfile, user__username=username)
+            user_profile = get_object_or_404(
+                with_social_counts(UserProfile.objects.select_related('user'), user_ref='user'),
+                user__username=username,
+            )
             serializer = UserProfileSerializer(user_profile, context={'request': request})
             logger.info('User profile retrieved successfully', extra={
                 'requested_username': username,
@@ -275,7 +406,7 @@ class UserProfileView(APIView):
         """
         logger.info('User profile update attempt', extra={
             'user_id': request.user.id,
-            'ip': request.META.get('REMOTE_ADDR')
+            'ip': client_ip(request)
         })
 
         try:
@@ -287,11 +418,13 @@ class UserProfileView(APIView):
             return Response({"detail": "User profile not found."}, status=status.HTTP_404_NOT_FOUND)
 
         # Filter the request data to only include allowed fields
-        allowed_fields = ['username', 'first_name', 'last_name', 'profile_picture', 'profile_picture_content_type', 'biography']
+        allowed_fields = ['username', 'first_name', 'last_name', 'profile_picture', 'biography']
         filtered_data = {k: v for k, v in request.data.items() if k in allowed_fields}
 
-        # Update user fields
+        # Update user fields. request.user may come from the per-process user
+        # cache and be a little out of date, so only the changed names are saved.
         user = request.user
+        renamed = []
         if 'username' in filtered_data:
             new_username = filtered_data['username']
             if User.objects.filter(username=new_username).exclude(id=user.id).exists():
@@ -305,16 +438,27 @@ class UserProfileView(APIView):
                 )
             user.username = new_username
             filtered_data.pop('username')
-        if 'first_name' in filtered_data:
-            user.first_name = filtered_data.pop('first_name')
-        if 'last_name' in filtered_data:
-            user.last_name = filtered_data.pop('last_name')
-        user.save()
+            renamed.append('username')
+        for field in ('first_name', 'last_name'):
+            if field in filtered_data:
+                setattr(user, field, filtered_data.pop(field))
+                renamed.append(field)
+        if renamed:
+            user.save(update_fields=renamed)
+            # Cached user search results and comment ETags may reflect the old name
+            transaction.on_commit(search_cache.invalidate)
+            transaction.on_commit(conditional.users_changed)
 
-        # Update profile fields
+        # Update profile fields. A new picture is stored while validating, and
+        # its follow-up work (see store_upload) runs once the profile is saved.
         serializer = UserProfileSerializer(user_profile, data=filtered_data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
+        with transaction.atomic():
+            valid = serializer.is_valid()
+            if valid:
+                old_hash = user_profile.avatar_hash
+                serializer.save()
+                replaced(old_hash, user_profile.avatar_hash)
+        if valid:
             logger.info('User profile updated successfully', extra={
                 'user_id': request.user.id,
                 'updated_fields': list(filtered_data.keys())
@@ -325,4 +469,142 @@ class UserProfileView(APIView):
             'user_id': request.user.id,
             'errors': serializer.errors
         })
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class ProfilePictureView(APIView):
+    """
+    Profile picture upload for the logged-in user, streamed to a temporary
+    file in chunks instead of being sent as base64 inside JSON, so memory use
+    does not grow with the size of the picture. The request body is read here,
+    never by DRF's parsers.
+    """
+
+    def put(self, request, *args, **kwargs):
+        """
+        Upload a picture as the raw request body.
+
+        Headers:
+        - Content-Type: image/jpeg, image/png, image/gif or image/webp
+        - Content-Length: size of the picture, at most AVATAR_MAX_UPLOAD_SIZE
+        """
+        content_type = request.content_type.split(';')[0].strip()
+        if content_type not in EXTENSIONS:
+            return Response(
+                {"error": f"Content-Type must be one of: {', '.join(EXTENSIONS)}"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if content_length <= 0:
+            return Response({"error": "Content-Length is required"}, status=status.HTTP_411_LENGTH_REQUIRED)
+
+        try:
+            upload = receive_raw_upload(request._request, content_length)
+        except UploadTooLarge as e:
+            logger.warning('Profile picture upload failed - too large', extra={
+                'user_id': request.user.id,
+                'content_length': content_length
+            })
+            return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        return self.store(request, upload)
+
+    def post(self, request, *args, **kwargs):
+        """
+        Upload a picture as the `profile_picture` file of a multipart/form-data
+        body, at most AVATAR_MAX_UPLOAD_SIZE bytes.
+        """
+        if not request.content_type.startswith('multipart/form-data'):
+            return Response(
+                {"error": "Content-Type must be multipart/form-data"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        handler = AvatarUploadHandler(request._request)
+        request._request.upload_handlers = [handler]
+        upload = request.FILES.get('profile_picture')
+        if handler.too_large:
+            logger.warning('Profile picture upload failed - too large', extra={
+                'user_id': request.user.id,
+                'received': handler.received
+            })
+            return Response(
+                {"error": f"Uploads are limited to {max_upload_size()} bytes"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if upload is None:
+            return Response({"error": "profile_picture file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        return self.store(request, upload)
+
+    def store(self, request, upload):
+        try:
+            with transaction.atomic():
+                avatar_hash, content_type = store_upload(upload)
+                old_hash = (
+                    UserProfile.objects.select_for_update().filter(user=request.user)
+                    .values_list('avatar_hash', flat=True).first()
+                )
+                updated = UserProfile.objects.filter(user=request.user).update(
+                    avatar_hash=avatar_hash,
+                    profile_picture_content_type=content_type,
+                )
+                replaced(old_hash, avatar_hash)
+        except InvalidImage as e:
+            logger.warning('Profile picture upload failed - invalid image', extra={
+                'user_id': request.user.id,
+                'error': str(e)
+            })
+            return Response({"error": f"Not a valid image: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        finally:
+            upload.close()
+
+        if not updated:
+            return Response({"detail": "User profile not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        logger.info('Profile picture uploaded', extra={
+            'user_id': request.user.id,
+            'avatar_hash': avatar_hash,
+            'content_type': content_type
+        })
+        user_profile = with_social_counts(
+            UserProfile.objects.select_related('user'), user_ref='user'
+        ).get(user=request.user)
+        serializer = UserProfileSerializer(user_profile, context={'request': request})
+        return Response(serializer.data)
+
+class AvatarView(APIView):
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, avatar_hash, extension, size=None):
+        """
+        Serve a profile picture or one of its resized variants. The URL is
+        derived from the image content, so the response never changes and is
+        cacheable forever.
+
+        A variant that is not made yet (the upload is still being processed,
+        or the picture predates variants) is queued and the client is sent to
+        the original for now, with a response that is not cached.
+        """
+        if size is not None and (size not in VARIANT_SIZES or extension != VARIANT_EXTENSION):
+            return Response({"error": "Avatar not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        etag = f'"{avatar_hash}_{size}"' if size else f'"{avatar_hash}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponseNotModified()
+        else:
+            try:
+                avatar = open_avatar(avatar_hash, extension, size)
+            except FileNotFoundError:
+                original = find_original(avatar_hash) if size and HASH_RE.match(avatar_hash) else None
+                if original is None:
+                    return Response({"error": "Avatar not found"}, status=status.HTTP_404_NOT_FOUND)
+                original_type = content_type_for(original.rsplit('.', 1)[1])
+                make_variants_in_background(avatar_hash, original_type)
+                response = HttpResponseRedirect(original_url(avatar_hash, original_type))
+                response['Cache-Control'] = 'no-cache'
+                return response
+            response = FileResponse(avatar, content_type=content_type_for(extension))
+        response['ETag'] = etag
+        response['Cache-Control'] = CACHE_CONTROL
+        return response
@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'api.apps.ApiConfig',
@@ -102,9 +103,56 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,  # Number of items per page
 }
 
+# Authors with more followers than this are not fanned out into home timelines;
+# their friends-only posts are merged in at read time instead.
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS', 5000))
+
+# Shared cache for the follow graph and other hot lookups. Use a backend shared
+# between workers (e.g. Redis or Memcached) in production so invalidations reach
+# every process; the local-memory default only suits a single worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+# Users authenticated by CookieJWTAuthentication are kept in memory this many
+# seconds per process (api.user_cache). Saving a user clears its entry in every
+# process that shares CACHES, where a version per user is kept
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Follower/following id sets, shown as friendship statuses, are also refreshed
+# after this many seconds. Access to friends-only entries is always checked
+# against the database.
+SOCIAL_GRAPH_CACHE_TIMEOUT = 300
+
+# Search queries shorter than this are matched as substrings instead of full-text
+SEARCH_MIN_FULL_TEXT_LENGTH = 3
+
+# Blog entry search engine: PostgreSQL full-text search, or the in-process
+# BM25 index (api.search.InvertedIndexSearchBackend). The index is loaded
+# from SEARCH_INDEX_PATH when present, see the build_search_index command.
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'api.search.DatabaseSearchBackend')
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', os.path.join(BASE_DIR, 'search_index.json.gz'))
+# Each process's in-process index catches up with writes from other processes as
+# soon as they happen, and at least this often (seconds) for bulk updates
+SEARCH_INDEX_SYNC_INTERVAL = 30
+
+# Search results (capped count mode) are cached for this many seconds; new or
+# deleted posts and renamed users invalidate them right away
+SEARCH_CACHE_TIMEOUT = 60
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Threads per process making resized profile picture variants (api.avatars);
+# 0 makes them during the upload request
+AVATAR_WORKERS = 2
+
+# Largest profile picture accepted by /api/profile/picture/, in bytes
+AVATAR_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -157,6 +205,29 @@ DATABASES = {
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
+# Passwords are checked on a small process pool (api.passwords) instead of in the web worker
+AUTHENTICATION_BACKENDS = ['api.authentication.PooledModelBackend']
+
+# Hashing processes per web process (0 hashes inline), and how many requests
+# may wait for one before logins and signups get a 503. The pending count is
+# kept in CACHES, so it covers every web process only with a shared cache.
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_MAX_PENDING = 8
+
+# Logins are refused with a 429, before any hashing, after this many failures
+# for one username or from one address within the window (seconds)
+LOGIN_MAX_FAILURES_PER_USERNAME = 5
+LOGIN_MAX_FAILURES_PER_IP = 20
+LOGIN_FAILURE_WINDOW = 15 * 60
+
+# Reverse proxies in front of the app. Each appends the address it was
+# connected from to CLIENT_IP_HEADER, and the client address used by the login
+# throttle and in logs is then read from there (api.client_ip). 0 uses
+# REMOTE_ADDR: set it only where that many proxies are really deployed and
+# gunicorn cannot be reached around them, or clients can forge their address.
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+CLIENT_IP_HEADER = 'HTTP_X_FORWARDED_FOR'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -211,5 +282,11 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
+    # Enforced by api.revocation (see CookieTokenRefreshSerializer), not by
+    # simplejwt's token_blacklist app
     'BLACKLIST_AFTER_ROTATION': True,
-}
\ No newline at end of file
+}
+
+# Each worker checks for refresh tokens revoked by other workers at most this
+# often, in seconds; run purge_revoked_tokens daily to drop expired ones
+TOKEN_REVOCATION_SYNC_INTERVAL = 10
\ No newline at end of file